@@ -1,17 +1,21 @@
 import os
 import sys
-from docx import Document
 from sentence_transformers import SentenceTransformer
 import numpy as np
 import faiss
-import opik
-from opik.integrations.openai import track_openai
-from opik import Opik, opik_context
 from openai import OpenAI
 import openai
 from dotenv import load_dotenv
 import json
 from Class_RetrievedClause import RetrievedClause
+from document import load_document
+from embedding_cache import (DEFAULT_INDEX_CACHE_DIR, load_document_index, load_template_embeddings,
+                             save_document_index, units_sha256)
+from llm_executor import DEFAULT_MAX_CONCURRENCY, run_concurrently, sum_token_usage
+from prompt_registry import MISSING_PROMPT, SYSTEM_PROMPT, get_prompt_registry
+from score_thresholds import score_answer
+from token_budget import trim_retrieved_context
+from tracing import create_tracer
 from pathlib import Path
 current_dir = os.path.dirname(__file__)
 project_root = os.path.abspath(os.path.join(current_dir, "../../"))
@@ -22,18 +26,11 @@ if project_root not in sys.path:
 from utils import initialize_openai_client, initialize_opik_client
 from config import SAMPLE_DOC, MODEL_NAME, DOC_PATH, OPENAI_MODEL_MISSING, RETRIEVED_K, PROCESS_STEP1_JSON, BASEDIR
 
-EMBEDDING_MODEL = SentenceTransformer(MODEL_NAME)
-
 load_dotenv()
 
-
-def load_paragraphs(file_path):
-    if not os.path.exists(file_path):
-        raise FileNotFoundError(f"File not found: {file_path}")
-    doc = Document(file_path)
-    # Only keep paragraphs with non-empty text
-    paragraphs = [para.text.strip() for para in doc.paragraphs if para.text.strip()]
-    return paragraphs
+# Who gave a clause its step 1 answer
+LLM_ANSWER = "llm"
+THRESHOLD_ANSWER = "threshold"
 
 
 def extract_clauses_from_json(json_path) -> list[RetrievedClause]:
@@ -61,10 +58,12 @@ def normalize_embeddings(embeddings):
     norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
     return embeddings / norms
 
-def retrieve(query, embedding_model, index, paragraphs, k=3):
-    # Compute and normalize the query embedding
-    query_embedding = embedding_model.encode([query])
-    query_embedding = query_embedding / np.linalg.norm(query_embedding, axis=1, keepdims=True)
+def retrieve(query, embedding_model, index, paragraphs, k=3, query_embedding=None):
+    # Compute and normalize the query embedding, unless a cached one is given
+    if query_embedding is None:
+        query_embedding = embedding_model.encode([query])
+        query_embedding = query_embedding / np.linalg.norm(query_embedding, axis=1, keepdims=True)
+    query_embedding = np.asarray(query_embedding).reshape(1, -1)
     # Perform search on the FAISS index
     scores, indices = index.search(np.array(query_embedding, dtype=np.float32), k)
     retrieved = []
@@ -75,8 +74,71 @@ def retrieve(query, embedding_model, index, paragraphs, k=3):
     return retrieved
 
 
+def choose_k(scores, min_score=None, max_drop=None):
+    """
+    Adaptive top-k: the number of hits (sorted by descending score) worth pasting into a prompt.
+    Hits are kept while they score at least min_score and lose at most max_drop (relative) against
+    the top hit, so a clear best match isn't padded with noise. The top hit is always kept.
+    """
+    if len(scores) == 0:
+        return 0
+    k = 1
+    for score in scores[1:]:
+        if min_score is not None and score < min_score:
+            break
+        if max_drop is not None and score < scores[0] * (1 - max_drop):
+            break
+        k += 1
+    return k
+
+
+def retrieve_batch(clauses, embedding_model, index, paragraphs, k=3, query_embeddings=None, min_score=None,
+                   max_drop=None):
+    """
+    Retrieves the top-k paragraphs for all clauses with one encode call and one FAISS search.
 
-def save_retrieved_clauses_to_json(retrieved_clauses_list, filename="retrieved_clauses.json"):
+    Parameters:
+    - clauses (list[RetrievedClause]): The queries; their retrieved_clauses are filled in place.
+    - query_embeddings (np.ndarray): Optional normalized query embeddings (one row per clause),
+      e.g. from the template embedding cache. Computed in a single batch if not given.
+    - min_score / max_drop (float): Adaptive top-k (see choose_k); k is then the maximum per clause.
+      The number kept is recorded in clause.retrieved_k.
+
+    Returns:
+    - The clauses list.
+    """
+    if not clauses:
+        return clauses
+    if query_embeddings is None:
+        query_embeddings = normalize_embeddings(np.array(embedding_model.encode([clause.input_clause for clause in clauses])))
+    scores, indices = index.search(np.ascontiguousarray(query_embeddings, dtype=np.float32), k)
+
+    for clause, clause_scores, clause_indices in zip(clauses, scores, indices):
+        # FAISS pads with -1 when the index holds fewer than k paragraphs
+        retrieved = [(paragraphs[idx], score) for score, idx in zip(clause_scores, clause_indices) if idx >= 0]
+        if min_score is not None or max_drop is not None:
+            retrieved = retrieved[:choose_k([score for _, score in retrieved], min_score, max_drop)]
+        clause.retrieved_clauses = retrieved
+        clause.retrieved_k = len(retrieved)
+    return clauses
+
+
+def retrieval_summary(clauses):
+    """Distribution of the number of paragraphs retrieved per clause, for execuation_details.json."""
+    ks = [clause.retrieved_k if clause.retrieved_k is not None else len(clause.retrieved_clauses)
+          for clause in clauses]
+    if not ks:
+        return {"clauses": 0, "mean_k": 0, "k_counts": {}}
+    return {
+        "clauses": len(ks),
+        "mean_k": round(sum(ks) / len(ks), 2),
+        "k_counts": {str(k): ks.count(k) for k in sorted(set(ks))},
+    }
+
+
+
+def retrieved_clauses_to_json_data(retrieved_clauses_list):
+    """Converts RetrievedClause objects into the JSON structure used by the step 1 output file."""
     json_data = []
 
     for clause_obj in retrieved_clauses_list:
@@ -85,8 +147,15 @@ def save_retrieved_clauses_to_json(retrieved_clauses_list, filename="retrieved_c
             "clause_subname": clause_obj.clause_subname,
             "input_clause": clause_obj.input_clause,
             "retrieved_clauses": [{"clause": c, "confidence": float(conf)} for c, conf in clause_obj.retrieved_clauses],
-            "answer": clause_obj.answer
+            "retrieved_k": clause_obj.retrieved_k,
+            "answer": clause_obj.answer,
+            "answer_source": clause_obj.answer_source
         })
+    return json_data
+
+
+def save_retrieved_clauses_to_json(retrieved_clauses_list, filename="retrieved_clauses.json"):
+    json_data = retrieved_clauses_to_json_data(retrieved_clauses_list)
 
     if isinstance(filename, tuple):
         filename = filename[0]
@@ -99,32 +168,46 @@ def save_retrieved_clauses_to_json(retrieved_clauses_list, filename="retrieved_c
 
 
 
-def get_openai_response(clause:RetrievedClause, openai_client, thread_id, opik_client, OPENAI_MODEL):
+def build_request(clause: RetrievedClause, OPENAI_MODEL, prompts=None, context_token_budget=None):
+    """
+    Returns the chat.completions request body that asks whether a template clause is
+    missing or entailed, given its retrieved paragraphs. Used for direct calls and batch files.
+    With context_token_budget, the prompt only gets the retrieved paragraphs that fit into it
+    (token_budget.trim_retrieved_context); clause.retrieved_clauses is left as it is.
+    """
+    prompts = prompts or get_prompt_registry()
+    clause = trim_retrieved_context(clause, context_token_budget, OPENAI_MODEL)
+    context = prompts.format(MISSING_PROMPT, input_clause=clause.input_clause,
+                             retrieved_clauses=clause.return_retrievedClauses())
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": prompts.format(SYSTEM_PROMPT)},
+            {"role": "user", "content": context}
+        ],
+        "seed": 42,
+    }
+
+
+def get_openai_response(clause:RetrievedClause, openai_client, thread_id, tracer, OPENAI_MODEL, prompts=None,
+                        context_token_budget=None):
     """
     Gets a response from OpenAI using the input clause and retrieved clauses with confidence scores.
 
     Parameters:
     - input_clause (str): The queried clause.
     - retrieved_clauses (list of tuples): List of (clause, confidence) tuples.
+    - tracer (TraceExporter): Records the call off the request path, tracing is skipped if None.
+    - prompts (PromptRegistry): Source of the Opik prompts, defaults to the process-wide registry.
+    - context_token_budget (int): Token budget of the retrieved paragraphs in the prompt, None for all of them.
 
     Returns:
     - str: The response from OpenAI.
     """
-    client = opik_client
-    retrieved_clause = clause.return_retrievedClauses()
-    prompt = client.get_prompt(name="V3 - Missing Clauses - Zero-shot")
-    context = prompt.format(input_clause=clause.input_clause,
-                            retrieved_clauses=retrieved_clause)
-
+    request = build_request(clause, OPENAI_MODEL, prompts, context_token_budget)
+    context = request["messages"][1]["content"]
 
-    response = openai_client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": client.get_prompt(name="V1 - System Prompt").format()},
-            {"role": "user", "content": context}
-        ],
-        seed=42
-    )
+    response = openai_client.chat.completions.create(**request)
 
     content = response.choices[0].message.content  #.strip()
 
@@ -139,19 +222,90 @@ def get_openai_response(clause:RetrievedClause, openai_client, thread_id, opik_c
 
     # Optionally, return the token usage along with the content
 
-    trace = client.trace(
-        name=f'{clause.clause_name} - {clause.clause_subname}',
-        input=context,
-        output=content,
-        thread_id=thread_id
-    )
+    if tracer is not None:
+        tracer.trace(
+            name=f'{clause.clause_name} - {clause.clause_subname}',
+            input=context,
+            output=content,
+            thread_id=thread_id
+        )
 
     return content, input_tokens, output_tokens, total_tokens
 
 
 
-def initialize_faiss_index(doc_path, embedding_model):
-    paragraphs = load_paragraphs(doc_path)
+def top_score(clause: RetrievedClause):
+    """Similarity of the best retrieved paragraph, None if nothing was retrieved."""
+    if not clause.retrieved_clauses:
+        return None
+    return max(float(score) for _, score in clause.retrieved_clauses)
+
+
+def threshold_answer(clause: RetrievedClause, entail_above=None, missing_below=None):
+    """
+    Decides step 1 from the retrieval score alone when it is unambiguous.
+
+    Returns:
+    - "entailment" if the best paragraph scores at least entail_above, "missing" if it scores
+      below missing_below (or nothing was retrieved), None if the LLM has to decide.
+    """
+    return score_answer(top_score(clause), entail_above, missing_below)
+
+
+def classify_clause(clause: RetrievedClause, openai_client, thread_id, tracer, OPENAI_MODEL, prompts=None,
+                    entail_above=None, missing_below=None, context_token_budget=None):
+    """
+    Step 1 for one clause: the threshold answer if the score is outside the ambiguous band,
+    else get_openai_response(). Sets clause.answer_source.
+
+    Returns:
+    - The get_openai_response() tuple; (answer, 0, 0, 0) if no LLM call was needed.
+    """
+    answer = threshold_answer(clause, entail_above, missing_below)
+    if answer is not None:
+        clause.answer_source = THRESHOLD_ANSWER
+        return answer, 0, 0, 0
+    clause.answer_source = LLM_ANSWER
+    return get_openai_response(clause, openai_client, thread_id, tracer, OPENAI_MODEL, prompts, context_token_budget)
+
+
+def answer_summary(clauses):
+    """LLM calls made and saved by the score thresholds in step 1, for execuation_details.json."""
+    by_threshold = [clause for clause in clauses if clause.answer_source == THRESHOLD_ANSWER]
+    return {
+        "llm_calls": sum(1 for clause in clauses if clause.answer_source == LLM_ANSWER),
+        "calls_saved": len(by_threshold),
+        "auto_entailment": sum(1 for clause in by_threshold if clause.answer == "entailment"),
+        "auto_missing": sum(1 for clause in by_threshold if clause.answer == "missing"),
+    }
+
+
+def initialize_faiss_index(doc_path, embedding_model, model_name=None, cache_dir=DEFAULT_INDEX_CACHE_DIR,
+                           document=None, units=None):
+    """
+    Builds the FAISS index over the document's paragraphs.
+    If model_name is given, the index is read from / stored in the per-document cache.
+
+    Parameters:
+    - document (DocumentIR): The already parsed document; parsed from doc_path if not given.
+    - units (list[str]): Retrieval units to index instead of the paragraphs, e.g. the texts
+      of segmentation.segment_document(). The cache is then keyed by the units' content.
+
+    Returns:
+    - Tuple (index, paragraphs).
+    """
+    if units is not None:
+        doc_hash = units_sha256(units)
+    else:
+        doc_hash = document.sha256 if document is not None else None
+    if model_name and cache_dir:
+        cached = load_document_index(doc_path, model_name, cache_dir, doc_hash)
+        if cached is not None:
+            index, paragraphs, _ = cached
+            print(f"FAISS index loaded from cache with {index.ntotal} vectors.")
+            return index, paragraphs
+
+    paragraphs = list(units) if units is not None else (document or load_document(doc_path)).texts()
 
     # Compute embeddings
     print("Computing embeddings for document paragraphs...")
@@ -164,50 +318,112 @@ def initialize_faiss_index(doc_path, embedding_model):
     index.add(np.array(normalized_paragraph_embeddings, dtype=np.float32))
 
     print(f"FAISS index built with {index.ntotal} vectors.")
+    if model_name and cache_dir:
+        save_document_index(doc_path, model_name, paragraphs, normalized_paragraph_embeddings, index, cache_dir,
+                            doc_hash)
     return index, paragraphs
 
 
+def template_similarity(index, template_path, embedding_model, model_name=None):
+    """
+    Cosine similarity of every indexed paragraph with every template clause.
+    If model_name is given, the template clause embeddings are read from the on-disk cache.
+
+    Returns:
+    - np.ndarray of shape (paragraphs, template clauses), rows in the order of the index.
+    """
+    inputs = [clause.input_clause for clause in extract_clauses_from_json(template_path)]
+    if model_name:
+        template_embeddings = load_template_embeddings(template_path, inputs, embedding_model, model_name)
+    else:
+        template_embeddings = normalize_embeddings(np.array(embedding_model.encode(inputs)))
+    # The flat index stores the normalized paragraph embeddings themselves
+    paragraph_embeddings = index.reconstruct_n(0, index.ntotal)
+    return paragraph_embeddings @ np.asarray(template_embeddings, dtype=np.float32).T
+
+
+def retrieve_template_clauses(index, paragraphs, template_path, embedding_model, retrieved_k=3, model_name=None,
+                              min_score=None, max_drop=None):
+    """
+    Loads the template clauses and retrieves the best matching document paragraphs for each.
+    If model_name is given, the template clause embeddings are read from the on-disk cache.
+    With min_score or max_drop, k is chosen per clause (see choose_k) up to retrieved_k.
+
+    Returns:
+    - List of RetrievedClause objects with retrieved_clauses filled in.
+    """
+    retrieved_clauses_list = extract_clauses_from_json(template_path)
+
+    template_embeddings = None
+    if model_name:
+        template_embeddings = load_template_embeddings(
+            template_path, [clause.input_clause for clause in retrieved_clauses_list], embedding_model, model_name
+        )
+
+    return retrieve_batch(retrieved_clauses_list, embedding_model, index, paragraphs, k=retrieved_k,
+                          query_embeddings=template_embeddings, min_score=min_score, max_drop=max_drop)
+
+
+def identify_missing_clauses(index, paragraphs, template_path, embedding_model, openai_client, tracer,
+                             openai_model, retrieved_k=3, thread_id=None, model_name=None,
+                             max_concurrency=DEFAULT_MAX_CONCURRENCY, prompts=None, entail_above=None,
+                             missing_below=None):
+    """
+    Runs step 1: retrieves the best matching paragraphs for every template clause
+    and lets the LLM decide whether the clause is missing or entailed.
+    Up to max_concurrency LLM requests are sent at the same time. Each clause goes through
+    classify_clause, so one whose best score is at least entail_above or below missing_below
+    is answered by score_thresholds.score_answer without a call, like in the pipeline.
+
+    Returns:
+    - Tuple (retrieved_clauses_list, token_usage) where token_usage is a dict with
+      input_tokens, output_tokens and total_tokens summed over all calls.
+    """
+    retrieved_clauses_list = retrieve_template_clauses(
+        index, paragraphs, template_path, embedding_model, retrieved_k, model_name
+    )
+
+    responses = run_concurrently(
+        lambda retrieved_clause: classify_clause(retrieved_clause, openai_client, thread_id, tracer,
+                                                 openai_model, prompts, entail_above, missing_below),
+        retrieved_clauses_list,
+        max_concurrency,
+    )
+    for retrieved_clause, (content, _, _, _) in zip(retrieved_clauses_list, responses):
+        retrieved_clause.answer = content
+
+    return retrieved_clauses_list, sum_token_usage(responses)
+
+
 # Example usage
 if __name__ == "__main__":
     # INITIALIZE
     print(DOC_PATH)
-    index, paragraphs = initialize_faiss_index(DOC_PATH, EMBEDDING_MODEL)
+    EMBEDDING_MODEL = SentenceTransformer(MODEL_NAME)
+    index, paragraphs = initialize_faiss_index(DOC_PATH, EMBEDDING_MODEL, MODEL_NAME)
     openai_client = initialize_openai_client()
     #current_directory = os.path.dirname(__file__)
     json_file_path =  BASEDIR / "data/V3 - Template Clause MLL.json"
     #json_file_path = "data/V3 - Template Clause MLL.json"
-    retrieved_clauses_list = extract_clauses_from_json(json_file_path)
-
-    for clause_query in retrieved_clauses_list:
-        similar_clauses = retrieve(clause_query.input_clause, EMBEDDING_MODEL, index, paragraphs, k=RETRIEVED_K)
-        clause_query.retrieved_clauses = similar_clauses
 
     thread_id = f"TEST Identify Missing / Entailment - 1_V3_RAG - {SAMPLE_DOC}"
-    opik_client = initialize_opik_client()
-
-    input_tokens = 0
-    output_tokens = 0
-    total_tokens = 0
+    tracer = create_tracer("opik")
 
-    for retrieved_clause in retrieved_clauses_list:
-        content, input_tokens, output_tokens, total_tokens = get_openai_response(retrieved_clause, openai_client, thread_id, opik_client,  OPENAI_MODEL_MISSING)
-        retrieved_clause.answer = content
-        output_tokens += output_tokens
-        input_tokens += input_tokens
-        total_tokens += total_tokens
+    retrieved_clauses_list, token_usage = identify_missing_clauses(
+        index, paragraphs, json_file_path, EMBEDDING_MODEL, openai_client, tracer,
+        OPENAI_MODEL_MISSING, retrieved_k=RETRIEVED_K, thread_id=thread_id, model_name=MODEL_NAME
+    )
 
-    opik_client.end()
+    tracer.close()
     save_retrieved_clauses_to_json(retrieved_clauses_list, PROCESS_STEP1_JSON)
 
     execution_details_path = BASEDIR / 'V3_Frontend/temp/execuation_details.json'
     with open(execution_details_path, 'r+', encoding='utf-8') as file:
         execution_details = json.load(file)
-        execution_details['steps'][0]['input_tokens'] = input_tokens
-        execution_details['steps'][0]['output_tokens'] = output_tokens
-        execution_details['steps'][0]['total_tokens'] = total_tokens
+        execution_details['steps'][0].update(token_usage)
         file.seek(0)
         json.dump(execution_details, file, indent=4)
         file.truncate()
 
 
-    print("JSON file saved successfully.")
\ No newline at end of file
+    print("JSON file saved successfully.")
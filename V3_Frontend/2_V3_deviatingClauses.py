@@ -2,8 +2,6 @@ from Class_RetrievedClause import RetrievedClause
 import json
 import os
 import sys
-import opik
-from opik import opik_context
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -12,10 +10,19 @@ project_root = os.path.abspath(os.path.join(current_dir, "../../"))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 from utils import initialize_openai_client, initialize_opik_client
+from llm_executor import DEFAULT_MAX_CONCURRENCY, run_concurrently, sum_token_usage
+from prompt_registry import DEVIATING_PROMPT, SYSTEM_PROMPT, get_prompt_registry
+from tracing import create_tracer
 
 from config import OPENAI_MODEL_DEVIATING, SAMPLE_DOC, PROCESS_STEP1_JSON, PROCESS_STEP2_JSON, BASEDIR
 
-SAMPLE = SAMPLE_DOC.split(".")[0]
+SAMPLE = SAMPLE_DOC.split(".")[0] if SAMPLE_DOC else None
+
+
+def filter_by_answer(data, answer):
+    """Returns the clause dicts whose 'answer' equals the given answer (case-insensitive, stripping spaces)."""
+    return [obj for obj in data if (obj.get("answer") or "").strip().lower() == answer]
+
 
 def filter_missing_answers(input_file: str, output_file=False):
     """
@@ -39,7 +46,7 @@ def filter_missing_answers(input_file: str, output_file=False):
         data = json.load(file)  # Assuming it's a list of dictionaries
 
     # Filter objects where "answer" is "missing" (case-insensitive, stripping spaces)
-    missing_objects = [obj for obj in data if obj.get("answer", "").strip().lower() == "missing"]
+    missing_objects = filter_by_answer(data, "missing")
 
     if output_file:
         os.makedirs(temp_folder, exist_ok=True)
@@ -73,9 +80,7 @@ def filter_entailment_answers(input_file: str, output_file=False):
         data = json.load(file)  # Assuming it's a list of dictionaries
 
     # Filter objects where "answer" is "entailment" (case-insensitive, stripping spaces)
-    entailment_objects = [
-        obj for obj in data if obj.get("answer", "").strip().lower() == "entailment"
-    ]
+    entailment_objects = filter_by_answer(data, "entailment")
 
     if output_file:
         os.makedirs(temp_folder, exist_ok=True)
@@ -85,36 +90,44 @@ def filter_entailment_answers(input_file: str, output_file=False):
 
     return len(data), len(entailment_objects)
 
-@opik.track(name="Check Deviating Clauses")
-def get_openai_response(clause:RetrievedClause, openai_client, OPENAI_MODEL="gpt-4o-2024-08-06"):
+def build_request(clause: RetrievedClause, OPENAI_MODEL="gpt-4o-2024-08-06", prompts=None):
+    """
+    Returns the chat.completions request body that asks how the counterparty's best matching
+    clause deviates from the template clause. Used for direct calls and batch files.
+    """
+    prompts = prompts or get_prompt_registry()
+    formatted_prompt = prompts.format(DEVIATING_PROMPT, name=clause.clause_name, subname=clause.clause_subname,
+                                      template_clause=clause.input_clause,
+                                      counterparty_clause=clause.get_best_clause())
+    return {
+        "model": OPENAI_MODEL,
+        "messages": [
+            {"role": "system", "content": prompts.format(SYSTEM_PROMPT)},
+            {"role": "user", "content": formatted_prompt}
+        ],
+        "seed": 42,
+    }
+
+
+def get_openai_response(clause:RetrievedClause, openai_client, OPENAI_MODEL="gpt-4o-2024-08-06", thread_id=None,
+                        prompts=None, tracer=None):
     """
     Gets a response from OpenAI using the input clause and retrieved clauses with confidence scores.
 
     Parameters:
     - input_clause (str): The queried clause.
     - retrieved_clauses (list of tuples): List of (clause, confidence) tuples.
+    - prompts (PromptRegistry): Source of the Opik prompts, defaults to the process-wide registry.
+    - tracer (TraceExporter): Records the call as "Check Deviating Clauses", tracing is skipped if None.
 
     Returns:
     - str: The response from OpenAI.
     """
-    thread_id = f"V3 - 2_V3_deviatingClauses - {SAMPLE_DOC}"
-    client = initialize_opik_client()
-    prompt = client.get_prompt(name="V3 - Deviating Clauses - Zero-shot")
-    formatted_prompt = prompt.format(name=obj.clause_name, subname=obj.clause_subname, template_clause=obj.input_clause,
-                                     counterparty_clause=obj.get_best_clause())
-
-    opik_context.update_current_trace(
-        thread_id=thread_id
-    )
+    thread_id = thread_id or f"V3 - 2_V3_deviatingClauses - {SAMPLE_DOC}"
+    request = build_request(clause, OPENAI_MODEL, prompts)
+    formatted_prompt = request["messages"][1]["content"]
 
-    response = openai_client.chat.completions.create(
-        model=OPENAI_MODEL,
-        messages=[
-            {"role": "system", "content": client.get_prompt(name="V1 - System Prompt").format()},
-            {"role": "user", "content": formatted_prompt}
-        ],
-        seed=42
-    )
+    response = openai_client.chat.completions.create(**request)
 
     content = response.choices[0].message.content  #.strip()
     # Extract token usage
@@ -126,6 +139,9 @@ def get_openai_response(clause:RetrievedClause, openai_client, OPENAI_MODEL="gpt
     print(f"Output Tokens: {output_tokens}")
     print(f"Total Tokens: {total_tokens}")
 
+    if tracer is not None:
+        tracer.trace(name="Check Deviating Clauses", input=formatted_prompt, output=content, thread_id=thread_id)
+
     # Optionally, return the token usage along with the content
     return content, input_tokens, output_tokens, total_tokens
 
@@ -158,63 +174,75 @@ def write_retrieved_clauses_to_file(retrieved_clauses, file_path):
     return True
 
 
-# When you want to output the file to the default location.
-total_entailment, filtered_entailment = filter_entailment_answers(f'V3_Frontend/{PROCESS_STEP1_JSON}', True)
-#print(f"Total objects: {total_entailment}, Filtered objects (entailment): {filtered_entailment}")
-
-total_missing, filtered_missing = filter_missing_answers(f'V3_Frontend/{PROCESS_STEP1_JSON}', True)
-#print(f"Total objects: {total_missing}, Filtered objects: {filtered_missing}")
+def clauses_from_json_data(clauses_data):
+    """Builds RetrievedClause objects from the JSON structure written by step 1."""
+    retrieved_clause_objects = []
+    for entry in clauses_data:
+        # Initialize the object with only the accepted parameters
+        obj = RetrievedClause(
+            clause_name=entry["clause_name"],
+            clause_subname=entry["clause_subname"],
+            input_clause=entry["input_clause"],
+        )
 
+        obj.set_clauses(entry["retrieved_clauses"])
+        obj.answer = entry["answer"]
+        retrieved_clause_objects.append(obj)
+    return retrieved_clause_objects
 
 
-assert total_missing == total_entailment, "Total has to be equal for both values"
-assert filtered_entailment + filtered_missing == total_entailment, "Both filtered has to be equal to total"
+def identify_deviating_clauses(retrieved_clause_objects, openai_client, openai_model, thread_id=None,
+                               max_concurrency=DEFAULT_MAX_CONCURRENCY, prompts=None, tracer=None):
+    """
+    Runs step 2: asks the LLM for a modified version of every entailed clause,
+    with up to max_concurrency requests in flight.
 
+    Returns:
+    - Dict with input_tokens, output_tokens and total_tokens summed over all calls.
+    """
+    responses = run_concurrently(
+        lambda obj: get_openai_response(obj, openai_client, openai_model, thread_id, prompts, tracer),
+        retrieved_clause_objects,
+        max_concurrency,
+    )
+    for obj, (content, _, _, _) in zip(retrieved_clause_objects, responses):
+        obj.modified_clause = content
+        print(f"Modified Clause: {obj.modified_clause}")
 
+    return sum_token_usage(responses)
 
-with open(f'V3_Frontend/temp/{SAMPLE}-entailment_filtered.json', 'r', encoding='utf-8') as file:
-    clauses_data = json.load(file)
 
-retrieved_clause_objects = []
-for entry in clauses_data:
-    # Initialize the object with only the accepted parameters
-    obj = RetrievedClause(
-        clause_name=entry["clause_name"],
-        clause_subname=entry["clause_subname"],
-        input_clause=entry["input_clause"],
-    )
+if __name__ == "__main__":
+    # When you want to output the file to the default location.
+    total_entailment, filtered_entailment = filter_entailment_answers(f'V3_Frontend/{PROCESS_STEP1_JSON}', True)
+    #print(f"Total objects: {total_entailment}, Filtered objects (entailment): {filtered_entailment}")
 
+    total_missing, filtered_missing = filter_missing_answers(f'V3_Frontend/{PROCESS_STEP1_JSON}', True)
+    #print(f"Total objects: {total_missing}, Filtered objects: {filtered_missing}")
 
-    obj.set_clauses(entry["retrieved_clauses"])
-    #print(entry["answer"])
-    obj.answer = entry["answer"]
-    retrieved_clause_objects.append(obj)
+    assert total_missing == total_entailment, "Total has to be equal for both values"
+    assert filtered_entailment + filtered_missing == total_entailment, "Both filtered has to be equal to total"
 
+    with open(f'V3_Frontend/temp/{SAMPLE}-entailment_filtered.json', 'r', encoding='utf-8') as file:
+        clauses_data = json.load(file)
 
-OPENAI_CLIENT = initialize_openai_client()
+    retrieved_clause_objects = clauses_from_json_data(clauses_data)
 
-output_tokens = 0
-input_tokens = 0
-total_tokens = 0
+    OPENAI_CLIENT = initialize_openai_client()
+    TRACER = create_tracer("opik")
 
-for obj in retrieved_clause_objects:
-    content, input_tokens, output_tokens, total_tokens = get_openai_response(obj, OPENAI_CLIENT, OPENAI_MODEL_DEVIATING)
-    obj.modified_clause = content
-    output_tokens += output_tokens
-    input_tokens += input_tokens
-    total_tokens += total_tokens
-    print(f"Modified Clause: {obj.modified_clause}")
+    token_usage = identify_deviating_clauses(retrieved_clause_objects, OPENAI_CLIENT, OPENAI_MODEL_DEVIATING,
+                                             tracer=TRACER)
+    TRACER.close()
 
-status = write_retrieved_clauses_to_file(retrieved_clause_objects, f'V3_Frontend/{PROCESS_STEP2_JSON}')
+    status = write_retrieved_clauses_to_file(retrieved_clause_objects, f'V3_Frontend/{PROCESS_STEP2_JSON}')
 
-execution_details_path = 'V3_Frontend/temp/execuation_details.json'
-with open(execution_details_path, 'r+', encoding='utf-8') as file:
-    execution_details = json.load(file)
-    execution_details['steps'][1]['input_tokens'] = input_tokens
-    execution_details['steps'][1]['output_tokens'] = output_tokens
-    execution_details['steps'][1]['total_tokens'] = total_tokens # TODO: Change to correct path
-    file.seek(0)
-    json.dump(execution_details, file, indent=4)
-    file.truncate()
+    execution_details_path = 'V3_Frontend/temp/execuation_details.json'
+    with open(execution_details_path, 'r+', encoding='utf-8') as file:
+        execution_details = json.load(file)
+        execution_details['steps'][1].update(token_usage) # TODO: Change to correct path
+        file.seek(0)
+        json.dump(execution_details, file, indent=4)
+        file.truncate()
 
-assert status == True, "File not written successfully"
+    assert status == True, "File not written successfully"
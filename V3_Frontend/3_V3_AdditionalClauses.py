@@ -1,19 +1,21 @@
 from config import OPENAI_MODEL_ADDITIONAL, DOC_PATH
 from dotenv import load_dotenv
 load_dotenv()
-import opik
 import os
 import sys
 import openai
 import json
-import docx2txt
-from config import BASEDIR
+from config import BASEDIR, DEFAULT_CANDIDATE_THRESHOLD
 
 current_dir = os.path.dirname(__file__)
 project_root = os.path.abspath(os.path.join(current_dir, "../../"))
 if project_root not in sys.path:
     sys.path.insert(0, project_root)
 from utils import initialize_openai_client, initialize_opik_client
+from prompt_registry import ADDITIONAL_PROMPT, SYSTEM_PROMPT, get_prompt_registry
+from tracing import create_tracer
+from document import load_document
+from token_budget import DEFAULT_OUTPUT_TOKENS, ensure_fits_context
 
 # Function to load the template NDA from a JSON file.
 def load_template_nda(json_path):
@@ -32,18 +34,84 @@ def load_counterparty_contract(txt_path):
 def read_docx(file_path: str) -> str:
     """
     Read a .docx file and return its textual content as a single string.
-    Utilizes the docx2txt library for straightforward extraction.
+    Uses the shared document IR, so the text matches the paragraphs step 1 indexes.
 
     :param file_path: Path to the .docx file
     :return: The extracted text
     """
-    return docx2txt.process(file_path)
+    return load_document(file_path).full_text
+
+
+def template_clause_names(mll_template):
+    """The template reduced to its clause names and subnames, without the clause texts."""
+    return {name: list(sub_dict) if isinstance(sub_dict, dict) else [] for name, sub_dict in mll_template.items()}
+
+
+def select_candidates(paragraphs, similarity, threshold=DEFAULT_CANDIDATE_THRESHOLD):
+    """
+    Keeps the paragraphs that match no template clause, i.e. whose highest similarity in the
+    paragraph x template clause matrix is below threshold, in document order.
+
+    Parameters:
+    - paragraphs (list[str]): The indexed paragraphs (or retrieval units).
+    - similarity (np.ndarray): One row per paragraph, one column per template clause
+      (see 1_V3_RAG.template_similarity).
+
+    Returns:
+    - Tuple (candidate paragraphs, report dict).
+    """
+    best_scores = similarity.max(axis=1) if len(paragraphs) else []
+    candidates = [paragraph for paragraph, score in zip(paragraphs, best_scores) if score < threshold]
+    return candidates, {
+        "threshold": threshold,
+        "paragraphs": len(paragraphs),
+        "candidates": len(candidates),
+    }
+
+
+def build_request(mll_template, external_contract: str, openai_model: str = None, prompts=None) -> dict:
+    """
+    Returns the chat.completions request body for step 3. Used for direct calls and batch files.
+    Raises ValueError if the template and contract don't fit into the model's context window.
+    """
+    openai_model = openai_model or OPENAI_MODEL_ADDITIONAL
+    prompts = prompts or get_prompt_registry()
+    formatted_prompt = prompts.format(
+        ADDITIONAL_PROMPT,
+        MLL_template=mll_template,
+        external_contract=external_contract
+    )
+    messages = [
+        {"role": "system", "content": prompts.format(SYSTEM_PROMPT)},
+        {"role": "user", "content": formatted_prompt},
+    ]
+    # The whole template and contract go into one prompt, so fail here rather than at the API
+    ensure_fits_context(messages, openai_model, DEFAULT_OUTPUT_TOKENS["additional"])
+    return {
+        "model": openai_model,
+        "messages": messages,
+        "response_format": {
+            "type": "json_object"
+        },
+        "seed": 42,
+    }
+
+
+def parse_content(content: str) -> dict:
+    """Parses the JSON answer of step 3."""
+    try:
+        return json.loads(content)
+    except json.JSONDecodeError:
+        raise ValueError(f"Failed to parse JSON from model:\n{content}")
 
 
-@opik.track(name="Search Additional Clauses", flush=True)
 def identify_additional_clauses(
     mll_template: str,
     external_contract: str,
+    openai_model: str = None,
+    openai_client=None,
+    prompts=None,
+    tracer=None,
 ) -> str:
     """
     Identify additional clauses in an external NDA contract using OpenAI.
@@ -51,41 +119,29 @@ def identify_additional_clauses(
     Parameters:
     - mll_template: The base MLL template text.
     - external_contract: The full text of the external NDA.
+    - openai_model: OpenAI model to use, defaults to OPENAI_MODEL_ADDITIONAL.
+    - openai_client: Existing OpenAI client, a new one is created if not given.
+    - prompts: PromptRegistry to read the Opik prompts from, defaults to the process-wide registry.
+    - tracer: TraceExporter recording the call as "Search Additional Clauses", tracing is skipped if None.
 
     Returns:
     The assistant's response with identified additional clauses.
     """
+    openai_model = openai_model or OPENAI_MODEL_ADDITIONAL
     # Initialize prompt from Opik
-    client = initialize_opik_client()
-    openai_client = initialize_openai_client()
+    prompts = prompts or get_prompt_registry()
+    openai_client = openai_client or initialize_openai_client()
 
-    prompt = client.get_prompt(name="V1.2 - Additional")
-    formatted_prompt = prompt.format(
-        MLL_template=mll_template,
-        external_contract=external_contract
-    )
+    request = build_request(mll_template, external_contract, openai_model, prompts)
+    formatted_prompt = request["messages"][1]["content"]
 
     print(formatted_prompt)
-    print(OPENAI_MODEL_ADDITIONAL)
-    # Call OpenAI ChatCompletion
-    response = openai_client.chat.completions.create(
-        model=OPENAI_MODEL_ADDITIONAL,
-        messages=[
-            {"role": "system", "content": client.get_prompt(name="V1 - System Prompt").format()},
-            {"role": "user", "content": formatted_prompt},
-        ],
-        response_format={
-            "type": "json_object"
-        },
-        seed=42
-    )
+    print(openai_model)
 
-    content = response.choices[0].message.content
+    # Call OpenAI ChatCompletion
+    response = openai_client.chat.completions.create(**request)
 
-    try:
-        content_json = json.loads(content)
-    except json.JSONDecodeError:
-        raise ValueError(f"Failed to parse JSON from model:\n{content}")
+    content_json = parse_content(response.choices[0].message.content)
 
     # Extract token usage
     input_tokens = response.usage.prompt_tokens
@@ -96,42 +152,49 @@ def identify_additional_clauses(
     print(f"Output Tokens: {output_tokens}")
     print(f"Total Tokens: {total_tokens}")
 
+    if tracer is not None:
+        tracer.trace(name="Search Additional Clauses", input=formatted_prompt, output=content_json)
+
     # Optionally, return the token usage along with the content
     return content_json, input_tokens, output_tokens, total_tokens
 
 
 
-MLL_NDA = load_template_nda("data/V3 - Template Clause MLL.json")
-EXTERNAL_NDA = read_docx(DOC_PATH)
-
-print(f'Additional / Path: {DOC_PATH}')
-print(EXTERNAL_NDA)
-
-# Call the function to identify additional clauses
-content, input_tokens, output_tokens, total_tokens = identify_additional_clauses(
-    mll_template=MLL_NDA,
-    external_contract=EXTERNAL_NDA
-)
-
-# Write the results to a text file in the "temp" folder, overwriting if it exists
-base_dir = os.path.dirname(os.path.abspath(__file__))
-temp_dir = os.path.join(base_dir, "temp")
-print(f'TEMP DIR PATH: {temp_dir}')
-os.makedirs(temp_dir, exist_ok=True)
-output_path = os.path.join(temp_dir, "3_V3_additional_clauses.json")
-#with open(output_path, 'w', encoding='utf-8') as out_file:
-#    out_file.write(content)
-with open(output_path, 'w', encoding='utf-8') as out_file:
-    json.dump(content, out_file, indent=4)
-
-execution_details_path = 'V3_Frontend/temp/execuation_details.json'
-with open(execution_details_path, 'r+', encoding='utf-8') as file:
-    execution_details = json.load(file)
-    execution_details['steps'][2]['input_tokens'] = input_tokens
-    execution_details['steps'][2]['output_tokens'] = output_tokens
-    execution_details['steps'][2]['total_tokens'] = total_tokens
-    file.seek(0)
-    json.dump(execution_details, file, indent=4)
-    file.truncate()
-
-print(f"Results written to {output_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    MLL_NDA = load_template_nda("data/V3 - Template Clause MLL.json")
+    EXTERNAL_NDA = read_docx(DOC_PATH)
+
+    print(f'Additional / Path: {DOC_PATH}')
+    print(EXTERNAL_NDA)
+
+    # Call the function to identify additional clauses
+    TRACER = create_tracer("opik")
+    content, input_tokens, output_tokens, total_tokens = identify_additional_clauses(
+        mll_template=MLL_NDA,
+        external_contract=EXTERNAL_NDA,
+        tracer=TRACER
+    )
+    TRACER.close()
+
+    # Write the results to a text file in the "temp" folder, overwriting if it exists
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    temp_dir = os.path.join(base_dir, "temp")
+    print(f'TEMP DIR PATH: {temp_dir}')
+    os.makedirs(temp_dir, exist_ok=True)
+    output_path = os.path.join(temp_dir, "3_V3_additional_clauses.json")
+    #with open(output_path, 'w', encoding='utf-8') as out_file:
+    #    out_file.write(content)
+    with open(output_path, 'w', encoding='utf-8') as out_file:
+        json.dump(content, out_file, indent=4)
+
+    execution_details_path = 'V3_Frontend/temp/execuation_details.json'
+    with open(execution_details_path, 'r+', encoding='utf-8') as file:
+        execution_details = json.load(file)
+        execution_details['steps'][2]['input_tokens'] = input_tokens
+        execution_details['steps'][2]['output_tokens'] = output_tokens
+        execution_details['steps'][2]['total_tokens'] = total_tokens
+        file.seek(0)
+        json.dump(execution_details, file, indent=4)
+        file.truncate()
+
+    print(f"Results written to {output_path}")
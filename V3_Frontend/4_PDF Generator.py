@@ -1,5 +1,7 @@
+import io
 import json
-from difflib import SequenceMatcher
+from functools import lru_cache
+from highlighting import highlight_reportlab
 from config import SAMPLE_DOC, PROCESS_STEP1_JSON, PROCESS_STEP2_JSON, OPENAI_MODEL_MISSING, MODEL_NAME, OPENAI_MODEL_DEVIATING, OPENAI_MODEL_ADDITIONAL, MODEL_PRICING, BASEDIR
 import os
 
@@ -11,20 +13,6 @@ import json
 import re
 from reportlab.platypus import Paragraph, Spacer
 
-SHORT_MODEL_NAME = MODEL_NAME.split("/")[1]  # Extract the first part of the model name
-#SHORT_MODEL_NAME = MODEL_NAME
-
-# --- Step 1: Load the JSON data ---
-deviating_file = f'V3_Frontend/{PROCESS_STEP2_JSON}'
-with open(deviating_file, "r", encoding="utf-8") as file:
-    deviating_data = json.load(file)
-
-
-missing_file = f'V3_Frontend/{PROCESS_STEP1_JSON}'
-with open(missing_file, "r", encoding="utf-8") as file:
-    missing_data = json.load(file)
-
-
 def get_best_retrieved_clause(retrieved_clauses):
     return max(retrieved_clauses, key=lambda x: x["confidence"])
 
@@ -42,37 +30,6 @@ def filter_missing_answers(input_file: str, output_file=False):
 
     return missing_objects
 
-# --- Utility: Function to mark overlapping text ---
-# This function uses difflib's SequenceMatcher to find overlapping sequences between the modified text and the retrieved clause.
-# It wraps overlapping segments in a font tag to change the color (red in this case) so they are “highlighted” in the PDF.
-def OLD_mark_overlapping_text(modified, retrieved):
-    s = SequenceMatcher(None, modified, retrieved)
-    opcodes = s.get_opcodes()
-    marked_text = ""
-    for tag, i1, i2, j1, j2 in opcodes:
-        segment = modified[i1:i2]
-        if tag == 'equal' and segment.strip():  # an overlapping segment found
-            # Wrap overlapping text in a <font> tag with a red color
-            marked_text += f"<font color='red'>{segment}</font>"
-        else:
-            marked_text += segment
-    return marked_text
-
-def mark_overlapping_text(modified, retrieved):
-    from difflib import SequenceMatcher
-    s = SequenceMatcher(None, modified, retrieved)
-    opcodes = s.get_opcodes()
-    marked_text = ""
-    for tag, i1, i2, j1, j2 in opcodes:
-        segment = modified[i1:i2]
-        # Highlight segments that do not match the retrieved clause
-        if tag != 'equal' and segment.strip():
-            marked_text += f"<font color='red'>{segment}</font>"
-        else:
-            marked_text += segment
-    return marked_text
-
-
 def append_deviating_clauses(clauses_data, styles, story):
     """
     Append Flowable objects (Paragraphs and Spacers) for clause content to the existing story list.
@@ -97,8 +54,8 @@ def append_deviating_clauses(clauses_data, styles, story):
         best_retrieved = get_best_retrieved_clause(clause_obj.get("retrieved_clauses", []))
         retrieved_clause = best_retrieved.get("clause", "")
 
-        # Mark overlapping text in the modified clause based on the retrieved clause
-        marked_modified_clause = mark_overlapping_text(modified_clause, retrieved_clause)
+        # Mark the text of the modified clause that deviates from the retrieved clause
+        marked_modified_clause = highlight_reportlab(modified_clause, retrieved_clause)
 
         # Append the various sections as Paragraphs to the provided story list
         story.append(Paragraph(f"<b>Clause:</b> {clause_name}", styles['ClauseHeading']))
@@ -239,6 +196,14 @@ def append_additional_clauses_JSON(json_path, styles, story):
     with open(json_path, "r", encoding="utf-8") as f:
         data = json.load(f)
 
+    append_additional_entries(data, styles, story)
+
+
+def append_additional_entries(data, styles, story):
+    """
+    Appends the additional clauses of an already loaded step 3 result
+    ({"entries": [...]}) to the story flowables.
+    """
     entries = data.get("entries", [])
     if not entries:
         return  # nothing to add
@@ -270,7 +235,7 @@ def append_additional_clauses_JSON(json_path, styles, story):
             story.append(Spacer(1, 12))
 
 
-def append_missing_paragraphs(missing_data, styles, story):
+def append_missing_paragraphs(missing_data, styles, story, document=None):
     """
     Append Flowable objects (Paragraphs and Spacers) for missing clause content to the existing story list.
 
@@ -287,10 +252,14 @@ def append_missing_paragraphs(missing_data, styles, story):
         styles (dict): A dictionary of ReportLab ParagraphStyle objects; expected keys include:
                        'ClauseHeading' and 'ClauseBody'.
         story (list): The existing list of Flowable objects that this function appends to.
+        document (DocumentIR): If given, retrieved paragraphs are labelled with their clause number.
 
     Returns:
         None
     """
+    numbering = {}
+    if document is not None:
+        numbering = {paragraph.text: paragraph.numbering for paragraph in document.paragraphs if paragraph.numbering}
 
     story.append(Paragraph("Missing Clauses", styles["Heading2"]))
     for missing_obj in missing_data:
@@ -314,6 +283,10 @@ def append_missing_paragraphs(missing_data, styles, story):
         story.append(Paragraph("<b>Retrieved Clauses:</b>", styles['ClauseBody']))
         for idx, clause in enumerate(retrieved_clauses, start=1):
             retrieved_text = f"{idx}. {clause.get('clause', '')} (Confidence: {clause.get('confidence', 0):.3f})"
+            # Clause-level units start with the text of their first paragraph
+            first_paragraph = clause.get('clause', '').split("\n", 1)[0]
+            if first_paragraph in numbering:
+                retrieved_text += f" [Clause {numbering[first_paragraph]}]"
             story.append(Paragraph(retrieved_text, styles["NumberedClause"]))
             story.append(Spacer(1, 3))
 
@@ -321,18 +294,19 @@ def append_missing_paragraphs(missing_data, styles, story):
         story.append(Spacer(1, 20))
 
 
-def calculate_api_usage_price(input_tokens, output_tokens):
+def calculate_api_usage_price(input_tokens, output_tokens, model=None):
     """
     Calculate the price of API usage based on token counts and model pricing.
 
     Args:
         input_tokens (int): The number of input tokens used.
         output_tokens (int): The number of output tokens generated.
+        model (str): The OpenAI model, defaults to OPENAI_MODEL_ADDITIONAL.
 
     Returns:
         float: The total price of the API usage.
     """
-    model = OPENAI_MODEL_ADDITIONAL
+    model = model or OPENAI_MODEL_ADDITIONAL
     if model not in MODEL_PRICING:
         raise ValueError(f"Pricing information for model '{model}' is not available.")
 
@@ -343,81 +317,171 @@ def calculate_api_usage_price(input_tokens, output_tokens):
     return total_price
 
 
-# --- Step 2: Set up ReportLab PDF generation ---
-pdf_filename = f"Findings Overview - {OPENAI_MODEL_MISSING}.pdf"
-doc = SimpleDocTemplate(pdf_filename, pagesize=letter,
-                        rightMargin=40, leftMargin=40, topMargin=40, bottomMargin=40)
-
-styles = getSampleStyleSheet()
-styles.add(ParagraphStyle(name='ClauseHeading', fontSize=14, leading=16, spaceAfter=10, spaceBefore=10))
-styles.add(ParagraphStyle(name='ClauseBody', fontSize=10, leading=14))
-styles.add(ParagraphStyle(
-    "NumberedClause",
-    parent=styles["ClauseBody"],
-    leftIndent=20  # Adjust the indent as desired
-))
-styles.add(ParagraphStyle(
-    "ClauseSubHeading",
-    parent=styles["ClauseHeading"],
-    fontSize=10,
-    leading=12,
-    spaceAfter=4,
-))
+def calculate_steps_price(steps, models):
+    """
+    Calculate the price of a run, each step priced with the model it used.
 
+    Args:
+        steps (list): The "steps" of execuation_details.json.
+        models (list): Missing, deviating and additional model, used for steps that
+            don't carry their own "cost" or "model" (details written by older runs).
 
-with open('V3_Frontend/temp/execuation_details.json', 'r', encoding='utf-8') as file:
-    execution_details = json.load(file)
+    Returns:
+        float: The total price of the API usage, None if a step used a model without pricing.
+    """
+    total_price = 0
+    for step, model in zip(steps, models):
+        if "cost" in step:
+            # None: the step's model has no pricing, so neither has the run
+            if step["cost"] is None:
+                return None
+            total_price += step["cost"]
+        else:
+            total_price += calculate_api_usage_price(step["input_tokens"], step["output_tokens"],
+                                                     step.get("model") or model)
+    return total_price
 
-# Totals : Time
-time_seconds_1 = execution_details['steps'][0]['time_seconds']
-time_seconds_2 = execution_details['steps'][1]['time_seconds']
-time_seconds_3 = execution_details['steps'][2]['time_seconds']
-total_time = time_seconds_1 + time_seconds_2 + time_seconds_3
 
-# Totals: Tokens
-total_input_tokens = sum(step["input_tokens"] for step in execution_details["steps"])
-total_output_tokens = sum(step["output_tokens"] for step in execution_details["steps"])
+@lru_cache(maxsize=1)
+def build_styles():
+    # Built once per process; the story only reads the styles
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(name='ClauseHeading', fontSize=14, leading=16, spaceAfter=10, spaceBefore=10))
+    styles.add(ParagraphStyle(name='ClauseBody', fontSize=10, leading=14))
+    styles.add(ParagraphStyle(
+        "NumberedClause",
+        parent=styles["ClauseBody"],
+        leftIndent=20  # Adjust the indent as desired
+    ))
+    styles.add(ParagraphStyle(
+        "ClauseSubHeading",
+        parent=styles["ClauseHeading"],
+        fontSize=10,
+        leading=12,
+        spaceAfter=4,
+    ))
+    return styles
+
+
+def render_pdf(missing_data, deviating_data, additional_data, execution_details, sample_doc, model_name,
+               missing_model, deviating_model, additional_model, document=None):
+    """
+    Builds the findings overview PDF from the in-memory results of steps 1-3.
 
-# Totals: Cost
-price = calculate_api_usage_price(total_input_tokens, total_output_tokens)
+    Args:
+        missing_data (list): Step 1 clause dicts with answer "missing".
+        deviating_data (list): Step 2 clause dicts.
+        additional_data (dict): Step 3 result ({"entries": [...]}).
+        execution_details (dict): Per-step timings and token counts ({"steps": [...]}).
+        sample_doc, model_name, missing_model, deviating_model, additional_model (str):
+            Run parameters printed in the header.
+        document (DocumentIR): The parsed contract shared with steps 1-3, optional.
 
-story = []
+    Returns:
+        bytes: The PDF, e.g. for st.download_button.
+    """
+    # --- Step 2: Set up ReportLab PDF generation ---
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter,
+                            rightMargin=40, leftMargin=40, topMargin=40, bottomMargin=40)
+
+    styles = build_styles()
+
+    # Totals : Time
+    time_seconds_1 = execution_details['steps'][0]['time_seconds']
+    time_seconds_2 = execution_details['steps'][1]['time_seconds']
+    time_seconds_3 = execution_details['steps'][2]['time_seconds']
+    # Steps overlap when run through pipeline.analyze(), so prefer the measured wall time
+    total_time = execution_details.get('wall_time_seconds') or (time_seconds_1 + time_seconds_2 + time_seconds_3)
+
+    # Totals: Tokens
+    total_input_tokens = sum(step["input_tokens"] for step in execution_details["steps"])
+    total_output_tokens = sum(step["output_tokens"] for step in execution_details["steps"])
+
+    # Totals: Cost
+    price = calculate_steps_price(execution_details["steps"], [missing_model, deviating_model, additional_model])
+
+    story = []
+
+    story.append(Paragraph(f"Findings Overview in {sample_doc}",styles["Heading1"]))
+    story.append(Spacer(1, 6))
+    if document is not None:
+        story.append(Paragraph(f'Document: {len(document.paragraphs)} paragraphs, SHA-256 {document.sha256[:12]}',
+                               styles["Normal"]))
+    story.append(Paragraph(f'Embedding Model: {model_name}', styles["Normal"]))
+    story.append(Paragraph(f'Missing Model: {missing_model}', styles["Normal"]))
+    story.append(Paragraph(f'Deviating Model: {deviating_model}', styles["Normal"]))
+    story.append(Paragraph(f'Additional Model: {additional_model}', styles["Normal"]))
+    story.append(Paragraph(f'Total Input tokens: {total_input_tokens}', styles["Normal"]))
+    story.append(Paragraph(f'Total Output tokens: {total_output_tokens}', styles["Normal"]))
+    cost = f'{round(price, 3)} $' if price is not None else 'n/a (no pricing for a model used)'
+    story.append(Paragraph(f'Total Cost: {cost}', styles["Normal"]))
+
+    story.append(Paragraph(f'Duration Total : {round(total_time, 1)}', styles["Normal"]))
+    story.append(Paragraph(f'Duration Step 1 (Missing): {time_seconds_1}', styles["Normal"]))
+    story.append(Paragraph(f'Duration Step 2 (Deviation): {time_seconds_2}', styles["Normal"]))
+    note_3 = f" ({execution_details['steps'][2]['time_note']})" if execution_details['steps'][2].get('time_note') else ""
+    story.append(Paragraph(f'Duration Step 3 (Additional): {time_seconds_3}{note_3}', styles["Normal"]))
+
+
+    # --- Step 3: Append the data to the PDF story ---
+    # Append the missing clauses to the story
+    append_missing_paragraphs(missing_data, styles, story, document)
+
+    # Append the deviating clauses to the story
+    append_deviating_clauses(deviating_data, styles, story)
+
+    # Append the additional clauses to the story
+    append_additional_entries(additional_data, styles, story)
 
-story.append(Paragraph(f"Findings Overview in {SAMPLE_DOC}",styles["Heading1"]))
-story.append(Spacer(1, 6))
-story.append(Paragraph(f'Embedding Model: {MODEL_NAME}', styles["Normal"]))
-story.append(Paragraph(f'Missing Model: {OPENAI_MODEL_MISSING}', styles["Normal"]))
-story.append(Paragraph(f'Deviating Model: {OPENAI_MODEL_DEVIATING}', styles["Normal"]))
-story.append(Paragraph(f'Additional Model: {OPENAI_MODEL_ADDITIONAL}', styles["Normal"]))
-story.append(Paragraph(f'Total Input tokens: {total_input_tokens}', styles["Normal"]))
-story.append(Paragraph(f'Total Output tokens: {total_output_tokens}', styles["Normal"]))
-story.append(Paragraph(f'Total Cost: {round(price, 3)} $', styles["Normal"]))
+    story.append(Spacer(1, 20))
+    story.append(Paragraph(f"{sample_doc} is finished", styles["Heading1"]))
 
-story.append(Paragraph(f'Duration Total : {round(total_time, 1)}', styles["Normal"]))
-story.append(Paragraph(f'Duration Step 1 (Missing): {time_seconds_1}', styles["Normal"]))
-story.append(Paragraph(f'Duration Step 2 (Deviation): {time_seconds_2}', styles["Normal"]))
-story.append(Paragraph(f'Duration Step 3 (Additional): {time_seconds_3}', styles["Normal"]))
+    # --- Step 4: Build the PDF ---
+    doc.build(story)
+    return buffer.getvalue()
 
 
-# --- Step 3: Append the data to the PDF story ---
-# Append the missing clauses to the story
-missing_data = filter_missing_answers(missing_file)
-append_missing_paragraphs(missing_data, styles, story)
+def generate_pdf(missing_data, deviating_data, additional_data, execution_details, pdf_filename,
+                 sample_doc, model_name, missing_model, deviating_model, additional_model, document=None):
+    """
+    Writes the findings overview PDF (see render_pdf) to pdf_filename.
 
-# Append the deviating clauses to the story
-append_deviating_clauses(deviating_data, styles, story)
+    Returns:
+        str: The path of the generated PDF.
+    """
+    pdf = render_pdf(missing_data, deviating_data, additional_data, execution_details, sample_doc, model_name,
+                     missing_model, deviating_model, additional_model, document)
+    with open(pdf_filename, "wb") as f:
+        f.write(pdf)
 
-# Append the additional clauses to the story
-additional_file_path = "V3_Frontend/temp/3_V3_additional_clauses.json"
-append_additional_clauses_JSON(additional_file_path, styles, story)
+    print(f"PDF generated and saved as '{pdf_filename}'.")
+    return pdf_filename
 
-story.append(Spacer(1, 20))
-story.append(Paragraph(f"{SAMPLE_DOC} is finished", styles["Heading1"]))
 
+if __name__ == "__main__":
+    SHORT_MODEL_NAME = MODEL_NAME.split("/")[1]  # Extract the first part of the model name
+    #SHORT_MODEL_NAME = MODEL_NAME
 
+    # --- Step 1: Load the JSON data ---
+    deviating_file = f'V3_Frontend/{PROCESS_STEP2_JSON}'
+    with open(deviating_file, "r", encoding="utf-8") as file:
+        deviating_data = json.load(file)
 
+    missing_file = f'V3_Frontend/{PROCESS_STEP1_JSON}'
 
-# --- Step 4: Build the PDF ---
-doc.build(story)
+    with open('V3_Frontend/temp/execuation_details.json', 'r', encoding='utf-8') as file:
+        execution_details = json.load(file)
 
-print(f"PDF generated and saved as '{pdf_filename}'.")
+    additional_file_path = "V3_Frontend/temp/3_V3_additional_clauses.json"
+    with open(additional_file_path, "r", encoding="utf-8") as f:
+        additional_data = json.load(f)
+
+    generate_pdf(
+        filter_missing_answers(missing_file),
+        deviating_data,
+        additional_data,
+        execution_details,
+        f"Findings Overview - {OPENAI_MODEL_MISSING}.pdf",
+        SAMPLE_DOC, MODEL_NAME, OPENAI_MODEL_MISSING, OPENAI_MODEL_DEVIATING, OPENAI_MODEL_ADDITIONAL,
+    )
@@ -14,7 +14,9 @@ class RetrievedClause:
         self.clause_subname = clause_subname
         self.input_clause = input_clause
         self.retrieved_clauses: List[Dict[str, float]] = []  # List of (clause, confidence) tuples
+        self.retrieved_k = None  # Number of paragraphs the retrieval kept (chosen per clause with adaptive top-k)
         self.answer = None
+        self.answer_source = None  # "llm", or "threshold" if step 1 was decided by the retrieval score
         self.modified_clause = None
 
     def display_retrievedClauses(self, top_n=1):
@@ -25,8 +27,10 @@ class RetrievedClause:
             print(clause)
             print("-----")
 
-    def return_retrievedClauses(self, top_n=3):
-        """Returns the retrieved clauses."""
+    def return_retrievedClauses(self, top_n=None):
+        """Returns the retrieved clauses, all of them unless top_n is given."""
+        if top_n is None:
+            top_n = len(self.retrieved_clauses)
         result = []
         result.append(f"Top {top_n} retrieved clauses:")
 
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+batch_analyze.py
+Analyses many NDAs in parallel.
+
+Documents come from a directory (every .docx in it) or a manifest: a text file with one
+path per line, or a JSON list of paths or {"doc_path": ..., "sample_doc": ...} objects.
+They are spread over a process pool; each worker loads the embedding model once and
+keeps it for all its documents, and the template clause embeddings are shared through
+the on-disk cache (embedding_cache.py), so they are computed at most once.
+
+Every document gets its own result directory (<output-dir>/<document name>/) and
+<output-dir>/summary.json aggregates timings, tokens and cost over all documents.
+All options after the known ones are passed to run_pipeline.py for every document.
+
+python3 V3_Frontend/batch_analyze.py --input data/raw --workers 4 --output-dir reports/batch -a gpt-4.1-2025-04-14 -b gpt-4.1-2025-04-14 -c gpt-4.1-2025-04-14
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import run_pipeline
+from metrics import sum_cost
+
+
+def load_jobs(input_path):
+    """Returns [(sample_doc, doc_path)] from a directory or a manifest file."""
+    input_path = Path(input_path)
+    if input_path.is_dir():
+        # "~$" files are Word lock files of open documents
+        paths = sorted(path for path in input_path.glob("*.docx") if not path.name.startswith("~$"))
+        return [(path.name, str(path)) for path in paths]
+
+    if input_path.suffix.lower() == ".json":
+        with open(input_path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+    else:
+        with open(input_path, "r", encoding="utf-8") as f:
+            entries = [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+    jobs = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"doc_path": entry}
+        doc_path = Path(entry["doc_path"])
+        if not doc_path.is_absolute():
+            doc_path = input_path.parent / doc_path
+        jobs.append((entry.get("sample_doc") or doc_path.name, str(doc_path)))
+    return jobs
+
+
+def _init_worker(model_name, embedding_batch_size):
+    """Loads the embedding model once per worker process."""
+    from embedding_service import get_embedding_service
+    get_embedding_service(model_name, embedding_batch_size).start()
+
+
+def analyze_document(sample_doc, doc_path, pipeline_args, output_dir):
+    """Runs the pipeline for one document in a worker and returns its summary row."""
+    from pipeline import analyze, analyze_batch
+
+    start_time = time.time()
+    row = {"sample_doc": sample_doc, "doc_path": doc_path, "output_dir": str(output_dir)}
+    try:
+        args = run_pipeline.parse_args(["-s", sample_doc, "-d", doc_path, "--output-dir", str(output_dir)]
+                                       + pipeline_args)
+        config = run_pipeline.build_config(args)
+        result = (analyze_batch if config.batch_mode else analyze)(doc_path, config, generate_pdf=args.pdf)
+        row.update(
+            status="ok",
+            missing=len(result.missing),
+            deviating=len(result.deviating),
+            additional=len(result.additional_entries),
+            input_tokens=sum(step["input_tokens"] for step in result.steps),
+            output_tokens=sum(step["output_tokens"] for step in result.steps),
+            cache_hits=sum(step["cache_hits"] for step in result.steps),
+            cost=sum_cost(step["cost"] for step in result.steps),
+            steps_wall_time_seconds=result.wall_time_seconds,
+        )
+    except Exception as e:
+        row.update(status="error", error=repr(e), traceback=traceback.format_exc())
+    row["time_seconds"] = round(time.time() - start_time, 1)
+    row["worker_pid"] = os.getpid()
+    return row
+
+
+def summarize(rows, wall_time_seconds):
+    ok = [row for row in rows if row["status"] == "ok"]
+    return {
+        "documents": len(rows),
+        "succeeded": len(ok),
+        "failed": len(rows) - len(ok),
+        "wall_time_seconds": round(wall_time_seconds, 1),
+        "document_time_seconds": round(sum(row["time_seconds"] for row in rows), 1),
+        "input_tokens": sum(row["input_tokens"] for row in ok),
+        "output_tokens": sum(row["output_tokens"] for row in ok),
+        "cost": sum_cost(row["cost"] for row in ok),
+        "documents_per_hour": round(len(ok) / wall_time_seconds * 3600, 1) if wall_time_seconds else None,
+        "results": sorted(rows, key=lambda row: row["sample_doc"]),
+    }
+
+
+def run_batch(jobs, output_dir, pipeline_args, workers=2, model_name=None, embedding_batch_size=64):
+    """
+    Analyses all jobs with a pool of worker processes and writes summary.json.
+
+    Parameters:
+    - jobs (list[tuple]): (sample_doc, doc_path) pairs.
+    - output_dir (str | Path): One sub-directory per document is created in it.
+    - pipeline_args (list[str]): Extra run_pipeline.py arguments for every document.
+    - workers (int): Number of worker processes.
+    - model_name (str): Embedding model the workers preload.
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    rows = []
+    start_time = time.time()
+
+    # spawn: the parent may already run threads (embedding service, exporters), which fork doesn't copy safely
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_init_worker, initargs=(model_name, embedding_batch_size)) as pool:
+        futures = {}
+        used_dirs = set()
+        for sample_doc, doc_path in jobs:
+            name = Path(sample_doc).stem
+            # Manifests may list documents with the same name from different folders
+            while name in used_dirs:
+                name = f"{name}_"
+            used_dirs.add(name)
+            futures[pool.submit(analyze_document, sample_doc, doc_path, pipeline_args, output_dir / name)] = sample_doc
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            status = "done" if row["status"] == "ok" else f"FAILED: {row['error']}"
+            print(f"[{len(rows)}/{len(jobs)}] {row['sample_doc']}: {status} ({row['time_seconds']} s)")
+
+    summary = summarize(rows, time.time() - start_time)
+    with open(output_dir / "summary.json", "w", encoding="utf-8") as f:
+        json.dump(summary, f, indent=4, ensure_ascii=False)
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Analyse a directory or manifest of NDAs in parallel. "
+                    "Unknown options are passed to run_pipeline.py for every document."
+    )
+    parser.add_argument("--input", "-i", required=True, help="Directory with .docx files or a manifest file")
+    parser.add_argument("--output-dir", "-o", required=True, help="Directory for the per-document results")
+    parser.add_argument("--workers", "-w", type=int, default=2, help="Number of worker processes (default: 2)")
+    args, pipeline_args = parser.parse_known_args()
+
+    # Validate the pass-through options once, before starting any worker
+    pipeline_defaults = run_pipeline.parse_args(["-s", "batch"] + pipeline_args)
+    jobs = load_jobs(args.input)
+    if not jobs:
+        parser.error(f"No documents found in {args.input}")
+    print(f"Analysing {len(jobs)} documents with {args.workers} workers...")
+
+    summary = run_batch(jobs, args.output_dir, pipeline_args, args.workers,
+                        pipeline_defaults.model_name, pipeline_defaults.embedding_batch_size)
+    print(f"{summary['succeeded']}/{summary['documents']} documents in {summary['wall_time_seconds']} s, "
+          f"{summary['input_tokens']} input / {summary['output_tokens']} output tokens, "
+          f"{str(summary['cost']) + ' $' if summary['cost'] is not None else 'cost n/a'}")
+    print(f"Summary written to {Path(args.output_dir) / 'summary.json'}")
+    sys.exit(1 if summary["failed"] else 0)
@@ -0,0 +1,208 @@
+"""
+batch_jobs.py
+Sends chat completion requests through the OpenAI Batch API instead of one
+synchronous call per request.
+
+Requests are written to a JSONL file ({"custom_id", "method", "url", "body"} per line),
+uploaded and submitted as one batch, polled until the batch is done, and the output
+file is mapped back to the requests by custom_id. Batches are billed at a discount
+and don't hold a connection per request, at the price of latency (up to the
+completion window), so this is meant for bulk, non-interactive runs.
+
+fake_openai_server.py implements the same file and batch endpoints for local runs.
+"""
+
+import json
+import time
+from pathlib import Path
+
+from llm_cache import request_key
+from resilience import retry_call, timeout_until
+
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+DEFAULT_POLL_INTERVAL = 30.0
+DEFAULT_COMPLETION_WINDOW = "24h"
+
+
+class BatchError(RuntimeError):
+    pass
+
+
+def write_batch_file(path, requests):
+    """
+    Writes requests to a Batch API input file.
+
+    Parameters:
+    - path (str | Path): Output JSONL file.
+    - requests (dict): {custom_id: chat.completions request body}.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in requests.items():
+            f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": body},
+                               ensure_ascii=False) + "\n")
+    return path
+
+
+def parse_batch_output(text):
+    """
+    Parses a Batch API output (or error) file.
+
+    Returns:
+    - Tuple (results, errors): results maps the custom_id of each successful request to
+      (content, input_tokens, output_tokens, total_tokens), errors maps failed ones to their error.
+    """
+    results, errors = {}, {}
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        custom_id = entry["custom_id"]
+        response = entry.get("response") or {}
+        if entry.get("error") or response.get("status_code", 200) != 200:
+            errors[custom_id] = entry.get("error") or response.get("body", {}).get("error") or response
+            continue
+        body = response["body"]
+        usage = body.get("usage", {})
+        results[custom_id] = (
+            body["choices"][0]["message"]["content"],
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            usage.get("total_tokens", 0),
+        )
+    return results, errors
+
+
+class BatchRunner:
+    def __init__(self, openai_client, work_dir, poll_interval=DEFAULT_POLL_INTERVAL,
+                 completion_window=DEFAULT_COMPLETION_WINDOW, timeout=None, cache=None, recorder=None, policy=None):
+        """
+        Parameters:
+        - openai_client: OpenAI client with the files and batches APIs.
+        - work_dir (str | Path): Where the input and output JSONL files are kept.
+        - poll_interval (float): Seconds between status checks.
+        - completion_window (str): Batch API completion window.
+        - timeout (float): Give up waiting after this many seconds, None waits for the final status.
+        - cache (LLMCache): Requests found in the cache aren't submitted; results are stored in it.
+        - recorder (MetricsRecorder): Records every result; the stage is the custom_id up to
+          the first "-" ("step1-0003" -> "step1").
+        - policy (RetryPolicy): Backoff and deadline of every file and batch API call (resilience.py);
+          None leaves retrying to the client.
+        """
+        self.client = openai_client
+        self.work_dir = Path(work_dir)
+        self.poll_interval = poll_interval
+        self.completion_window = completion_window
+        self.timeout = timeout
+        self.cache = cache
+        self.recorder = recorder
+        self.policy = policy
+        self.stats = {"batches": 0, "submitted": 0, "cache_hits": 0, "failed": 0}
+
+    def _record(self, custom_id, model, **kwargs):
+        # Batch requests have no per-call latency, only the batch as a whole
+        if self.recorder is not None:
+            self.recorder.record(custom_id.split("-")[0], model, **kwargs)
+
+    def _call(self, fn, **kwargs):
+        if self.policy is None:
+            return fn(**kwargs)
+        return retry_call(lambda deadline: fn(**kwargs, **timeout_until(deadline)), self.policy)[0]
+
+    def submit(self, input_path, name):
+        # Read upfront, so a retried upload sends the whole file again
+        input_path = Path(input_path)
+        input_file = self._call(self.client.files.create, file=(input_path.name, input_path.read_bytes()),
+                                purpose="batch")
+        batch = self._call(
+            self.client.batches.create,
+            input_file_id=input_file.id,
+            endpoint=CHAT_COMPLETIONS_URL,
+            completion_window=self.completion_window,
+            metadata={"name": name},
+        )
+        print(f"Submitted batch {batch.id} ({name}).")
+        return batch
+
+    def wait(self, batch_id):
+        """Polls a batch until it reaches a final status and returns it."""
+        start = time.monotonic()
+        while True:
+            batch = self._call(self.client.batches.retrieve, batch_id=batch_id)
+            if batch.status in FINAL_STATUSES:
+                return batch
+            if self.timeout is not None and time.monotonic() - start > self.timeout:
+                raise BatchError(f"Batch {batch_id} still '{batch.status}' after {self.timeout} s")
+            counts = getattr(batch, "request_counts", None)
+            if counts is not None:
+                print(f"Batch {batch_id}: {batch.status}, {counts.completed}/{counts.total} done")
+            time.sleep(self.poll_interval)
+
+    def _file_text(self, file_id):
+        if not file_id:
+            return ""
+        return self._call(self.client.files.content, file_id=file_id).text
+
+    def run(self, requests, name):
+        """
+        Runs requests through one batch and waits for it.
+
+        Parameters:
+        - requests (dict): {custom_id: chat.completions request body}.
+        - name (str): Used for the file names and the batch metadata.
+
+        Returns:
+        - Dict {custom_id: (content, input_tokens, output_tokens, total_tokens)}. Cache hits
+          have zero token usage, like CachedOpenAIClient responses.
+
+        Raises:
+        - BatchError if the batch doesn't complete or any request failed.
+        """
+        results, pending = {}, {}
+        for custom_id, body in requests.items():
+            hit = self.cache.get(request_key(body), body["model"]) if self.cache is not None else None
+            if hit is not None:
+                results[custom_id] = (hit[0], 0, 0, 0)
+                self._record(custom_id, body["model"], cache_hit=True, cached_input_tokens=hit[1]["prompt_tokens"],
+                             cached_output_tokens=hit[1]["completion_tokens"])
+            else:
+                pending[custom_id] = body
+        self.stats["cache_hits"] += len(results)
+        if not pending:
+            return results
+
+        input_path = write_batch_file(self.work_dir / f"{name}-input.jsonl", pending)
+        batch = self.wait(self.submit(input_path, name).id)
+        self.stats["batches"] += 1
+        self.stats["submitted"] += len(pending)
+
+        output_text = self._file_text(batch.output_file_id)
+        (self.work_dir / f"{name}-output.jsonl").write_text(output_text, encoding="utf-8")
+        batch_results, errors = parse_batch_output(output_text)
+        _, file_errors = parse_batch_output(self._file_text(getattr(batch, "error_file_id", None)))
+        errors.update(file_errors)
+        errors.update({custom_id: "no result in the output file" for custom_id in pending
+                       if custom_id not in batch_results and custom_id not in errors})
+        self.stats["failed"] += len(errors)
+        for custom_id, (_, input_tokens, output_tokens, _) in batch_results.items():
+            self._record(custom_id, pending[custom_id]["model"], input_tokens=input_tokens,
+                         output_tokens=output_tokens, batch=True)
+        for custom_id, error in errors.items():
+            self._record(custom_id, pending.get(custom_id, {}).get("model"), status="error", error=str(error), batch=True)
+
+        if batch.status != "completed" or errors:
+            sample = "; ".join(f"{custom_id}: {error}" for custom_id, error in list(errors.items())[:3])
+            raise BatchError(f"Batch {batch.id} ended '{batch.status}' with {len(errors)} failed requests. {sample}")
+
+        if self.cache is not None:
+            for custom_id, (content, input_tokens, output_tokens, total_tokens) in batch_results.items():
+                if content:
+                    self.cache.put(request_key(pending[custom_id]), pending[custom_id]["model"], content, {
+                        "prompt_tokens": input_tokens,
+                        "completion_tokens": output_tokens,
+                        "total_tokens": total_tokens,
+                    })
+        results.update(batch_results)
+        return results
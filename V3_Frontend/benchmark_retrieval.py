@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+benchmark_retrieval.py
+Compares per-query retrieval (one encode + one FAISS search per template clause)
+with batched retrieval (one encode + one FAISS search for all clauses), and the
+retrieved prompt context of fixed against adaptive top-k.
+
+python3 V3_Frontend/benchmark_retrieval.py -d "data/raw/Sample 2.docx" --min-score 0.3 --max-score-drop 0.1
+"""
+
+import argparse
+import importlib
+import os
+import sys
+import time
+from pathlib import Path
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from embedding_service import DEFAULT_MODEL_NAME, get_embedding_service
+from segmentation import retrieved_context_tokens
+
+rag_step = importlib.import_module("1_V3_RAG")
+
+
+def _time_runs(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start_time)
+    return min(timings)
+
+
+def benchmark_retrieval(clauses, embedding_model, index, paragraphs, k=3, repeats=3):
+    """
+    Returns the best-of-`repeats` wall time and throughput (queries/s) of both retrieval modes.
+    Both modes encode the queries, so the numbers compare like with like.
+    """
+    def per_query():
+        for clause in clauses:
+            clause.retrieved_clauses = rag_step.retrieve(clause.input_clause, embedding_model, index, paragraphs, k=k)
+
+    def batched():
+        rag_step.retrieve_batch(clauses, embedding_model, index, paragraphs, k=k)
+
+    results = {}
+    for name, fn in (("per_query", per_query), ("batched", batched)):
+        seconds = _time_runs(fn, repeats)
+        results[name] = {"seconds": round(seconds, 4), "queries_per_second": round(len(clauses) / seconds, 1)}
+    results["speedup"] = round(results["per_query"]["seconds"] / results["batched"]["seconds"], 1)
+    return results
+
+
+def compare_adaptive_k(clauses, embedding_model, index, paragraphs, k, min_score, max_drop, encoding):
+    """Retrieved context tokens of all step 1 prompts with fixed and with adaptive top-k."""
+    rag_step.retrieve_batch(clauses, embedding_model, index, paragraphs, k=k)
+    fixed_tokens = retrieved_context_tokens(clauses, encoding)
+    rag_step.retrieve_batch(clauses, embedding_model, index, paragraphs, k=k, min_score=min_score, max_drop=max_drop)
+    adaptive_tokens = retrieved_context_tokens(clauses, encoding)
+    return {
+        "fixed_tokens": fixed_tokens,
+        "adaptive_tokens": adaptive_tokens,
+        "reduction": round(1 - adaptive_tokens / max(fixed_tokens, 1), 3),
+        "retrieval": rag_step.retrieval_summary(clauses),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark per-query against batched retrieval.")
+    parser.add_argument("--doc-path", "-d", required=True, help="Path to the .docx document")
+    parser.add_argument("--model-name", "-m", default=DEFAULT_MODEL_NAME,
+                        help=f"Name of the model to be used (default: '{DEFAULT_MODEL_NAME}')")
+    parser.add_argument("--retrieved-k", "-k", type=int, default=3, help="Number of items to retrieve (default: 3)")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed repetitions per mode (default: 3)")
+    parser.add_argument("--min-score", type=float, default=0.3, help="Adaptive top-k score floor (default: 0.3)")
+    parser.add_argument("--max-score-drop", type=float, default=0.1,
+                        help="Adaptive top-k relative drop-off from the best score (default: 0.1)")
+    args = parser.parse_args()
+
+    embedding_model = get_embedding_service(args.model_name).start()
+    index, paragraphs = rag_step.initialize_faiss_index(args.doc_path, embedding_model)
+    template_path = Path(current_dir).parent / "data/V3 - Template Clause MLL.json"
+    clauses = rag_step.extract_clauses_from_json(template_path)
+
+    results = benchmark_retrieval(clauses, embedding_model, index, paragraphs, args.retrieved_k, args.repeats)
+    print(f"Queries: {len(clauses)}, paragraphs: {len(paragraphs)}, k: {args.retrieved_k}")
+    for mode in ("per_query", "batched"):
+        print(f"  {mode:<10}: {results[mode]['seconds']} s ({results[mode]['queries_per_second']} queries/s)")
+    print(f"  Speedup   : {results['speedup']}x")
+
+    import tiktoken
+
+    adaptive = compare_adaptive_k(clauses, embedding_model, index, paragraphs, args.retrieved_k, args.min_score,
+                                  args.max_score_drop, tiktoken.get_encoding("o200k_base"))
+    print(f"Retrieved prompt context: {adaptive['fixed_tokens']} tokens with k={args.retrieved_k}, "
+          f"{adaptive['adaptive_tokens']} adaptive ({adaptive['reduction']:.0%} fewer, "
+          f"mean k {adaptive['retrieval']['mean_k']}, k counts {adaptive['retrieval']['k_counts']})")
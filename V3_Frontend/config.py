@@ -1,5 +1,7 @@
 import os
 from pathlib import Path
+
+from workspace import new_run_id
 # os.environ["PROCESS_STEP1_JSON"] = "V3-missing-o1-2024-12-17-Sample 10-K3.json"
 # os.environ["PROCESS_STEP2_JSON"] = "TEST - V3-missing-o1-2024-12-17-Sample 10-K3.json"
 # os.environ["OPENAI_MODEL_DEVIATING"] = "gpt-4o-2024-08-06" #"o1-2024-12-17"
@@ -15,7 +17,10 @@ OPENAI_MODEL_ADDITIONAL = os.environ.get("OPENAI_MODEL_ADDITIONAL")
 RETRIEVED_K = int(os.environ.get("RETRIEVED_K", 3))
 PROCESS_STEP1_JSON = os.environ.get("PROCESS_STEP1_JSON")
 PROCESS_STEP2_JSON = os.environ.get("PROCESS_STEP2_JSON")
-BASEDIR = Path(os.environ.get("BASEDIR"))
+BASEDIR = Path(os.environ.get("BASEDIR", Path(__file__).resolve().parent.parent))
+# Step 3 pre-filter: paragraphs whose best template clause similarity is below this are candidate
+# additional clauses. Not calibrated yet, hence the pre-filter is off by default.
+DEFAULT_CANDIDATE_THRESHOLD = 0.5
 
 # PRICE PER TOKEN
 MODEL_PRICING = {
@@ -30,6 +35,23 @@ MODEL_PRICING = {
     "gpt-4.1-mini-2025-04-14": {"input": 0.0000125, "output": 0.0000044},
     "gpt-5-2025-08-07": {"input": 0.00000125, "output": 0.00001}
 }
+
+# CONTEXT WINDOW IN TOKENS (token_budget.py)
+MODEL_CONTEXT_TOKENS = {
+    "gpt-4o-2024-08-06": 128000,
+    "gpt-4.1-2025-04-14": 1047576,
+    "o1-2024-12-17": 200000,
+    "o3-2025-04-16": 200000,
+    "o4-mini-2025-04-16": 200000,
+    "o3-mini-2025-01-31": 200000,
+    "gpt-4.1-mini-2025-04-14": 1047576,
+    "gpt-5-2025-08-07": 400000,
+}
+
+# TIME TO LIVE OF CACHED LLM RESPONSES IN SECONDS (llm_cache.py)
+LLM_CACHE_TTL_SECONDS = {
+    "default": 30 * 24 * 3600,
+}
 """
 
 SAMPLE_DOC = "Sample 10"
@@ -43,4 +65,163 @@ RETRIEVED_K = 3
 PROCESS_STEP1_JSON= f"V3-missing-{OPENAI_MODEL_MISSING}-{SAMPLE_DOC}-K{RETRIEVED_K}.json"
 PROCESS_STEP2_JSON = f"V3-deviating-{OPENAI_MODEL_DEVIATING}-{SAMPLE_DOC}.json"
 
-"""
\ No newline at end of file
+"""
+
+
+class PipelineConfig:
+    def __init__(self, sample_doc, doc_path, model_name="lucagafner/NDA_finetuned_V1",
+                 missing_model="o1-2024-12-17", deviating_model="o1-2024-12-17",
+                 additional_model="o1-2024-12-17", retrieved_k=3, step1_json=None,
+                 step2_json=None, openai_key=None, basedir=None, embedding_batch_size=64,
+                 llm_concurrency=8, use_llm_cache=True, llm_cache_path=None, llm_cache_max_mb=256,
+                 prompt_snapshot=None, offline_prompts=False, trace_sink="opik", trace_path=None,
+                 use_index_cache=True, segment_clauses=False, context_token_budget=2000,
+                 batch_mode=False, batch_poll_interval=30.0, batch_timeout=None, output_dir=None,
+                 metrics_path=None, prometheus_path=None, llm_max_retries=4, llm_deadline=600.0, llm_hedge=False,
+                 llm_hedge_quantile=0.95, run_id=None, workspace_root=None, workspace_retention_hours=72.0,
+                 adaptive_k=False, min_score=0.3, max_score_drop=0.1, entail_above=None, missing_below=None,
+                 additional_prefilter=False, additional_threshold=DEFAULT_CANDIDATE_THRESHOLD):
+        """
+        Holds the parameters of a single pipeline run.
+
+        Parameters:
+        - sample_doc (str): Name of the analysed document (e.g. "Sample 2.docx").
+        - doc_path (str): Path to the .docx file.
+        - model_name (str): Sentence-transformers model used for retrieval.
+        - missing_model / deviating_model / additional_model (str): OpenAI models for steps 1-3.
+        - retrieved_k (int): Number of paragraphs retrieved per template clause.
+        - step1_json / step2_json (str): Output filenames, auto-generated if not given.
+        - openai_key (str): OpenAI API key, falls back to OPENAI_API_KEY if not given.
+        - basedir (str | Path): Repository root, defaults to the parent of V3_Frontend.
+        - embedding_batch_size (int): Maximum batch size of the shared embedding service.
+        - llm_concurrency (int): Maximum number of concurrent LLM requests in steps 1 and 2.
+        - use_llm_cache (bool): Whether OpenAI responses are served from / stored in the SQLite cache.
+        - llm_cache_path (str | Path): Cache database, defaults to V3_Frontend/temp/llm_cache.sqlite3.
+        - llm_cache_max_mb (int): Size above which least recently used cache entries are evicted.
+        - prompt_snapshot (str | Path): Local prompt snapshot, used as fallback when Opik is unreachable.
+        - offline_prompts (bool): Read prompts only from prompt_snapshot and don't contact Opik.
+        - trace_sink (str): Where LLM call traces go: "opik", "jsonl" or "none".
+        - trace_path (str | Path): File of the jsonl trace sink, defaults to V3_Frontend/temp/traces.jsonl.
+        - use_index_cache (bool): Whether document FAISS indexes are reused across runs.
+        - segment_clauses (bool): Index clause-level units (see segmentation.py) instead of raw paragraphs
+          (opt-in until its step 1/2 results are evaluated on the sample documents).
+        - context_token_budget (int): Maximum tokens of retrieved context pasted into one step 1 prompt; step 2
+          and the results keep the full paragraphs.
+        - batch_mode (bool): Send the LLM requests through the OpenAI Batch API (pipeline.analyze_batch).
+        - batch_poll_interval (float): Seconds between batch status checks.
+        - batch_timeout (float): Seconds after which a batch run gives up waiting, None to wait for the batch.
+        - output_dir (str | Path): Directory for the result JSON files and the PDF, instead of the
+          run's workspace.
+        - metrics_path (str | Path): Append-only JSONL log of every LLM call (metrics.py), defaults to
+          V3_Frontend/temp/metrics.jsonl.
+        - prometheus_path (str | Path): If set, the metrics of the run are also written there as
+          Prometheus text exposition.
+        - llm_max_retries (int): Retries of a failed LLM call (429, 5xx, timeouts) with jittered backoff.
+        - llm_deadline (float): Seconds an LLM call may take including retries, None for no deadline.
+        - llm_hedge (bool): Send a duplicate of LLM calls slower than the llm_hedge_quantile latency.
+        - llm_hedge_quantile (float): Latency quantile of the recent calls after which a call is hedged.
+        - run_id (str): ID of the run in its workspace, the metrics and the job store; generated if not given.
+        - workspace_root (str | Path): Directory of the per-run workspaces, defaults to V3_Frontend/temp/runs.
+        - workspace_retention_hours (float): Workspaces idle for longer are removed when a run starts;
+          None or 0 keeps them.
+        - adaptive_k (bool): Choose the number of retrieved paragraphs per template clause from their
+          scores, with retrieved_k as the maximum (see 1_V3_RAG.choose_k).
+        - min_score (float): Adaptive top-k: paragraphs below this similarity are dropped (the best one is kept).
+        - max_score_drop (float): Adaptive top-k: paragraphs scoring more than this fraction below the
+          best one are dropped.
+        - entail_above / missing_below (float): Step 1 answers "entailment" / "missing" without an LLM
+          call when the best retrieval score is at least / below the threshold; None asks the LLM
+          (fit them with score_thresholds.py).
+        - additional_prefilter (bool): Send step 3 only the paragraphs that match no template clause,
+          with the template clause names instead of the whole template (opt-in).
+        - additional_threshold (float): Paragraphs whose best template clause similarity is below this
+          are step 3 candidates.
+        """
+        self.sample_doc = sample_doc
+        self.doc_path = doc_path
+        self.model_name = model_name
+        self.missing_model = missing_model
+        self.deviating_model = deviating_model
+        self.additional_model = additional_model
+        self.retrieved_k = int(retrieved_k)
+        self.openai_key = openai_key
+        self.basedir = Path(basedir) if basedir else Path(__file__).resolve().parent.parent
+        self.embedding_batch_size = int(embedding_batch_size)
+        self.llm_concurrency = int(llm_concurrency)
+        self.use_llm_cache = use_llm_cache
+        self.llm_cache_path = Path(llm_cache_path) if llm_cache_path else self.basedir / "V3_Frontend/temp/llm_cache.sqlite3"
+        self.llm_cache_max_mb = int(llm_cache_max_mb)
+        self.prompt_snapshot = Path(prompt_snapshot) if prompt_snapshot else None
+        self.offline_prompts = offline_prompts
+        self.trace_sink = trace_sink
+        self.trace_path = Path(trace_path) if trace_path else self.basedir / "V3_Frontend/temp/traces.jsonl"
+        self.use_index_cache = use_index_cache
+        self.index_cache_dir = self.basedir / "V3_Frontend/temp/index_cache"
+        self.document_cache_dir = self.basedir / "V3_Frontend/temp/document_cache"
+        self.segment_clauses = segment_clauses
+        self.context_token_budget = int(context_token_budget)
+        self.batch_mode = batch_mode
+        self.batch_poll_interval = float(batch_poll_interval)
+        self.batch_timeout = float(batch_timeout) if batch_timeout else None
+        self.output_dir = Path(output_dir) if output_dir else None
+        self.metrics_path = Path(metrics_path) if metrics_path else self.basedir / "V3_Frontend/temp/metrics.jsonl"
+        self.prometheus_path = Path(prometheus_path) if prometheus_path else None
+        self.llm_max_retries = int(llm_max_retries)
+        self.llm_deadline = float(llm_deadline) if llm_deadline else None
+        self.llm_hedge = llm_hedge
+        self.llm_hedge_quantile = float(llm_hedge_quantile)
+        self.run_id = run_id or new_run_id()
+        self.workspace_root = Path(workspace_root) if workspace_root else self.basedir / "V3_Frontend/temp/runs"
+        self.workspace_retention_hours = float(workspace_retention_hours) if workspace_retention_hours else None
+        self.adaptive_k = adaptive_k
+        self.min_score = float(min_score) if min_score is not None else None
+        self.max_score_drop = float(max_score_drop) if max_score_drop is not None else None
+        self.entail_above = float(entail_above) if entail_above is not None else None
+        self.missing_below = float(missing_below) if missing_below is not None else None
+        self.additional_prefilter = additional_prefilter
+        self.additional_threshold = float(additional_threshold)
+
+        self.sample = sample_doc.split(".")[0]
+        self.step1_json = step1_json or f"V3-missing-{missing_model}-{self.sample}-K{self.retrieved_k}.json"
+        self.step2_json = step2_json or f"V3-deviating-{deviating_model}-{self.sample}.json"
+
+    @property
+    def retrieval_thresholds(self):
+        """Keyword arguments of retrieve_template_clauses(); fixed top-k unless adaptive_k is set."""
+        if not self.adaptive_k:
+            return {"min_score": None, "max_drop": None}
+        return {"min_score": self.min_score, "max_drop": self.max_score_drop}
+
+    @property
+    def template_path(self):
+        return self.basedir / "data/V3 - Template Clause MLL.json"
+
+    @property
+    def frontend_dir(self):
+        return self.basedir / "V3_Frontend"
+
+    @property
+    def temp_dir(self):
+        return self.frontend_dir / "temp"
+
+    @property
+    def workspace_dir(self):
+        """Where this run writes its files: output_dir if given, else its own workspace."""
+        return self.output_dir or self.workspace_root / self.run_id
+
+    @classmethod
+    def from_env(cls):
+        """Builds a config from the environment variables set by run_pipeline.py."""
+        return cls(
+            sample_doc=SAMPLE_DOC,
+            doc_path=DOC_PATH,
+            model_name=MODEL_NAME,
+            missing_model=OPENAI_MODEL_MISSING,
+            deviating_model=OPENAI_MODEL_DEVIATING,
+            additional_model=OPENAI_MODEL_ADDITIONAL,
+            retrieved_k=RETRIEVED_K,
+            step1_json=PROCESS_STEP1_JSON,
+            step2_json=PROCESS_STEP2_JSON,
+            openai_key=os.environ.get("OPENAI_API_KEY"),
+            basedir=BASEDIR,
+        )
@@ -0,0 +1,228 @@
+"""
+document.py
+Intermediate representation of the analysed contract.
+
+The DOCX is parsed once per run (and once per content hash across runs thanks to
+the binary cache) and the resulting DocumentIR is handed to every step, so the
+retrieval paragraphs of step 1 and the full text of step 3 come from the same
+parse.
+
+Like docx2txt, which step 3 used before, the IR holds the headers, the body (with
+text boxes and tables) and the footers, in that order. Merged table cells are read
+once, not once per grid cell they span.
+"""
+
+import json
+import os
+import re
+import zlib
+from pathlib import Path
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+
+from embedding_cache import file_sha256
+
+DEFAULT_DOCUMENT_CACHE_DIR = Path(__file__).resolve().parent / "temp" / "document_cache"
+
+PARAGRAPH_SEPARATOR = "\n\n"
+CACHE_MAGIC = b"DOCIR"
+# 2: headers, footers and text boxes, merged cells read once
+CACHE_VERSION = 2
+
+_MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
+# Manually typed clause numbers such as "2.", "2.1", "2.1.3)" or "(a)"
+_NUMBERING = re.compile(r"^\s*(\(?[0-9]+(?:\.[0-9]+)*[.)]?|\([a-z]{1,3}\)|[a-z]\))\s+", re.IGNORECASE)
+
+
+class DocumentParagraph:
+    def __init__(self, id, text, start, end, numbering=None, list_level=None, style=None, source="body"):
+        """
+        A non-empty paragraph of the document.
+
+        Parameters:
+        - id (str): Stable ID derived from the position in the document ("p0001", ...).
+        - text (str): Stripped paragraph text.
+        - start / end (int): Character offsets of the text within DocumentIR.full_text.
+        - numbering (str): Clause number typed at the start of the paragraph, e.g. "2.1".
+        - list_level (int): Level of Word's automatic list numbering, if any.
+        - style (str): Name of the Word paragraph style.
+        - source (str): "body", "table", "textbox", "header" or "footer".
+        """
+        self.id = id
+        self.text = text
+        self.start = start
+        self.end = end
+        self.numbering = numbering
+        self.list_level = list_level
+        self.style = style
+        self.source = source
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return f"DocumentParagraph(id={self.id!r}, numbering={self.numbering!r}, text={self.text[:40]!r})"
+
+
+class DocumentIR:
+    def __init__(self, source_path, sha256, paragraphs):
+        """
+        Parameters:
+        - source_path (str): Path of the parsed file.
+        - sha256 (str): Content hash of the file.
+        - paragraphs (list[DocumentParagraph]): Paragraphs in document order.
+        """
+        self.source_path = str(source_path)
+        self.sha256 = sha256
+        self.paragraphs = paragraphs
+
+    @property
+    def full_text(self):
+        return PARAGRAPH_SEPARATOR.join(paragraph.text for paragraph in self.paragraphs)
+
+    def texts(self):
+        return [paragraph.text for paragraph in self.paragraphs]
+
+    def to_bytes(self):
+        """Serializes the IR to the compact binary cache format (zlib-compressed JSON)."""
+        payload = {
+            "source_path": self.source_path,
+            "sha256": self.sha256,
+            "paragraphs": [paragraph.to_dict() for paragraph in self.paragraphs],
+        }
+        body = zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        return CACHE_MAGIC + bytes([CACHE_VERSION]) + body
+
+    @classmethod
+    def from_bytes(cls, data):
+        if data[:len(CACHE_MAGIC)] != CACHE_MAGIC or data[len(CACHE_MAGIC)] != CACHE_VERSION:
+            raise ValueError("Not a document IR cache file of the current version")
+        payload = json.loads(zlib.decompress(data[len(CACHE_MAGIC) + 1:]).decode("utf-8"))
+        paragraphs = [DocumentParagraph(**paragraph) for paragraph in payload["paragraphs"]]
+        return cls(payload["source_path"], payload["sha256"], paragraphs)
+
+
+def _textbox_paragraphs(element, parent):
+    """Paragraphs of the text boxes anchored in element (a paragraph or table)."""
+    for textbox in element.iter(qn("w:txbxContent")):
+        # Word stores each text box twice: as DrawingML and as a VML fallback for old readers
+        if any(ancestor.tag == _MC_FALLBACK for ancestor in textbox.iterancestors()):
+            continue
+        for p in textbox.iter(qn("w:p")):
+            yield Paragraph(p, parent), "textbox"
+
+
+def _iter_container_paragraphs(container, parent, source):
+    """Yields (paragraph, source) for the paragraphs and table cells of a body, header or footer."""
+    for child in container.iterchildren():
+        if child.tag == qn("w:p"):
+            yield Paragraph(child, parent), source
+            yield from _textbox_paragraphs(child, parent)
+        elif child.tag == qn("w:tbl"):
+            seen = set()
+            for row in Table(child, parent).rows:
+                for cell in row.cells:
+                    # A merged cell is returned for every grid cell it spans, across columns and rows
+                    if cell._tc in seen:
+                        continue
+                    seen.add(cell._tc)
+                    for paragraph in cell.paragraphs:
+                        yield paragraph, "table" if source == "body" else source
+            yield from _textbox_paragraphs(child, parent)
+
+
+def _header_footer_parts(doc, kind):
+    """The distinct header or footer definitions of the sections (linked ones share a part)."""
+    seen = set()
+    for section in doc.sections:
+        candidates = [getattr(section, kind)]
+        if section.different_first_page_header_footer:
+            candidates.append(getattr(section, f"first_page_{kind}"))
+        if doc.settings.odd_and_even_pages_header_footer:
+            candidates.append(getattr(section, f"even_page_{kind}"))
+        for header_footer in candidates:
+            if header_footer.is_linked_to_previous:
+                continue
+            part = header_footer.part
+            if part.partname in seen:
+                continue
+            seen.add(part.partname)
+            yield header_footer
+
+
+def _iter_block_paragraphs(doc):
+    """Yields (paragraph, source) for header, body (with tables and text boxes) and footer paragraphs."""
+    for header in _header_footer_parts(doc, "header"):
+        yield from _iter_container_paragraphs(header._element, header, "header")
+    yield from _iter_container_paragraphs(doc.element.body, doc, "body")
+    for footer in _header_footer_parts(doc, "footer"):
+        yield from _iter_container_paragraphs(footer._element, footer, "footer")
+
+
+def _list_level(paragraph):
+    p_pr = paragraph._p.pPr
+    if p_pr is None or p_pr.numPr is None or p_pr.numPr.ilvl is None:
+        return None
+    return int(p_pr.numPr.ilvl.val)
+
+
+def parse_docx(file_path, sha256=None):
+    """Parses a .docx file into a DocumentIR."""
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+    doc = Document(file_path)
+
+    paragraphs = []
+    offset = 0
+    for paragraph, source in _iter_block_paragraphs(doc):
+        text = paragraph.text.strip()
+        if not text:
+            continue
+        if paragraphs:
+            offset += len(PARAGRAPH_SEPARATOR)
+        numbering_match = _NUMBERING.match(text)
+        paragraphs.append(DocumentParagraph(
+            id=f"p{len(paragraphs) + 1:04d}",
+            text=text,
+            start=offset,
+            end=offset + len(text),
+            numbering=numbering_match.group(1).strip("().") if numbering_match else None,
+            list_level=_list_level(paragraph),
+            style=paragraph.style.name if paragraph.style is not None else None,
+            source=source,
+        ))
+        offset += len(text)
+
+    return DocumentIR(file_path, sha256 or file_sha256(file_path), paragraphs)
+
+
+def load_document(file_path, cache_dir=DEFAULT_DOCUMENT_CACHE_DIR):
+    """
+    Returns the DocumentIR of a .docx file, read from the binary cache if the same
+    content was parsed before. Pass cache_dir=None to always parse.
+    """
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found: {file_path}")
+    sha256 = file_sha256(file_path)
+    if cache_dir is None:
+        return parse_docx(file_path, sha256)
+
+    cache_path = Path(cache_dir) / f"{sha256}.docir"
+    if cache_path.exists():
+        try:
+            document = DocumentIR.from_bytes(cache_path.read_bytes())
+            document.source_path = str(file_path)
+            return document
+        except (ValueError, zlib.error):
+            print(f"Document cache {cache_path.name} is unreadable, parsing again.")
+
+    document = parse_docx(file_path, sha256)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_name(f"{cache_path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(document.to_bytes())
+    os.replace(tmp_path, cache_path)
+    return document
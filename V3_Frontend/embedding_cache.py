@@ -0,0 +1,154 @@
+"""
+embedding_cache.py
+On-disk caches for embeddings that don't change between runs.
+
+Template clause embeddings are stored next to the template JSON as a normalized
+float32 .npy file whose name contains the embedding model and the SHA-256 of the
+template, so editing the template or switching the model rebuilds the cache.
+
+Document indexes (paragraphs, normalized embeddings and the serialized FAISS
+index) are stored per document content hash and embedding model, so re-running
+a contract with other OpenAI models or another k skips parsing and encoding.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+
+import faiss
+import numpy as np
+
+DEFAULT_INDEX_CACHE_DIR = Path(__file__).resolve().parent / "temp" / "index_cache"
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """Returns the hex SHA-256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def units_sha256(units):
+    """SHA-256 of a list of retrieval units; the cache key of an index over units instead of the file's paragraphs."""
+    return hashlib.sha256(json.dumps(list(units), ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def model_slug(model_name):
+    """Turns a model name like 'lucagafner/NDA_finetuned_V1' into a filename-safe string."""
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)
+
+
+def normalize_rows(embeddings):
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def save_npy_atomic(path, array):
+    """Writes an array via a temporary file so readers never see a half-written cache."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def template_embeddings_path(template_path, model_name, template_hash=None):
+    template_path = Path(template_path)
+    template_hash = template_hash or file_sha256(template_path)
+    return template_path.with_name(f"{template_path.stem}.{model_slug(model_name)}.{template_hash[:16]}.npy")
+
+
+def load_template_embeddings(template_path, clauses, embedding_model, model_name):
+    """
+    Returns the normalized embeddings of the template clauses, one row per clause.
+
+    The model is only used when no valid cache exists for (model_name, template hash);
+    otherwise the cached file is memory-mapped.
+
+    Parameters:
+    - template_path (str | Path): Path to the template clause JSON.
+    - clauses (list[str]): The template clause texts in template order.
+    - embedding_model: Anything with an encode(list[str]) method.
+    - model_name (str): Name of the embedding model, part of the cache key.
+    """
+    template_path = Path(template_path)
+    cache_path = template_embeddings_path(template_path, model_name)
+
+    if cache_path.exists():
+        embeddings = np.load(cache_path, mmap_mode="r")
+        if embeddings.shape[0] == len(clauses):
+            return embeddings
+        print(f"Template embedding cache {cache_path.name} doesn't match the template, rebuilding.")
+
+    embeddings = normalize_rows(embedding_model.encode(list(clauses)))
+    save_npy_atomic(cache_path, embeddings)
+
+    # Remove caches of older template versions for the same model; the glob also matches
+    # models whose slug merely starts with this one ("foo" vs. "foo.2"), so the name is parsed
+    slug = model_slug(model_name)
+    for stale in template_path.parent.glob(f"{template_path.stem}.{slug}.*.npy"):
+        stale_slug, _, stale_hash = stale.name[len(template_path.stem) + 1:-len(".npy")].rpartition(".")
+        if stale_slug == slug and re.fullmatch(r"[0-9a-f]{16}", stale_hash) and stale != cache_path:
+            stale.unlink(missing_ok=True)
+
+    print(f"Template embeddings cached in {cache_path.name}.")
+    return np.load(cache_path, mmap_mode="r")
+
+
+def document_cache_dir(doc_path, model_name, cache_dir=DEFAULT_INDEX_CACHE_DIR, doc_hash=None):
+    doc_hash = doc_hash or file_sha256(doc_path)
+    return Path(cache_dir) / f"{doc_hash[:32]}-{model_slug(model_name)}"
+
+
+def load_document_index(doc_path, model_name, cache_dir=DEFAULT_INDEX_CACHE_DIR, doc_hash=None):
+    """
+    Returns (index, paragraphs, embeddings) from the cache, or None if the document
+    hasn't been indexed with this model yet. The index and embeddings are memory-mapped.
+    Pass doc_hash if the document's SHA-256 is already known to skip hashing the file.
+    """
+    entry_dir = document_cache_dir(doc_path, model_name, cache_dir, doc_hash)
+    if not (entry_dir / "index.faiss").exists():
+        return None
+
+    with open(entry_dir / "paragraphs.json", "r", encoding="utf-8") as f:
+        paragraphs = json.load(f)
+    embeddings = np.load(entry_dir / "embeddings.npy", mmap_mode="r")
+    try:
+        index = faiss.read_index(str(entry_dir / "index.faiss"), faiss.IO_FLAG_MMAP)
+    except RuntimeError:
+        # Not every FAISS build can memory-map flat indexes
+        index = faiss.read_index(str(entry_dir / "index.faiss"))
+
+    if index.ntotal != len(paragraphs) or embeddings.shape[0] != len(paragraphs):
+        print(f"Index cache {entry_dir.name} is inconsistent, rebuilding.")
+        return None
+    return index, paragraphs, embeddings
+
+
+def save_document_index(doc_path, model_name, paragraphs, embeddings, index, cache_dir=DEFAULT_INDEX_CACHE_DIR,
+                        doc_hash=None):
+    """Stores a document's paragraphs, normalized embeddings and FAISS index in the cache."""
+    entry_dir = document_cache_dir(doc_path, model_name, cache_dir, doc_hash)
+    tmp_dir = entry_dir.with_name(f"{entry_dir.name}.{os.getpid()}.tmp")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    with open(tmp_dir / "paragraphs.json", "w", encoding="utf-8") as f:
+        json.dump(paragraphs, f, ensure_ascii=False)
+    np.save(tmp_dir / "embeddings.npy", np.asarray(embeddings, dtype=np.float32))
+    faiss.write_index(index, str(tmp_dir / "index.faiss"))
+
+    shutil.rmtree(entry_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, entry_dir)
+    except OSError:
+        # Another run stored the same document at the same time
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return entry_dir
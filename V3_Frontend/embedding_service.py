@@ -0,0 +1,185 @@
+"""
+embedding_service.py
+Keeps sentence-transformers models resident for the lifetime of the process so that
+pipeline runs (CLI or Streamlit sessions) don't pay the model load on every analysis.
+Concurrent encode requests are merged into shared batches by a single worker thread.
+"""
+
+import argparse
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+DEFAULT_MODEL_NAME = "lucagafner/NDA_finetuned_V1"
+DEFAULT_MAX_BATCH_SIZE = 64
+
+_services = {}
+_services_lock = threading.Lock()
+
+
+class _EncodeRequest:
+    def __init__(self, sentences):
+        self.sentences = sentences
+        self.future = Future()
+
+
+class EmbeddingService:
+    def __init__(self, model_name=DEFAULT_MODEL_NAME, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+        """
+        Wraps a SentenceTransformer that is loaded once and then shared.
+
+        Parameters:
+        - model_name (str): Hugging Face name or local path of the model.
+        - max_batch_size (int): Maximum number of sentences encoded in one forward batch.
+        """
+        self.model_name = model_name
+        self.max_batch_size = int(max_batch_size)
+        self._model = None
+        self._load_error = None
+        self._load_time_seconds = None
+        self._ready = threading.Event()
+        self._start_lock = threading.Lock()
+        self._started = False
+        self._queue = queue.Queue()
+        self._requests = 0
+        self._batches = 0
+        self._encoded_sentences = 0
+
+    def start(self, wait=True):
+        """Loads the model and starts the batching worker (only the first call does any work)."""
+        with self._start_lock:
+            if not self._started:
+                self._started = True
+                threading.Thread(target=self._run, name=f"embedding-{self.model_name}", daemon=True).start()
+        if wait:
+            self.wait_until_ready()
+        return self
+
+    def wait_until_ready(self, timeout=None):
+        if not self._ready.wait(timeout):
+            raise TimeoutError(f"Embedding model '{self.model_name}' is not ready after {timeout} s")
+        if self._load_error is not None:
+            raise RuntimeError(f"Embedding model '{self.model_name}' failed to load") from self._load_error
+
+    def is_ready(self):
+        return self._ready.is_set() and self._load_error is None
+
+    def health(self):
+        """Returns a readiness report that can be shown in the app or logged."""
+        if not self._started:
+            status = "stopped"
+        elif not self._ready.is_set():
+            status = "loading"
+        elif self._load_error is not None:
+            status = "error"
+        else:
+            status = "ready"
+        return {
+            "model_name": self.model_name,
+            "status": status,
+            "error": repr(self._load_error) if self._load_error else None,
+            "load_time_seconds": self._load_time_seconds,
+            "max_batch_size": self.max_batch_size,
+            "queued_requests": self._queue.qsize(),
+            "requests": self._requests,
+            "batches": self._batches,
+            "encoded_sentences": self._encoded_sentences,
+        }
+
+    def get_sentence_embedding_dimension(self):
+        self.start()
+        return self._model.get_sentence_embedding_dimension()
+
+    def encode(self, sentences, **kwargs):
+        """
+        Encodes sentences with the shared model. Mirrors SentenceTransformer.encode for the
+        calls made in this project, so the service can be passed wherever a model is expected.
+        Extra keyword arguments (e.g. show_progress_bar) are accepted and ignored.
+        """
+        single = isinstance(sentences, str)
+        sentences = [sentences] if single else list(sentences)
+        self.start()
+        if not sentences:
+            return np.zeros((0, self._model.get_sentence_embedding_dimension()), dtype=np.float32)
+
+        request = _EncodeRequest(sentences)
+        self._queue.put(request)
+        embeddings = request.future.result()
+        return embeddings[0] if single else embeddings
+
+    def _run(self):
+        start_time = time.time()
+        try:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model_name)
+        except Exception as e:
+            self._load_error = e
+        self._load_time_seconds = round(time.time() - start_time, 1)
+        self._ready.set()
+
+        while True:
+            batch = [self._queue.get()]
+            size = len(batch[0].sentences)
+            # Merge whatever else is waiting, up to the batch limit
+            while size < self.max_batch_size:
+                try:
+                    request = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.sentences)
+            self._encode_batch(batch)
+
+    def _encode_batch(self, batch):
+        if self._load_error is not None:
+            for request in batch:
+                request.future.set_exception(RuntimeError(f"Embedding model '{self.model_name}' failed to load"))
+            return
+
+        sentences = [sentence for request in batch for sentence in request.sentences]
+        try:
+            embeddings = self._model.encode(sentences, batch_size=self.max_batch_size, convert_to_numpy=True,
+                                            show_progress_bar=False)
+        except Exception as e:
+            for request in batch:
+                request.future.set_exception(e)
+            return
+
+        self._requests += len(batch)
+        self._batches += 1
+        self._encoded_sentences += len(sentences)
+        offset = 0
+        for request in batch:
+            request.future.set_result(embeddings[offset:offset + len(request.sentences)])
+            offset += len(request.sentences)
+
+
+def get_embedding_service(model_name=DEFAULT_MODEL_NAME, max_batch_size=DEFAULT_MAX_BATCH_SIZE):
+    """
+    Returns the process-wide service for model_name, creating it on first use.
+    The batch size of an existing service is raised if a larger one is requested.
+    """
+    with _services_lock:
+        service = _services.get(model_name)
+        if service is None:
+            service = EmbeddingService(model_name, max_batch_size)
+            _services[model_name] = service
+        elif max_batch_size > service.max_batch_size:
+            service.max_batch_size = int(max_batch_size)
+    return service
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load an embedding model and report its readiness.")
+    parser.add_argument("--model-name", "-m", default=DEFAULT_MODEL_NAME,
+                        help=f"Name of the model to be used (default: '{DEFAULT_MODEL_NAME}')")
+    parser.add_argument("--max-batch-size", type=int, default=DEFAULT_MAX_BATCH_SIZE,
+                        help=f"Maximum number of sentences per forward batch (default: {DEFAULT_MAX_BATCH_SIZE})")
+    args = parser.parse_args()
+
+    service = get_embedding_service(args.model_name, args.max_batch_size).start()
+    service.encode(["warm-up"])
+    print(service.health())
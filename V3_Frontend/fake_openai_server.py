@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+fake_openai_server.py
+A minimal stand-in for the OpenAI chat completions endpoint, used to measure the
+pipeline's LLM layer without network access or API cost.
+
+Every request sleeps for the configured latency and answers "entailment" with a
+token usage derived from the prompt length. Faults can be injected to exercise the
+retry and hedging layer (resilience.py): a share of the requests fails with
+429/500/503, and a share turns into stragglers that take slow_latency instead.
+
+The file and batch endpoints accept the same JSONL files as the OpenAI Batch API
+(see batch_jobs.py): a batch is processed in the background, request by request,
+and its output file can be downloaded once the batch is "completed". The requests of
+server.failing_ids end up in the batch's error file and those of server.dropped_ids
+get no result at all, like requests the Batch API lost.
+
+python3 V3_Frontend/fake_openai_server.py --port 8765 --latency 0.5 --error-rate 0.05 --slow-rate 0.05 --slow-latency 5
+openai.OpenAI(base_url="http://127.0.0.1:8765/v1", api_key="fake")
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status):
+        body = json.dumps({"error": {"message": f"Injected fault {status}", "type": "server_error"}}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def _read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0].rstrip("/")
+        if path.endswith("/chat/completions"):
+            request = self._read_json()
+            fault, latency = self.server.draw_fault()
+            time.sleep(latency)
+            if fault is not None:
+                self._send_error(fault)
+                return
+            self._send_json(200, chat_completion(request, self.server.answer))
+        elif path.endswith("/files"):
+            self._send_json(200, self.server.store_file(*parse_upload(self.headers["Content-Type"], self._read_body())))
+        elif path.endswith("/batches"):
+            request = self._read_json()
+            if request.get("input_file_id") not in self.server.files:
+                self._send_json(404, {"error": {"message": f"No such file {request.get('input_file_id')}"}})
+                return
+            self._send_json(200, self.server.create_batch(request))
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def do_GET(self):
+        parts = self.path.split("?", 1)[0].rstrip("/").split("/")
+        if len(parts) >= 2 and parts[-2] == "batches" and parts[-1] in self.server.batches:
+            with self.server.lock:
+                self._send_json(200, dict(self.server.batches[parts[-1]]))
+        elif len(parts) >= 3 and parts[-3] == "files" and parts[-1] == "content" and parts[-2] in self.server.files:
+            body = self.server.files[parts[-2]]["content"]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0, answer="entailment", error_rate=0.0, slow_rate=0.0, slow_latency=5.0,
+                 seed=None):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = latency
+        self.answer = answer
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.random = random.Random(seed)
+        self.faults = {"requests": 0, "errors": 0, "slow": 0}
+        self.files = {}
+        self.batches = {}
+        # custom_ids of batch requests that fail, or that are missing from the output
+        self.failing_ids = set()
+        self.dropped_ids = set()
+        self.lock = threading.Lock()
+
+    def draw_fault(self):
+        """Returns (error status or None, latency) for the next chat completion request."""
+        with self.lock:
+            self.faults["requests"] += 1
+            if self.random.random() < self.error_rate:
+                self.faults["errors"] += 1
+                # Errors come back fast, like a rejected request
+                return self.random.choice((429, 500, 503)), self.latency / 10
+            if self.random.random() < self.slow_rate:
+                self.faults["slow"] += 1
+                return None, self.slow_latency
+        return None, self.latency
+
+    def store_file(self, filename, content, purpose="batch"):
+        file_id = f"file-{uuid.uuid4().hex}"
+        entry = {
+            "id": file_id,
+            "object": "file",
+            "bytes": len(content),
+            "created_at": int(time.time()),
+            "filename": filename,
+            "purpose": purpose,
+            "status": "processed",
+        }
+        self.files[file_id] = dict(entry, content=content)
+        return entry
+
+    def create_batch(self, request):
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch = {
+            "id": batch_id,
+            "object": "batch",
+            "endpoint": request.get("endpoint"),
+            "input_file_id": request["input_file_id"],
+            "completion_window": request.get("completion_window", "24h"),
+            "status": "in_progress",
+            "created_at": int(time.time()),
+            "output_file_id": None,
+            "error_file_id": None,
+            "metadata": request.get("metadata"),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+        }
+        with self.lock:
+            self.batches[batch_id] = batch
+        threading.Thread(target=self._process_batch, args=(batch_id,), daemon=True).start()
+        return dict(batch)
+
+    def _process_batch(self, batch_id):
+        lines = [line for line in self.files[self.batches[batch_id]["input_file_id"]]["content"].decode("utf-8")
+                 .splitlines() if line.strip()]
+        with self.lock:
+            self.batches[batch_id]["request_counts"]["total"] = len(lines)
+        output, errors = [], []
+        for line in lines:
+            entry = json.loads(line)
+            time.sleep(self.latency)
+            if entry["custom_id"] in self.dropped_ids:
+                continue
+            if entry["custom_id"] in self.failing_ids:
+                errors.append(json.dumps({
+                    "id": f"batch_req_{uuid.uuid4().hex}",
+                    "custom_id": entry["custom_id"],
+                    "response": {"status_code": 500, "request_id": uuid.uuid4().hex,
+                                 "body": {"error": {"message": "Injected fault 500", "type": "server_error"}}},
+                    "error": None,
+                }))
+                with self.lock:
+                    self.batches[batch_id]["request_counts"]["failed"] += 1
+                continue
+            output.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": entry["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex,
+                             "body": chat_completion(entry["body"], self.answer)},
+                "error": None,
+            }))
+            with self.lock:
+                self.batches[batch_id]["request_counts"]["completed"] += 1
+        output_file = self.store_file(f"{batch_id}_output.jsonl", ("\n".join(output) + "\n").encode("utf-8"),
+                                      "batch_output")
+        error_file = None
+        if errors:
+            error_file = self.store_file(f"{batch_id}_errors.jsonl", ("\n".join(errors) + "\n").encode("utf-8"),
+                                         "batch_output")
+        with self.lock:
+            self.batches[batch_id].update(status="completed", output_file_id=output_file["id"],
+                                          error_file_id=error_file["id"] if error_file else None,
+                                          completed_at=int(time.time()))
+
+
+def parse_upload(content_type, body):
+    """Returns (filename, content, purpose) of a multipart/form-data file upload."""
+    message = BytesParser(policy=policy.default).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode("utf-8") + body
+    )
+    filename, content, purpose = "upload.jsonl", b"", "batch"
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name == "file":
+            filename = part.get_filename() or filename
+            content = part.get_payload(decode=True)
+        elif name == "purpose":
+            purpose = part.get_content().strip()
+    return filename, content, purpose
+
+
+def chat_completion(request, answer="entailment"):
+    """Builds a chat.completion response for a request body."""
+    prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in request.get("messages", []))
+    completion_tokens = len(answer.split())
+    if request.get("response_format", {}).get("type") == "json_object":
+        answer = json.dumps({"entries": []})
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "fake-model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": answer},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        },
+    }
+
+
+def start_fake_server(host="127.0.0.1", port=0, latency=0.0, answer="entailment", error_rate=0.0, slow_rate=0.0,
+                      slow_latency=5.0, seed=None):
+    """
+    Starts the fake server on a background thread.
+
+    Parameters:
+    - error_rate (float): Share of chat completion requests answered with 429, 500 or 503.
+    - slow_rate (float): Share of requests that take slow_latency seconds instead of latency.
+    - seed (int): Seed of the fault injection, for reproducible runs.
+
+    Returns:
+    - Tuple (server, base_url). Call server.shutdown() when done.
+    """
+    server = FakeOpenAIServer((host, port), latency, answer, error_rate, slow_rate, slow_latency, seed)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI chat completions and batch endpoint.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds each request takes (default: 0.5)")
+    parser.add_argument("--answer", default="entailment", help="Content returned for every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failing with 429/5xx")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests that are stragglers")
+    parser.add_argument("--slow-latency", type=float, default=5.0, help="Seconds a straggler takes (default: 5)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed of the fault injection")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(args.host, args.port, args.latency, args.answer, args.error_rate,
+                                         args.slow_rate, args.slow_latency, args.seed)
+    print(f"Fake OpenAI endpoint listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
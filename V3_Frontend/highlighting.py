@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+highlighting.py
+Marks the words of a modified clause that deviate from the retrieved template clause.
+
+Shared by app.py (Markdown/HTML) and the PDF generator (ReportLab markup). The
+clauses are aligned word by word with RapidFuzz's bit-parallel Levenshtein opcodes
+instead of difflib.SequenceMatcher, whose character-level version is quadratic on
+long clauses. Words are compared case-insensitively and without their whitespace,
+and a word inside a replaced block is not marked if the retrieved block contains
+it as well. Results are memoized per (modified, retrieved) pair, since the app
+re-renders the same clauses on every poll.
+
+Compare against the previous difflib implementations:
+python3 V3_Frontend/highlighting.py --words 2000 --repeat 20
+"""
+
+import argparse
+import html
+import random
+import re
+import time
+from difflib import SequenceMatcher
+from functools import lru_cache
+from xml.sax.saxutils import escape
+
+from rapidfuzz.distance import Levenshtein
+
+# A word with the whitespace that follows it, so joining the tokens restores the text
+TOKEN_PATTERN = re.compile(r"\S+\s*")
+HIGHLIGHT_COLOR = "red"
+CACHE_SIZE = 4096
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text)
+
+
+def _normalize(token):
+    return token.strip().lower()
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def diff_segments(modified, retrieved):
+    """
+    Splits the modified clause into runs of unchanged and deviating text.
+
+    Returns:
+    - Tuple of (text, deviates) pairs; joining the texts gives back modified.
+    """
+    mod_tokens = tokenize(modified)
+    if not mod_tokens:
+        return ((modified, False),) if modified else ()
+    mod_words = [_normalize(token) for token in mod_tokens]
+    ret_words = [_normalize(token) for token in tokenize(retrieved)]
+
+    deviates = [False] * len(mod_tokens)
+    for opcode in Levenshtein.opcodes(mod_words, ret_words):
+        if opcode.tag == "equal":
+            continue
+        # Words that only moved within the replaced block are not deviations
+        replaced = set(ret_words[opcode.dest_start:opcode.dest_end])
+        for i in range(opcode.src_start, opcode.src_end):
+            deviates[i] = mod_words[i] not in replaced
+
+    segments = []
+    start = 0
+    for i in range(1, len(mod_tokens) + 1):
+        if i == len(mod_tokens) or deviates[i] != deviates[start]:
+            segments.append(("".join(mod_tokens[start:i]), deviates[start]))
+            start = i
+    # Leading whitespace isn't part of any token
+    leading = modified[:len(modified) - len(modified.lstrip())]
+    if leading:
+        segments.insert(0, (leading, False))
+    return tuple(segments)
+
+
+def _render(segments, escape_text, open_tag, close_tag):
+    parts = []
+    for text, deviates in segments:
+        if deviates:
+            # Keep the trailing whitespace outside the tag
+            stripped = text.rstrip()
+            parts.append(f"{open_tag}{escape_text(stripped)}{close_tag}{text[len(stripped):]}")
+        else:
+            parts.append(escape_text(text))
+    return "".join(parts)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def highlight_html(modified, retrieved, color=HIGHLIGHT_COLOR):
+    """The modified clause for st.markdown(..., unsafe_allow_html=True), deviations in color."""
+    return _render(diff_segments(modified, retrieved), lambda text: html.escape(text, quote=False),
+                   f"<span style='color: {color};'>", "</span>")
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def highlight_reportlab(modified, retrieved, color=HIGHLIGHT_COLOR):
+    """The modified clause as ReportLab Paragraph markup, deviations in color."""
+    return _render(diff_segments(modified, retrieved), escape, f"<font color='{color}'>", "</font>")
+
+
+def clear_cache():
+    diff_segments.cache_clear()
+    highlight_html.cache_clear()
+    highlight_reportlab.cache_clear()
+
+
+# --- Baselines for the benchmark: the implementations this module replaced ---
+
+def _difflib_tokens(modified, retrieved):
+    # Former app.py version: token-level SequenceMatcher, substring scan, += string building
+    mod_tokens = tokenize(modified)
+    ret_tokens = tokenize(retrieved)
+    marked_text = ""
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, mod_tokens, ret_tokens).get_opcodes():
+        for token in mod_tokens[i1:i2]:
+            if tag == "equal":
+                marked_text += token
+            else:
+                ret_segment = "".join(ret_tokens[j1:j2]).lower()
+                if token.strip().lower() and token.strip().lower() in ret_segment:
+                    marked_text += token
+                else:
+                    marked_text += f"<font color='red'>{token}</font>"
+    return marked_text
+
+
+def _difflib_characters(modified, retrieved):
+    # Former PDF generator version: character-level SequenceMatcher
+    marked_text = ""
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, modified, retrieved).get_opcodes():
+        segment = modified[i1:i2]
+        if tag != "equal" and segment.strip():
+            marked_text += f"<font color='red'>{segment}</font>"
+        else:
+            marked_text += segment
+    return marked_text
+
+
+def _sample_clauses(words, edit_rate, seed):
+    rng = random.Random(seed)
+    vocabulary = ("the receiving party shall keep all confidential information strictly confidential and "
+                  "not disclose it to any third party without the prior written consent of the disclosing "
+                  "party except as required by law or court order").split()
+    retrieved = [rng.choice(vocabulary) for _ in range(words)]
+    modified = []
+    for word in retrieved:
+        roll = rng.random()
+        if roll < edit_rate / 3:
+            continue
+        if roll < 2 * edit_rate / 3:
+            modified.append(rng.choice(vocabulary).upper())
+        elif roll < edit_rate:
+            modified.extend([word, "notwithstanding"])
+        else:
+            modified.append(word)
+    return " ".join(modified), " ".join(retrieved)
+
+
+def _time_per_call(fn, modified, retrieved, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(modified, retrieved)
+    return (time.perf_counter() - start) / repeat
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the clause highlighting on long synthetic clauses.")
+    parser.add_argument("--words", type=int, nargs="+", default=[200, 1000, 2000],
+                        help="Clause lengths in words (default: 200 1000 2000)")
+    parser.add_argument("--edit-rate", type=float, default=0.1, help="Share of edited words (default: 0.1)")
+    parser.add_argument("--repeat", type=int, default=5, help="Calls per measurement (default: 5)")
+    args = parser.parse_args()
+
+    def uncached(modified, retrieved):
+        clear_cache()
+        return highlight_reportlab(modified, retrieved)
+
+    for words in args.words:
+        modified, retrieved = _sample_clauses(words, args.edit_rate, seed=words)
+        highlight_reportlab(modified, retrieved)
+        timings = {
+            "difflib characters": _time_per_call(_difflib_characters, modified, retrieved, args.repeat),
+            "difflib tokens": _time_per_call(_difflib_tokens, modified, retrieved, args.repeat),
+            "rapidfuzz tokens": _time_per_call(uncached, modified, retrieved, args.repeat),
+            "rapidfuzz memoized": _time_per_call(highlight_reportlab, modified, retrieved, args.repeat),
+        }
+        print(f"{words} words ({len(modified)} characters):")
+        for name, seconds in timings.items():
+            print(f"  {name:<19}: {seconds * 1000:9.3f} ms  "
+                  f"({timings['difflib characters'] / seconds:8.1f}x vs. difflib characters)")
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+job_store.py
+Durable queue of analysis jobs in a SQLite database.
+
+The app submits a job (the uploaded document and the run_pipeline.py options) and
+polls its status, progress events and result. Workers (worker.py), on this host or
+on others sharing the database file, claim queued jobs under a lease and renew it
+with heartbeats while they run. A job whose lease runs out, because its worker died
+or lost the connection, is queued again on the next claim, up to max_attempts.
+
+The document is stored in the job itself, so workers only need the database, not
+the file system of the host that submitted the job. OpenAI keys never go into the
+database: workers use their own OPENAI_API_KEY, and a job that has to run with the
+submitter's key is pinned (affinity) to an in-process worker that got the key in memory.
+Workers report in every poll, so the app can tell whether any worker is alive.
+
+The database uses a rollback journal instead of WAL, since WAL doesn't work on
+network file systems.
+
+python3 V3_Frontend/job_store.py submit "data/raw/Sample 2.docx" -- -a gpt-4.1-2025-04-14 -b gpt-4.1-2025-04-14 -c gpt-4.1-2025-04-14
+python3 V3_Frontend/job_store.py list
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+DEFAULT_JOB_STORE_PATH = Path(__file__).resolve().parent / "temp" / "jobs.sqlite3"
+DEFAULT_LEASE_SECONDS = 120
+DEFAULT_MAX_ATTEMPTS = 3
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINAL_STATUSES = (DONE, FAILED)
+
+JOB_FIELDS = ("id", "status", "sample_doc", "filename", "args", "affinity", "attempts", "max_attempts", "worker_id",
+              "created_at", "started_at", "finished_at", "heartbeat_at", "lease_expires_at", "result", "error")
+
+
+def default_job_store_path():
+    """JOB_STORE_PATH if set (e.g. a database on shared storage), else V3_Frontend/temp/jobs.sqlite3."""
+    return Path(os.getenv("JOB_STORE_PATH") or DEFAULT_JOB_STORE_PATH)
+
+
+def _job(row):
+    job = dict(zip(JOB_FIELDS, row))
+    job["args"] = json.loads(job["args"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+class JobStore:
+    def __init__(self, path=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+        """
+        Parameters:
+        - path (str | Path): SQLite database file, defaults to default_job_store_path().
+        - lease_seconds (float): How long a claimed job stays with its worker without a heartbeat.
+        """
+        self.path = Path(path) if path else default_job_store_path()
+        self.lease_seconds = float(lease_seconds)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self._transaction() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                       id TEXT PRIMARY KEY,
+                       status TEXT NOT NULL,
+                       sample_doc TEXT NOT NULL,
+                       filename TEXT NOT NULL,
+                       document BLOB NOT NULL,
+                       args TEXT NOT NULL,
+                       affinity TEXT,
+                       attempts INTEGER NOT NULL DEFAULT 0,
+                       max_attempts INTEGER NOT NULL,
+                       worker_id TEXT,
+                       created_at REAL NOT NULL,
+                       started_at REAL,
+                       finished_at REAL,
+                       heartbeat_at REAL,
+                       lease_expires_at REAL,
+                       result TEXT,
+                       error TEXT
+                   )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS job_events (
+                       id INTEGER PRIMARY KEY AUTOINCREMENT,
+                       job_id TEXT NOT NULL,
+                       created_at REAL NOT NULL,
+                       event TEXT NOT NULL
+                   )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS job_events_job ON job_events (job_id, id)")
+            conn.execute("CREATE TABLE IF NOT EXISTS workers (worker_id TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "affinity" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN affinity TEXT")
+            if "openai_key" in columns:
+                # Databases of older versions stored the keys of queued jobs in plaintext
+                conn.execute("UPDATE jobs SET openai_key = NULL")
+
+    @contextmanager
+    def _transaction(self):
+        # One connection per operation: the store is shared by threads, processes and hosts
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def _query(self, query, params=()):
+        # Reads don't take the write lock, so polling apps don't hold up the workers
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            return conn.execute(query, params).fetchall()
+        finally:
+            conn.close()
+
+    def submit(self, document, filename, args=(), sample_doc=None, max_attempts=DEFAULT_MAX_ATTEMPTS, job_id=None,
+               affinity=None):
+        """
+        Queues an analysis.
+
+        Parameters:
+        - document (bytes): The .docx file.
+        - filename (str): Name the worker gives the file.
+        - args (list[str]): run_pipeline.py options; -s, -d, -K and --run-id are set by the worker.
+        - sample_doc (str): Document name in the results, defaults to filename.
+        - max_attempts (int): Claims of the job before it fails, counting claims by workers that died.
+        - job_id (str): ID of the job, which is also the run ID of its workspace; generated if None.
+        - affinity (str): Only this worker may claim the job, e.g. the in-process worker holding
+          the submitter's OpenAI key. The job fails if that worker stops reporting in.
+
+        Returns:
+        - The job ID.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, sample_doc, filename, document, args, affinity, max_attempts, "
+                "created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, QUEUED, sample_doc or filename, filename, sqlite3.Binary(document), json.dumps(list(args)),
+                 affinity, int(max_attempts), time.time()),
+            )
+        return job_id
+
+    def _requeue_expired(self, conn, now):
+        expired = conn.execute(
+            "SELECT id, attempts, max_attempts, worker_id FROM jobs WHERE status = ? AND lease_expires_at < ?",
+            (RUNNING, now),
+        ).fetchall()
+        for job_id, attempts, max_attempts, worker_id in expired:
+            if attempts >= max_attempts:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE id = ?",
+                    (FAILED, now, f"Lease expired {attempts} times, last worker {worker_id}", job_id),
+                )
+            else:
+                # The next attempt starts over, so its events replace the ones of the dead worker
+                conn.execute("UPDATE jobs SET status = ?, worker_id = NULL, lease_expires_at = NULL WHERE id = ?",
+                             (QUEUED, job_id))
+                conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+        # Pinned jobs can't run anywhere else once their worker is gone
+        conn.execute(
+            "UPDATE jobs SET status = ?, finished_at = ?, error = ? WHERE status = ? AND affinity IS NOT NULL "
+            "AND affinity NOT IN (SELECT worker_id FROM workers WHERE seen_at >= ?)",
+            (FAILED, now, "The worker this job was submitted to stopped", QUEUED, now - self.lease_seconds),
+        )
+        return len(expired)
+
+    def requeue_expired(self):
+        """Queues jobs again whose worker stopped sending heartbeats. Returns their number."""
+        with self._transaction() as conn:
+            return self._requeue_expired(conn, time.time())
+
+    def claim(self, worker_id):
+        """
+        Leases the oldest queued job to worker_id.
+
+        Returns:
+        - The job dict plus "document" (bytes), or None if no job is queued.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            self._requeue_expired(conn, now)
+            row = conn.execute("SELECT id FROM jobs WHERE status = ? AND (affinity IS NULL OR affinity = ?) "
+                               "ORDER BY created_at LIMIT 1", (QUEUED, worker_id)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker_id = ?, attempts = attempts + 1, started_at = ?, "
+                "heartbeat_at = ?, lease_expires_at = ? WHERE id = ?",
+                (RUNNING, worker_id, now, now, now + self.lease_seconds, row[0]),
+            )
+            job = _job(conn.execute(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (row[0],)).fetchone())
+            job["document"] = conn.execute("SELECT document FROM jobs WHERE id = ?", (row[0],)).fetchone()[0]
+        return job
+
+    def heartbeat(self, job_id, worker_id):
+        """Renews the lease. Returns False if the job is no longer leased to worker_id."""
+        now = time.time()
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET heartbeat_at = ?, lease_expires_at = ? WHERE id = ? AND status = ? AND worker_id = ?",
+                (now, now + self.lease_seconds, job_id, RUNNING, worker_id),
+            ).rowcount
+        return updated == 1
+
+    def worker_seen(self, worker_id):
+        """Records that a worker is alive; called on every poll and heartbeat."""
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO workers (worker_id, seen_at) VALUES (?, ?) "
+                         "ON CONFLICT (worker_id) DO UPDATE SET seen_at = excluded.seen_at", (worker_id, time.time()))
+
+    def live_workers(self, max_age_seconds=None):
+        """IDs of the workers that reported in within max_age_seconds (default: the lease)."""
+        max_age_seconds = self.lease_seconds if max_age_seconds is None else max_age_seconds
+        rows = self._query("SELECT worker_id FROM workers WHERE seen_at >= ? ORDER BY worker_id",
+                           (time.time() - max_age_seconds,))
+        return [row[0] for row in rows]
+
+    def add_event(self, job_id, event):
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO job_events (job_id, created_at, event) VALUES (?, ?, ?)",
+                         (job_id, time.time(), json.dumps(event, ensure_ascii=False, default=str)))
+
+    def events(self, job_id, after_id=0):
+        """Returns [(event_id, event)] of a job with an ID above after_id, oldest first."""
+        rows = self._query("SELECT id, event FROM job_events WHERE job_id = ? AND id > ? ORDER BY id",
+                           (job_id, after_id))
+        return [(event_id, json.loads(event)) for event_id, event in rows]
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None):
+        with self._transaction() as conn:
+            updated = conn.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ?, lease_expires_at = NULL "
+                "WHERE id = ? AND status = ? AND worker_id = ?",
+                (status, time.time(), json.dumps(result, ensure_ascii=False, default=str) if result is not None
+                 else None, error, job_id, RUNNING, worker_id),
+            ).rowcount
+        return updated == 1
+
+    def complete(self, job_id, worker_id, result):
+        """Stores the result. Returns False if the lease was lost and another worker owns the job."""
+        return self._finish(job_id, worker_id, DONE, result=result)
+
+    def fail(self, job_id, worker_id, error):
+        return self._finish(job_id, worker_id, FAILED, error=error)
+
+    def get(self, job_id):
+        rows = self._query(f"SELECT {', '.join(JOB_FIELDS)} FROM jobs WHERE id = ?", (job_id,))
+        return _job(rows[0]) if rows else None
+
+    def queue_position(self, job_id):
+        """Number of queued jobs ahead of job_id."""
+        return self._query(
+            "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at < (SELECT created_at FROM jobs WHERE id = ?)",
+            (QUEUED, job_id),
+        )[0][0]
+
+    def counts(self):
+        """Number of jobs per status."""
+        return dict(self._query("SELECT status, COUNT(*) FROM jobs GROUP BY status"))
+
+    def list_jobs(self, status=None, limit=50):
+        query = f"SELECT {', '.join(JOB_FIELDS)} FROM jobs"
+        params = ()
+        if status:
+            query += " WHERE status = ?"
+            params = (status,)
+        return [_job(row) for row in self._query(query + " ORDER BY created_at DESC LIMIT ?", params + (limit,))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Submit and inspect analysis jobs.")
+    parser.add_argument("--store", default=None, help="Job database (default: $JOB_STORE_PATH or V3_Frontend/temp/jobs.sqlite3)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit_parser = commands.add_parser("submit", help="Queue a document; options after -- go to run_pipeline.py")
+    submit_parser.add_argument("doc_path")
+    submit_parser.add_argument("pipeline_args", nargs=argparse.REMAINDER)
+    list_parser = commands.add_parser("list", help="Show the most recent jobs")
+    list_parser.add_argument("--status", default=None, choices=(QUEUED, RUNNING, DONE, FAILED))
+    args = parser.parse_args()
+
+    store = JobStore(args.store)
+    if args.command == "submit":
+        pipeline_args = [arg for arg in args.pipeline_args if arg != "--"]
+        job_id = store.submit(Path(args.doc_path).read_bytes(), Path(args.doc_path).name, pipeline_args)
+        print(f"Submitted job {job_id}")
+    else:
+        for job in store.list_jobs(args.status):
+            print(f"{job['id']}  {job['status']:<8} {job['sample_doc']:<30} attempts {job['attempts']}/"
+                  f"{job['max_attempts']}  worker {job['worker_id'] or '-'}  {job['error'] or ''}")
@@ -0,0 +1,210 @@
+"""
+llm_cache.py
+Content-addressed SQLite cache for OpenAI chat completions.
+
+The key is the SHA-256 of the model, the rendered messages, the seed, the
+response_format and any sampling parameters the request sets, so re-analysing a
+document (or re-running after a failure) only pays for requests that actually
+changed. Only complete answers (finish_reason "stop") are stored; a truncated or
+filtered answer is returned but asked again next time. Entries expire after a per-model
+TTL and the least recently used entries are evicted once the cache grows past
+its size limit.
+
+CachedOpenAIClient wraps an OpenAI client so that the step modules keep calling
+client.chat.completions.create(...) unchanged. Cache hits are returned with zero
+token usage and counted separately in the wrapper's stats, so token and cost
+totals only contain what was billed.
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+
+from config import LLM_CACHE_TTL_SECONDS
+
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent / "temp" / "llm_cache.sqlite3"
+DEFAULT_MAX_SIZE_BYTES = 256 * 1024 * 1024
+
+# Request parameters that determine the answer and are therefore part of the key
+KEY_FIELDS = ("model", "messages", "seed", "response_format")
+# Further parameters that change the answer; only keyed when set, so the keys of requests without them stay the same
+OPTIONAL_KEY_FIELDS = ("temperature", "top_p", "max_tokens", "max_completion_tokens", "reasoning_effort", "tools",
+                       "tool_choice")
+
+
+def request_key(request):
+    """Returns the cache key of a chat.completions.create request."""
+    payload = {field: request.get(field) for field in KEY_FIELDS}
+    payload.update({field: request[field] for field in OPTIONAL_KEY_FIELDS if request.get(field) is not None})
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def cached_response(model, content, usage):
+    """Builds an object shaped like an OpenAI ChatCompletion for a cache hit."""
+    return SimpleNamespace(
+        model=model,
+        cached=True,
+        choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                 message=SimpleNamespace(role="assistant", content=content))],
+        usage=SimpleNamespace(prompt_tokens=0, completion_tokens=0, total_tokens=0),
+        cached_usage=usage,
+    )
+
+
+class LLMCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_size_bytes=DEFAULT_MAX_SIZE_BYTES, ttl_seconds=None):
+        """
+        Parameters:
+        - path (str | Path): SQLite database file.
+        - max_size_bytes (int): Entries are evicted least-recently-used first above this size.
+        - ttl_seconds (dict): Per-model time to live, with a "default" entry for other models.
+          Defaults to config.LLM_CACHE_TTL_SECONDS.
+        """
+        self.path = Path(path)
+        self.max_size_bytes = int(max_size_bytes)
+        self.ttl_seconds = ttl_seconds or LLM_CACHE_TTL_SECONDS
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS completions (
+                   key TEXT PRIMARY KEY,
+                   model TEXT NOT NULL,
+                   content TEXT NOT NULL,
+                   prompt_tokens INTEGER NOT NULL,
+                   completion_tokens INTEGER NOT NULL,
+                   total_tokens INTEGER NOT NULL,
+                   size_bytes INTEGER NOT NULL,
+                   created_at REAL NOT NULL,
+                   last_access REAL NOT NULL
+               )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_last_access ON completions (last_access)")
+        self._conn.commit()
+
+    def ttl_for(self, model):
+        return self.ttl_seconds.get(model, self.ttl_seconds.get("default"))
+
+    def get(self, key, model):
+        """Returns (content, usage dict) for a fresh entry, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, prompt_tokens, completion_tokens, total_tokens, created_at FROM completions WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            content, prompt_tokens, completion_tokens, total_tokens, created_at = row
+            ttl = self.ttl_for(model)
+            if ttl is not None and now - created_at > ttl:
+                self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE completions SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": total_tokens}
+        return content, usage
+
+    def put(self, key, model, content, usage):
+        now = time.time()
+        size_bytes = len(key) + len(model) + len(content.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, usage["prompt_tokens"], usage["completion_tokens"], usage["total_tokens"],
+                 size_bytes, now, now),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total_size = self._conn.execute("SELECT COALESCE(SUM(size_bytes), 0) FROM completions").fetchone()[0]
+        if total_size <= self.max_size_bytes:
+            return
+        for key, size_bytes in self._conn.execute(
+            "SELECT key, size_bytes FROM completions ORDER BY last_access ASC"
+        ).fetchall():
+            self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+            total_size -= size_bytes
+            if total_size <= self.max_size_bytes:
+                break
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM completions")
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class _CachedCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._create(**kwargs)
+
+
+class CachedOpenAIClient:
+    def __init__(self, openai_client, cache: LLMCache):
+        """
+        Wraps an OpenAI client so chat.completions.create() goes through the cache.
+        Create one wrapper per step to get per-step hit statistics.
+        """
+        self._client = openai_client
+        self._cache = cache
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=_CachedCompletions(self))
+        self.stats = {"cache_hits": 0, "cache_misses": 0, "cached_input_tokens": 0, "cached_output_tokens": 0}
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _create(self, **kwargs):
+        model = kwargs.get("model")
+        key = request_key(kwargs)
+        hit = self._cache.get(key, model)
+        if hit is not None:
+            content, usage = hit
+            with self._lock:
+                self.stats["cache_hits"] += 1
+                self.stats["cached_input_tokens"] += usage["prompt_tokens"]
+                self.stats["cached_output_tokens"] += usage["completion_tokens"]
+            return cached_response(model, content, usage)
+
+        response = self._client.chat.completions.create(**kwargs)
+        with self._lock:
+            self.stats["cache_misses"] += 1
+        choice = response.choices[0]
+        # A "length" or "content_filter" answer would be replayed from the cache for the whole TTL
+        if choice.finish_reason == "stop" and choice.message.content:
+            self._cache.put(key, model, choice.message.content, {
+                "prompt_tokens": response.usage.prompt_tokens,
+                "completion_tokens": response.usage.completion_tokens,
+                "total_tokens": response.usage.total_tokens,
+            })
+        return response
+
+
+_default_caches = {}
+_default_caches_lock = threading.Lock()
+
+
+def get_llm_cache(path=DEFAULT_CACHE_PATH, max_size_bytes=DEFAULT_MAX_SIZE_BYTES):
+    """Returns the process-wide cache for a database file, opening it on first use."""
+    path = Path(path)
+    with _default_caches_lock:
+        cache = _default_caches.get(path)
+        if cache is None:
+            cache = LLMCache(path, max_size_bytes)
+            _default_caches[path] = cache
+    return cache
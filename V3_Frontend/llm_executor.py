@@ -0,0 +1,79 @@
+"""
+llm_executor.py
+Runs the per-clause LLM calls of steps 1 and 2 concurrently with a bounded number of
+requests in flight. Results keep the order of the input clauses.
+
+Measure the effect against the fake endpoint:
+python3 V3_Frontend/llm_executor.py --latency 0.5 --requests 25 --concurrency 1 4 8 16
+"""
+
+import argparse
+import time
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
+
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+def run_concurrently(fn, items, max_concurrency=DEFAULT_MAX_CONCURRENCY):
+    """
+    Calls fn(item) for every item with at most max_concurrency calls running at once.
+
+    Returns:
+    - List of the return values in the order of items. On the first exception the
+      calls that haven't started are cancelled; the exception is re-raised once the
+      calls already running have finished.
+    """
+    items = list(items)
+    if max_concurrency <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    pool = ThreadPoolExecutor(max_workers=min(max_concurrency, len(items)), thread_name_prefix="llm")
+    try:
+        futures = [pool.submit(fn, item) for item in items]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        failed = [future for future in futures if future in done and future.exception() is not None]
+        if failed:
+            # Stop before the queued clauses are sent (and billed)
+            pool.shutdown(wait=True, cancel_futures=True)
+            failed[0].result()
+        return [future.result() for future in futures]
+    finally:
+        pool.shutdown(wait=True)
+
+
+def sum_token_usage(responses):
+    """Sums the (content, input_tokens, output_tokens, total_tokens) tuples of get_openai_response calls."""
+    token_usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+    for _, input_tokens, output_tokens, total_tokens in responses:
+        token_usage["input_tokens"] += input_tokens
+        token_usage["output_tokens"] += output_tokens
+        token_usage["total_tokens"] += total_tokens
+    return token_usage
+
+
+if __name__ == "__main__":
+    import openai
+    from fake_openai_server import start_fake_server
+
+    parser = argparse.ArgumentParser(description="Measure wall time of concurrent calls against the fake endpoint.")
+    parser.add_argument("--latency", type=float, default=0.5, help="Injected latency per request (default: 0.5)")
+    parser.add_argument("--requests", type=int, default=25, help="Number of calls, one per clause (default: 25)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(latency=args.latency)
+    client = openai.OpenAI(base_url=base_url, api_key="fake")
+
+    def call(i):
+        response = client.chat.completions.create(
+            model="fake-model", messages=[{"role": "user", "content": f"Clause {i}"}], seed=42
+        )
+        usage = response.usage
+        return response.choices[0].message.content, usage.prompt_tokens, usage.completion_tokens, usage.total_tokens
+
+    for concurrency in args.concurrency:
+        start_time = time.perf_counter()
+        responses = run_concurrently(call, range(args.requests), concurrency)
+        elapsed = time.perf_counter() - start_time
+        print(f"Concurrency {concurrency:>3}: {elapsed:6.2f} s for {len(responses)} calls, {sum_token_usage(responses)}")
+
+    server.shutdown()
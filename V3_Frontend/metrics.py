@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+metrics.py
+Per-call metrics of the LLM requests.
+
+Every chat completion is recorded with its stage, model, latency, token usage,
+cache hit, retries and cost, appended as one JSON line to the metrics log and kept
+in memory for the aggregates of the current run. The step totals in
+execuation_details.json and the PDF are built from these records, and each call is
+priced with the model it actually used.
+
+Aggregate a metrics log, optionally as Prometheus text exposition:
+python3 V3_Frontend/metrics.py V3_Frontend/temp/metrics.jsonl --by model --prometheus metrics.prom
+"""
+
+import argparse
+import json
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from token_budget import project_cost
+
+STEP1 = "step1"
+STEP2 = "step2"
+STEP3 = "step3"
+METRIC_PREFIX = "nda_llm"
+# Batch API requests are billed at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+
+
+def sum_cost(costs):
+    """Sum of costs in $, None if any of them is unknown (a model missing from config.MODEL_PRICING)."""
+    costs = list(costs)
+    if any(cost is None for cost in costs):
+        return None
+    return round(sum(costs), 6)
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile, None for an empty list."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))]
+
+
+class MetricsRecorder:
+    def __init__(self, path=None, run_id=None):
+        """
+        Parameters:
+        - path (str | Path): Append-only JSONL log; records are only kept in memory if None.
+        - run_id (str): Written into every record so runs can be told apart in a shared log.
+        """
+        self.path = Path(path) if path else None
+        self.run_id = run_id
+        self.records = []
+        self._lock = threading.Lock()
+        if self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def record(self, stage, model, latency_seconds=None, input_tokens=0, output_tokens=0, cache_hit=False,
+               cached_input_tokens=0, cached_output_tokens=0, prompt_cache_tokens=0, retries=0, hedged=False,
+               status="ok", error=None, batch=False, hedge_loser=False):
+        """
+        Records one LLM call. Token counts are the billed ones (0 for cache hits); the tokens a
+        cache hit saved go into cached_input_tokens / cached_output_tokens.
+        prompt_cache_tokens are the input tokens OpenAI served from its prompt cache.
+        hedge_loser marks the duplicate request of a hedged call whose answer was dropped: its
+        tokens and cost count, but it is not a call of its own.
+        """
+        cost = project_cost(model, input_tokens, output_tokens)
+        if cost is not None and batch:
+            cost *= BATCH_PRICE_FACTOR
+        entry = {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "run_id": self.run_id,
+            "stage": stage,
+            "model": model,
+            "status": status,
+            "latency_seconds": round(latency_seconds, 4) if latency_seconds is not None else None,
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+            "cache_hit": cache_hit,
+            "cached_input_tokens": cached_input_tokens,
+            "cached_output_tokens": cached_output_tokens,
+            "prompt_cache_tokens": prompt_cache_tokens,
+            "retries": retries,
+            "hedged": hedged,
+            "hedge_loser": hedge_loser,
+            "batch": batch,
+            "cost": round(cost, 6) if cost is not None else None,
+            "error": error,
+        }
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock:
+            self.records.append(entry)
+            if self.path is not None:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+        return entry
+
+    def aggregate(self, by="stage"):
+        with self._lock:
+            records = list(self.records)
+        return aggregate(records, by)
+
+
+def aggregate(records, by="stage"):
+    """
+    Sums the records per value of a field ("stage", "model", "run_id", ...).
+
+    Returns:
+    - Dict {value: {"calls", "errors", "input_tokens", "output_tokens", "total_tokens",
+      "cache_hits", "cache_misses", "cached_input_tokens", "cached_output_tokens",
+      "prompt_cache_tokens", "retries", "hedged", "hedge_losers", "cost", "latency_p50",
+      "latency_p95", "latency_max", "models"}}. Tokens and cost include the hedge losers;
+      calls, cache hits and latencies don't. cost is None if a call used a model without pricing.
+    """
+    groups = defaultdict(list)
+    for entry in records:
+        groups[entry.get(by)].append(entry)
+
+    result = {}
+    for key, entries in groups.items():
+        ok = [entry for entry in entries if entry["status"] == "ok"]
+        calls = [entry for entry in entries if not entry.get("hedge_loser")]
+        ok_calls = [entry for entry in calls if entry["status"] == "ok"]
+        latencies = [entry["latency_seconds"] for entry in calls if entry.get("latency_seconds") is not None]
+        cache_hits = sum(1 for entry in ok_calls if entry["cache_hit"])
+        result[key] = {
+            "calls": len(calls),
+            "errors": len(calls) - len(ok_calls),
+            "input_tokens": sum(entry["input_tokens"] for entry in ok),
+            "output_tokens": sum(entry["output_tokens"] for entry in ok),
+            "total_tokens": sum(entry["total_tokens"] for entry in ok),
+            "cache_hits": cache_hits,
+            "cache_misses": len(ok_calls) - cache_hits,
+            "cached_input_tokens": sum(entry["cached_input_tokens"] for entry in ok_calls),
+            "cached_output_tokens": sum(entry["cached_output_tokens"] for entry in ok_calls),
+            "prompt_cache_tokens": sum(entry.get("prompt_cache_tokens", 0) for entry in ok),
+            "retries": sum(entry.get("retries", 0) for entry in calls),
+            "hedged": sum(1 for entry in calls if entry.get("hedged")),
+            "hedge_losers": len(entries) - len(calls),
+            "cost": sum_cost(entry["cost"] for entry in ok),
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_max": max(latencies) if latencies else None,
+            "models": sorted({entry["model"] for entry in entries if entry.get("model")}),
+        }
+    return result
+
+
+def _labels(**labels):
+    return ",".join(f'{name}="{str(value)}"' for name, value in labels.items())
+
+
+def to_prometheus(records):
+    """Renders the records as Prometheus text exposition, labelled by stage and model."""
+    groups = defaultdict(list)
+    for entry in records:
+        groups[(entry["stage"], entry["model"])].append(entry)
+    # The dropped duplicates of hedged calls only count towards tokens and cost
+    call_groups = {key: [entry for entry in entries if not entry.get("hedge_loser")] for key, entries in groups.items()}
+
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}_{name} {help_text}")
+        lines.append(f"# TYPE {METRIC_PREFIX}_{name} {kind}")
+        for labels, value in samples:
+            lines.append(f"{METRIC_PREFIX}_{name}{{{labels}}} {value}")
+
+    metric("calls_total", "counter", "LLM calls.",
+           [(_labels(stage=stage, model=model, status=status),
+             sum(1 for entry in entries if entry["status"] == status))
+            for (stage, model), entries in call_groups.items() for status in ("ok", "error")])
+    metric("tokens_total", "counter", "Billed tokens.",
+           [(_labels(stage=stage, model=model, kind=kind), sum(entry[f"{kind}_tokens"] for entry in entries))
+            for (stage, model), entries in groups.items() for kind in ("input", "output")])
+    metric("cached_tokens_total", "counter", "Tokens served from the local LLM cache.",
+           [(_labels(stage=stage, model=model, kind=kind), sum(entry[f"cached_{kind}_tokens"] for entry in entries))
+            for (stage, model), entries in call_groups.items() for kind in ("input", "output")])
+    metric("cache_hits_total", "counter", "Calls answered from the local LLM cache.",
+           [(_labels(stage=stage, model=model), sum(1 for entry in entries if entry["cache_hit"]))
+            for (stage, model), entries in call_groups.items()])
+    metric("retries_total", "counter", "Retried requests.",
+           [(_labels(stage=stage, model=model), sum(entry.get("retries", 0) for entry in entries))
+            for (stage, model), entries in call_groups.items()])
+    metric("hedged_total", "counter", "Calls answered by a hedged duplicate request.",
+           [(_labels(stage=stage, model=model), sum(1 for entry in entries if entry.get("hedged")))
+            for (stage, model), entries in call_groups.items()])
+    metric("hedge_losers_total", "counter", "Hedged requests whose answer was dropped, billed nonetheless.",
+           [(_labels(stage=stage, model=model), sum(1 for entry in entries if entry.get("hedge_loser")))
+            for (stage, model), entries in groups.items()])
+    # Models without pricing have no cost sample rather than a made-up 0
+    costs = {key: sum_cost(entry["cost"] for entry in entries if entry["status"] == "ok")
+             for key, entries in groups.items()}
+    metric("cost_dollars_total", "counter", "Cost from config.MODEL_PRICING.",
+           [(_labels(stage=stage, model=model), cost) for (stage, model), cost in costs.items() if cost is not None])
+
+    lines.append(f"# HELP {METRIC_PREFIX}_latency_seconds Latency of LLM calls.")
+    lines.append(f"# TYPE {METRIC_PREFIX}_latency_seconds summary")
+    for (stage, model), entries in call_groups.items():
+        latencies = [entry["latency_seconds"] for entry in entries if entry.get("latency_seconds") is not None]
+        for quantile in (0.5, 0.95, 0.99):
+            value = percentile(latencies, quantile)
+            if value is not None:
+                lines.append(f"{METRIC_PREFIX}_latency_seconds{{{_labels(stage=stage, model=model, quantile=quantile)}}} "
+                             f"{value}")
+        lines.append(f"{METRIC_PREFIX}_latency_seconds_sum{{{_labels(stage=stage, model=model)}}} "
+                     f"{round(sum(latencies), 4)}")
+        lines.append(f"{METRIC_PREFIX}_latency_seconds_count{{{_labels(stage=stage, model=model)}}} {len(latencies)}")
+    return "\n".join(lines) + "\n"
+
+
+def load_records(path, run_id=None):
+    records = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if run_id is None or entry.get("run_id") == run_id:
+                    records.append(entry)
+    return records
+
+
+class _MeteredCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._create(**kwargs)
+
+
+class MeteredOpenAIClient:
+    def __init__(self, openai_client, recorder: MetricsRecorder, stage):
+        """
+        Wraps an OpenAI (or CachedOpenAIClient) client so every chat.completions.create()
+        call is recorded under stage. Wrap the cached client, not the other way round,
+        so cache hits are recorded as well.
+        """
+        self._client = openai_client
+        self._recorder = recorder
+        self._stage = stage
+        self.chat = SimpleNamespace(completions=_MeteredCompletions(self))
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def _create(self, **kwargs):
+        model = kwargs.get("model")
+        start = time.perf_counter()
+        try:
+            response = self._client.chat.completions.create(**kwargs)
+        except Exception as e:
+            self._recorder.record(self._stage, model, time.perf_counter() - start, status="error", error=repr(e),
+                                  retries=getattr(e, "retries", 0))
+            raise
+        self._record(model, time.perf_counter() - start, response)
+        return response
+
+    def record_hedge_loser(self, kwargs, response, latency_seconds):
+        """on_hedge_loser callback of ResilientOpenAIClient: records the usage of the dropped duplicate request."""
+        self._record(kwargs.get("model"), latency_seconds, response, hedge_loser=True)
+
+    def _record(self, model, latency_seconds, response, hedge_loser=False):
+        usage = response.usage
+        cached_usage = getattr(response, "cached_usage", None) or {}
+        details = getattr(usage, "prompt_tokens_details", None)
+        self._recorder.record(
+            self._stage,
+            model,
+            latency_seconds,
+            input_tokens=usage.prompt_tokens,
+            output_tokens=usage.completion_tokens,
+            cache_hit=bool(getattr(response, "cached", False)),
+            cached_input_tokens=cached_usage.get("prompt_tokens", 0),
+            cached_output_tokens=cached_usage.get("completion_tokens", 0),
+            prompt_cache_tokens=(getattr(details, "cached_tokens", 0) or 0) if details is not None else 0,
+            retries=0 if hedge_loser else getattr(response, "retries", 0),
+            hedged=not hedge_loser and bool(getattr(response, "hedged", False)),
+            hedge_loser=hedge_loser,
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Aggregate an LLM metrics log.")
+    parser.add_argument("path", help="Metrics JSONL file")
+    parser.add_argument("--run-id", default=None, help="Only use the records of this run")
+    parser.add_argument("--by", default="stage", help="Field to aggregate by: stage, model or run_id (default: stage)")
+    parser.add_argument("--prometheus", default=None, help="Also write the records as Prometheus text to this file")
+    args = parser.parse_args()
+
+    records = load_records(args.path, args.run_id)
+    print(json.dumps(aggregate(records, args.by), indent=4))
+    if args.prometheus:
+        Path(args.prometheus).write_text(to_prometheus(records), encoding="utf-8")
+        print(f"Prometheus metrics written to {args.prometheus}")
@@ -0,0 +1,593 @@
+"""
+pipeline.py
+Runs the four analysis steps (missing, deviating, additional clauses and the PDF report)
+in a single Python process instead of one interpreter per step.
+
+Callers can follow a run through the progress callback of analyze(): it receives one
+dict per event, as soon as the event happens and from the pipeline's worker threads:
+- {"type": "step", "step": "step1" | "step2" | "step3" | "report", "status": "running" | "done",
+   "done": int, "total": int}: step status; done/total count the clauses of steps 1 and 2.
+- {"type": "missing", "clause": {...}}: a clause step 1 labelled missing (entry of result.missing).
+- {"type": "deviating", "clause": {...}}: a step 2 result (entry of result.deviating_data).
+- {"type": "additional", "entries": [...]}: the step 3 result.
+"""
+
+import importlib
+import os
+import sys
+import threading
+import time
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+from config import PipelineConfig
+from document import load_document
+from embedding_service import get_embedding_service
+from batch_jobs import BatchRunner
+from llm_cache import CachedOpenAIClient, get_llm_cache
+from llm_executor import run_concurrently
+from metrics import STEP1, STEP2, STEP3, MeteredOpenAIClient, MetricsRecorder, to_prometheus
+from prompt_registry import get_prompt_registry
+from resilience import ResilientOpenAIClient, RetryPolicy
+from scheduler import StageScheduler
+from segmentation import segment_document
+from token_budget import count_tokens
+from tracing import create_tracer
+from utils import initialize_openai_client
+from workspace import Workspace, cleanup_workspaces
+
+# The step modules start with a digit (and step 4 contains a space), so they
+# can't be imported with a regular import statement.
+rag_step = importlib.import_module("1_V3_RAG")
+deviating_step = importlib.import_module("2_V3_deviatingClauses")
+additional_step = importlib.import_module("3_V3_AdditionalClauses")
+pdf_step = importlib.import_module("4_PDF Generator")
+
+
+class AnalysisResult:
+    def __init__(self, config: PipelineConfig):
+        """
+        Collects the in-memory results of one pipeline run.
+
+        Parameters:
+        - config (PipelineConfig): The parameters the run was started with.
+        """
+        self.config = config
+        self.document = None   # DocumentIR shared by all steps
+        self.segmentation = None  # Segmentation report, None if paragraphs were indexed
+        self.additional_prefilter = None  # Step 3 pre-filter report, None if the whole contract was sent
+        self.clauses = []       # Step 1: all template clauses with their answer
+        self.deviating = []     # Step 2: entailed clauses with their modified_clause
+        self.additional = {}    # Step 3: {"entries": [...]}
+        self.steps = []         # Per-step timings and token usage
+        self.setup_time_seconds = 0
+        self.report_time_seconds = 0
+        self.wall_time_seconds = 0  # Steps 1-3 end to end; less than their sum since they overlap
+        self.stage_timings = {}
+        self.pdf_path = None
+        self.run_id = config.run_id
+        self.workspace = Workspace(config.workspace_dir, config.run_id)  # Where the run's files go
+        self.metrics = None     # MetricsRecorder with one record per LLM call
+
+    @property
+    def clauses_data(self):
+        """Step 1 results in the JSON structure of the step 1 output file."""
+        return rag_step.retrieved_clauses_to_json_data(self.clauses)
+
+    @property
+    def missing(self):
+        return deviating_step.filter_by_answer(self.clauses_data, "missing")
+
+    @property
+    def entailment(self):
+        return deviating_step.filter_by_answer(self.clauses_data, "entailment")
+
+    @property
+    def deviating_data(self):
+        return [deviating_clause_data(clause) for clause in self.deviating]
+
+    @property
+    def additional_entries(self):
+        return self.additional.get("entries", [])
+
+    def execution_details(self):
+        """Returns the run statistics in the format of execuation_details.json."""
+        return {
+            "steps": self.steps,
+            "setup_time_seconds": self.setup_time_seconds,
+            "report_time_seconds": self.report_time_seconds,
+            "wall_time_seconds": self.wall_time_seconds,
+            "stages": self.stage_timings,
+            "segmentation": self.segmentation,
+            "retrieval": rag_step.retrieval_summary(self.clauses),
+            "step1_answers": rag_step.answer_summary(self.clauses),
+            "additional_prefilter": self.additional_prefilter,
+            "run_id": self.run_id,
+            "models": self.metrics.aggregate("model") if self.metrics is not None else {},
+        }
+
+    def render_pdf(self):
+        """The findings PDF as bytes, built from the in-memory results (4_PDF Generator.render_pdf)."""
+        config = self.config
+        return pdf_step.render_pdf(
+            self.missing, self.deviating_data, self.additional, self.execution_details(),
+            config.sample_doc, config.model_name, config.missing_model,
+            config.deviating_model, config.additional_model, self.document,
+        )
+
+    def print_timings(self):
+        print("Stage timings:")
+        print(f"  Setup (models, clients) : {self.setup_time_seconds} s")
+        if self.segmentation:
+            print(f"  Segmentation            : {self.segmentation['paragraphs']} paragraphs -> "
+                  f"{self.segmentation['units']} units ({self.segmentation['index_reduction']:.0%} smaller index, "
+                  f"{self.segmentation['paragraph_chars']} -> {self.segmentation['unit_chars']} chars)")
+        if self.clauses:
+            retrieval = rag_step.retrieval_summary(self.clauses)
+            print(f"  Retrieval               : {retrieval['mean_k']} paragraphs per clause on average "
+                  f"(k: {retrieval['k_counts']})")
+            answers = rag_step.answer_summary(self.clauses)
+            if answers["calls_saved"]:
+                print(f"  Step 1 thresholds       : {answers['calls_saved']} LLM calls saved "
+                      f"({answers['auto_entailment']} entailment, {answers['auto_missing']} missing), "
+                      f"{answers['llm_calls']} calls made")
+        if self.additional_prefilter:
+            prefilter = self.additional_prefilter
+            print(f"  Step 3 pre-filter       : {prefilter['candidates']}/{prefilter['paragraphs']} paragraphs sent, "
+                  f"{prefilter['contract_tokens']} -> {prefilter['candidate_tokens']} contract tokens")
+        for step in self.steps:
+            cost = f"{step['cost']:.4f} $" if step.get("cost") is not None else "n/a"
+            elapsed = f"{step['time_seconds']} s" + (f" ({step['time_note']})" if step.get("time_note") else "")
+            print(f"  {step['name']:<24}: {elapsed} ({step['total_tokens']} tokens, "
+                  f"{step['cache_hits']} cache hits, {cost})")
+        print(f"  Steps 1-3 wall time     : {self.wall_time_seconds} s "
+              f"(sum of steps: {round(sum(step['time_seconds'] for step in self.steps), 1)} s)")
+        print(f"  Report                  : {self.report_time_seconds} s")
+
+
+def deviating_clause_data(clause):
+    """A step 2 clause in the JSON structure of the step 2 output file."""
+    return {
+        "clause_name": clause.clause_name,
+        "clause_subname": clause.clause_subname,
+        "input_clause": clause.input_clause,
+        "retrieved_clauses": clause.retrieved_clauses,
+        "answer": clause.answer,
+        "modified_clause": clause.modified_clause,
+    }
+
+
+def _emit(progress, event_type, **data):
+    if progress is not None:
+        progress(dict(type=event_type, **data))
+
+
+def _step_record(name, script, elapsed, model, stage_metrics=None):
+    """Step entry of execuation_details.json from the aggregated metrics of its LLM calls."""
+    record = {
+        "name": name,
+        "script": script,
+        "model": model,
+        "time_seconds": round(elapsed, 1),
+        # Set when the step's time is counted with another step, e.g. a shared batch
+        "time_note": None,
+        "calls": 0,
+        "total_tokens": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        # Cache hits are not part of the token counts above, which only hold billed tokens
+        "cache_hits": 0,
+        "cache_misses": 0,
+        "cached_input_tokens": 0,
+        "cached_output_tokens": 0,
+        "retries": 0,
+        "hedged": 0,
+        "hedge_losers": 0,
+        "cost": 0,
+        "latency_p50": None,
+        "latency_p95": None,
+    }
+    record.update({field: value for field, value in (stage_metrics or {}).items() if field in record})
+    return record
+
+
+def _step_records(result: AnalysisResult, step_times, time_notes=(None, None, None)):
+    """
+    Builds result.steps from the metrics of the run; step_times are the seconds of steps 1-3,
+    time_notes say where the time of a step is counted instead.
+    """
+    config = result.config
+    by_stage = result.metrics.aggregate("stage")
+    steps = [
+        ("Step 1 (Missing)", rag_step.__file__, config.missing_model, STEP1),
+        ("Step 2 (Deviation)", deviating_step.__file__, config.deviating_model, STEP2),
+        ("Step 3 (Additional)", additional_step.__file__, config.additional_model, STEP3),
+    ]
+    result.steps = [_step_record(name, script, elapsed, model, by_stage.get(stage))
+                    for (name, script, model, stage), elapsed in zip(steps, step_times)]
+    for step, note in zip(result.steps, time_notes):
+        step["time_note"] = note
+
+
+def _start_run(result: AnalysisResult):
+    """Creates the run's workspace, removes expired ones and starts recording metrics."""
+    config = result.config
+    result.workspace.create(sample_doc=config.sample_doc, doc_path=str(config.doc_path))
+    result.workspace.update(status="running")
+    removed = cleanup_workspaces(config.workspace_root, config.workspace_retention_hours, exclude=(config.run_id,))
+    if removed:
+        print(f"Removed {len(removed)} workspaces idle for more than {config.workspace_retention_hours} h.")
+    result.metrics = MetricsRecorder(config.metrics_path, result.run_id)
+    return result.metrics
+
+
+def save_artifacts(result: AnalysisResult):
+    """Writes the JSON files the step scripts used to exchange into the run's workspace."""
+    config = result.config
+    workspace = result.workspace
+    workspace.write_json(config.step1_json, result.clauses_data)
+    workspace.write_json(f"{config.sample}-missing_filtered.json", result.missing)
+    workspace.write_json(f"{config.sample}-entailment_filtered.json", result.entailment)
+    workspace.write_json(config.step2_json, result.deviating_data)
+    workspace.write_json("3_V3_additional_clauses.json", result.additional)
+    workspace.write_json("execuation_details.json", result.execution_details())
+
+
+def _span(spans):
+    """Wall time from the first start to the last end of a list of (start, end) pairs."""
+    if not spans:
+        return 0
+    return max(end for _, end in spans) - min(start for start, _ in spans)
+
+
+def retrieval_units(config: PipelineConfig, document):
+    """
+    Returns (units, segmentation report). units is None if the document's paragraphs
+    should be indexed as they are.
+    """
+    if not config.segment_clauses:
+        return None, None
+    segments, report = segment_document(document)
+    if not segments:
+        print("Segmentation left no retrieval units, indexing the paragraphs instead.")
+        return None, report
+    return [segment.text for segment in segments], report
+
+
+def additional_input(config: PipelineConfig, document, index, paragraphs, embedding_model):
+    """
+    Template and contract text for step 3. With the pre-filter, only the paragraphs that match
+    no template clause are sent, together with the template clause names instead of the template.
+
+    Returns:
+    - Tuple (mll_template, external_contract, pre-filter report or None).
+    """
+    mll_template = additional_step.load_template_nda(config.template_path)
+    if not config.additional_prefilter:
+        return mll_template, document.full_text, None
+    similarity = rag_step.template_similarity(index, config.template_path, embedding_model, config.model_name)
+    candidates, report = additional_step.select_candidates(paragraphs, similarity, config.additional_threshold)
+    external_contract = "\n\n".join(candidates)
+    report["contract_tokens"] = count_tokens(document.full_text, config.additional_model)
+    report["candidate_tokens"] = count_tokens(external_contract, config.additional_model)
+    return additional_step.template_clause_names(mll_template), external_contract, report
+
+
+def analyze(doc_path, config: PipelineConfig, generate_pdf=False, progress=None) -> AnalysisResult:
+    """
+    Runs steps 1-4 in the current process.
+
+    Step 3 only needs the document, the template and (for its pre-filter) the index, so it
+    runs alongside steps 1 and 2.
+    Every clause step 1 labels "entailment" is sent to step 2 right away instead of
+    waiting for all of step 1.
+
+    Parameters:
+    - doc_path (str): Path to the .docx file to analyse (overrides config.doc_path).
+    - config (PipelineConfig): Run parameters.
+    - generate_pdf (bool): Also write the findings PDF to the workspace; the app renders it on demand instead.
+    - progress (callable): Receives the progress events (see the module docstring). It is
+      called from worker threads, so it should only hand the event over, e.g. to a queue.
+
+    Returns:
+    - AnalysisResult with the clause results and per-stage timings.
+    """
+    config.doc_path = doc_path
+    result = AnalysisResult(config)
+
+    start_time = time.time()
+    # Loaded once per process and kept warm for later runs
+    embedding_model = get_embedding_service(config.model_name, config.embedding_batch_size).start()
+    # Retries are done by ResilientOpenAIClient, with the run's backoff and deadline
+    openai_client = initialize_openai_client(config.openai_key, max_retries=0)
+    # Spans are exported in the background; flushed once the steps are done
+    tracer = create_tracer(config.trace_sink, config.trace_path)
+    prompts = get_prompt_registry(config.prompt_snapshot, config.offline_prompts).preload()
+    step_clients = [openai_client] * 3
+    if config.use_llm_cache:
+        llm_cache = get_llm_cache(config.llm_cache_path, config.llm_cache_max_mb * 1024 * 1024)
+        step_clients = [CachedOpenAIClient(openai_client, llm_cache) for _ in range(3)]
+    # Around the cache, so hits return right away and stay out of the hedge delay; one per step,
+    # since step 3 calls take far longer than step 1 and 2 calls
+    policy = RetryPolicy(config.llm_max_retries, deadline=config.llm_deadline, hedge=config.llm_hedge,
+                         hedge_quantile=config.llm_hedge_quantile)
+    resilient_clients = [ResilientOpenAIClient(client, policy, max_in_flight=2 * config.llm_concurrency)
+                         for client in step_clients]
+    recorder = _start_run(result)
+    step_clients = [MeteredOpenAIClient(client, recorder, stage)
+                    for client, stage in zip(resilient_clients, (STEP1, STEP2, STEP3))]
+    for resilient_client, step_client in zip(resilient_clients, step_clients):
+        resilient_client.on_hedge_loser = step_client.record_hedge_loser
+    result.setup_time_seconds = round(time.time() - start_time, 1)
+
+    step1_thread_id = f"TEST Identify Missing / Entailment - 1_V3_RAG - {config.sample_doc}"
+    step2_thread_id = f"V3 - 2_V3_deviatingClauses - {config.sample_doc}"
+    spans = {"step1": [], "step2": []}
+    spans_lock = threading.Lock()
+    counts = {"step1": 0, "step2": 0, "entailed": 0, "clauses": 0}
+    scheduler = StageScheduler()
+
+    def timed(step, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            with spans_lock:
+                spans[step].append((start, time.perf_counter()))
+
+    def parse_document(_):
+        # Parsed once; step 1 indexes its paragraphs and step 3 reads its full text
+        return load_document(doc_path, config.document_cache_dir)
+
+    def segment(dependencies):
+        return retrieval_units(config, dependencies["document"])
+
+    def build_index(dependencies):
+        print("Running Step 1: identify missing clauses...")
+        _emit(progress, "step", step="step1", status="running", done=0, total=0)
+        units, _ = dependencies["segments"]
+        return timed("step1", rag_step.initialize_faiss_index, doc_path, embedding_model, config.model_name,
+                     config.index_cache_dir if config.use_index_cache else None, dependencies["document"], units)
+
+    def retrieval(dependencies):
+        index, paragraphs = dependencies["index"]
+        return timed("step1", rag_step.retrieve_template_clauses, index, paragraphs, config.template_path,
+                     embedding_model, config.retrieved_k, config.model_name, **config.retrieval_thresholds)
+
+    def classify_and_deviate(clause):
+        """Step 1 for one clause, directly followed by step 2 if the clause is entailed."""
+        response = timed("step1", rag_step.classify_clause, clause, step_clients[0], step1_thread_id,
+                         tracer, config.missing_model, prompts, config.entail_above, config.missing_below,
+                         config.context_token_budget)
+        clause.answer = response[0]
+        entailed = (clause.answer or "").strip().lower() == "entailment"
+        with spans_lock:
+            counts["step1"] += 1
+            counts["entailed"] += entailed
+            step1_done, entailed_count = counts["step1"], counts["entailed"]
+        _emit(progress, "step", step="step1", status="running", done=step1_done, total=counts["clauses"])
+        if (clause.answer or "").strip().lower() == "missing":
+            _emit(progress, "missing", clause=rag_step.retrieved_clauses_to_json_data([clause])[0])
+        # The run fails anyway once another stage (e.g. step 3) has failed; don't pay for step 2 calls
+        if not entailed or scheduler.failed.is_set():
+            return response, None, None
+
+        _emit(progress, "step", step="step2", status="running", done=counts["step2"], total=entailed_count)
+        deviating_clause = deviating_step.clauses_from_json_data(rag_step.retrieved_clauses_to_json_data([clause]))[0]
+        deviating_response = timed("step2", deviating_step.get_openai_response, deviating_clause, step_clients[1],
+                                   config.deviating_model, step2_thread_id, prompts, tracer)
+        deviating_clause.modified_clause = deviating_response[0]
+        with spans_lock:
+            counts["step2"] += 1
+            step2_done, entailed_count = counts["step2"], counts["entailed"]
+        _emit(progress, "deviating", clause=deviating_clause_data(deviating_clause))
+        _emit(progress, "step", step="step2", status="running", done=step2_done, total=entailed_count)
+        return response, deviating_clause, deviating_response
+
+    def missing_and_deviating(dependencies):
+        clauses = dependencies["retrieval"]
+        counts["clauses"] = len(clauses)
+        _emit(progress, "step", step="step1", status="running", done=0, total=len(clauses))
+        outcomes = run_concurrently(classify_and_deviate, clauses, config.llm_concurrency)
+        _emit(progress, "step", step="step1", status="done", done=len(clauses), total=len(clauses))
+        _emit(progress, "step", step="step2", status="done", done=counts["step2"], total=counts["entailed"])
+        return clauses, outcomes
+
+    def additional(dependencies):
+        print("Running Step 3: identify additional clauses...")
+        _emit(progress, "step", step="step3", status="running", done=0, total=1)
+        index, paragraphs = dependencies.get("index", (None, None))
+        mll_template, external_contract, result.additional_prefilter = additional_input(
+            config, dependencies["document"], index, paragraphs, embedding_model
+        )
+        if result.additional_prefilter is not None and not external_contract:
+            print("Step 3: every paragraph matches a template clause, no LLM call needed.")
+            response = ({"entries": []}, 0, 0, 0)
+        else:
+            response = additional_step.identify_additional_clauses(
+                mll_template=mll_template,
+                external_contract=external_contract,
+                openai_model=config.additional_model,
+                openai_client=step_clients[2],
+                prompts=prompts,
+                tracer=tracer,
+            )
+        _emit(progress, "additional", entries=response[0].get("entries", []))
+        _emit(progress, "step", step="step3", status="done", done=1, total=1)
+        return response
+
+    scheduler.add_stage("document", parse_document)
+    scheduler.add_stage("segments", segment, depends_on=["document"])
+    scheduler.add_stage("index", build_index, depends_on=["document", "segments"])
+    # The pre-filter needs the paragraph embeddings of the index
+    scheduler.add_stage("additional", additional,
+                        depends_on=["document", "index"] if config.additional_prefilter else ["document"])
+    scheduler.add_stage("retrieval", retrieval, depends_on=["index"])
+    scheduler.add_stage("missing_and_deviating", missing_and_deviating, depends_on=["retrieval"])
+    try:
+        stage_results, stage_timings = scheduler.run()
+    finally:
+        tracer.close()
+        for client in resilient_clients:
+            client.close()
+
+    result.document = stage_results["document"]
+    _, result.segmentation = stage_results["segments"]
+    result.clauses, outcomes = stage_results["missing_and_deviating"]
+    result.deviating = [deviating_clause for _, deviating_clause, _ in outcomes if deviating_clause is not None]
+    result.additional = stage_results["additional"][0]
+
+    _step_records(result, [_span(spans["step1"]), _span(spans["step2"]), stage_timings["additional"]["time_seconds"]])
+    result.stage_timings = stage_timings
+    result.wall_time_seconds = round(max(timing["end"] for timing in stage_timings.values()), 1)
+
+    print("Pipeline execution completed.")
+
+    return _finish(result, generate_pdf, progress)
+
+
+def _finish(result: AnalysisResult, generate_pdf, progress=None):
+    """Step 4 (the PDF report) and the JSON artifacts."""
+    config = result.config
+    if generate_pdf:
+        print("Running Step 4: generate PDF report...")
+        _emit(progress, "step", step="report", status="running", done=0, total=1)
+        start_time = time.time()
+        pdf_path = result.workspace.file(f"Findings Overview - {config.missing_model}.pdf")
+        pdf_path.write_bytes(result.render_pdf())
+        result.pdf_path = str(pdf_path)
+        print(f"PDF generated and saved as '{pdf_path}'.")
+        result.report_time_seconds = round(time.time() - start_time, 1)
+        _emit(progress, "step", step="report", status="done", done=1, total=1)
+
+    save_artifacts(result)
+    result.workspace.update(status="finished", pdf_path=result.pdf_path)
+    if config.prometheus_path and result.metrics is not None:
+        config.prometheus_path.parent.mkdir(parents=True, exist_ok=True)
+        config.prometheus_path.write_text(to_prometheus(result.metrics.records), encoding="utf-8")
+    return result
+
+
+def analyze_batch(doc_path, config: PipelineConfig, generate_pdf=False, progress=None) -> AnalysisResult:
+    """
+    Runs steps 1-4 with the LLM requests sent through the OpenAI Batch API.
+
+    Step 1 (all clauses) and step 3 go into a first batch; step 2 for the entailed clauses
+    into a second one. Results are mapped back to the clauses by custom_id. This takes up
+    to the batch completion window, so it is meant for bulk runs, not the app.
+
+    Parameters:
+    - doc_path (str): Path to the .docx file to analyse (overrides config.doc_path).
+    - config (PipelineConfig): Run parameters, including batch_poll_interval and batch_timeout.
+    - generate_pdf (bool): Also write the findings PDF to the workspace; the app renders it on demand instead.
+    - progress (callable): Receives the progress events of analyze(), once per batch.
+
+    Returns:
+    - AnalysisResult like analyze().
+    """
+    config.doc_path = doc_path
+    result = AnalysisResult(config)
+
+    start_time = time.time()
+    embedding_model = get_embedding_service(config.model_name, config.embedding_batch_size).start()
+    # Retries with the run's backoff and deadline, as in analyze()
+    openai_client = initialize_openai_client(config.openai_key, max_retries=0)
+    policy = RetryPolicy(config.llm_max_retries, deadline=config.llm_deadline)
+    tracer = create_tracer(config.trace_sink, config.trace_path)
+    prompts = get_prompt_registry(config.prompt_snapshot, config.offline_prompts).preload()
+    llm_cache = get_llm_cache(config.llm_cache_path, config.llm_cache_max_mb * 1024 * 1024) \
+        if config.use_llm_cache else None
+    recorder = _start_run(result)
+    runner = BatchRunner(openai_client, result.workspace.file("batches"), config.batch_poll_interval,
+                         timeout=config.batch_timeout, cache=llm_cache, recorder=recorder, policy=policy)
+    result.setup_time_seconds = round(time.time() - start_time, 1)
+
+    try:
+        print("Running Step 1: retrieve template clauses...")
+        _emit(progress, "step", step="step1", status="running", done=0, total=0)
+        start_time = time.time()
+        result.document = load_document(doc_path, config.document_cache_dir)
+        units, result.segmentation = retrieval_units(config, result.document)
+        index, paragraphs = rag_step.initialize_faiss_index(
+            doc_path, embedding_model, config.model_name, config.index_cache_dir if config.use_index_cache else None,
+            result.document, units,
+        )
+        clauses = rag_step.retrieve_template_clauses(index, paragraphs, config.template_path, embedding_model,
+                                                     config.retrieved_k, config.model_name,
+                                                     **config.retrieval_thresholds)
+        retrieval_time = time.time() - start_time
+
+        print("Submitting steps 1 and 3 as one batch...")
+        _emit(progress, "step", step="step3", status="running", done=0, total=1)
+        start_time = time.time()
+        for clause in clauses:
+            clause.answer = rag_step.threshold_answer(clause, config.entail_above, config.missing_below)
+            clause.answer_source = rag_step.THRESHOLD_ANSWER if clause.answer else rag_step.LLM_ANSWER
+        requests = {f"step1-{i:04d}": rag_step.build_request(clause, config.missing_model, prompts,
+                                                                     config.context_token_budget)
+                    for i, clause in enumerate(clauses) if clause.answer_source == rag_step.LLM_ANSWER}
+        mll_template, external_contract, result.additional_prefilter = additional_input(
+            config, result.document, index, paragraphs, embedding_model
+        )
+        if result.additional_prefilter is None or external_contract:
+            requests["step3"] = additional_step.build_request(mll_template, external_contract,
+                                                              config.additional_model, prompts)
+        responses = runner.run(requests, "step1-step3") if requests else {}
+        first_batch_time = time.time() - start_time
+
+        for i, clause in enumerate(clauses):
+            if f"step1-{i:04d}" not in requests:
+                continue
+            clause.answer = responses[f"step1-{i:04d}"][0]
+            tracer.trace(name=f"{clause.clause_name} - {clause.clause_subname}",
+                         input=requests[f"step1-{i:04d}"]["messages"][1]["content"],
+                         output=clause.answer,
+                         thread_id=f"TEST Identify Missing / Entailment - 1_V3_RAG - {config.sample_doc}")
+        result.clauses = clauses
+        if "step3" in requests:
+            result.additional = additional_step.parse_content(responses["step3"][0])
+            tracer.trace(name="Search Additional Clauses", input=requests["step3"]["messages"][1]["content"],
+                         output=result.additional)
+        else:
+            print("Step 3: every paragraph matches a template clause, no LLM call needed.")
+            result.additional = {"entries": []}
+        for clause in result.missing:
+            _emit(progress, "missing", clause=clause)
+        _emit(progress, "step", step="step1", status="done", done=len(clauses), total=len(clauses))
+        _emit(progress, "additional", entries=result.additional_entries)
+        _emit(progress, "step", step="step3", status="done", done=1, total=1)
+
+        print("Submitting step 2 as a batch...")
+        start_time = time.time()
+        entailed = [clause for clause in clauses if (clause.answer or "").strip().lower() == "entailment"]
+        result.deviating = deviating_step.clauses_from_json_data(rag_step.retrieved_clauses_to_json_data(entailed))
+        _emit(progress, "step", step="step2", status="running", done=0, total=len(result.deviating))
+        requests = {f"step2-{i:04d}": deviating_step.build_request(clause, config.deviating_model, prompts)
+                    for i, clause in enumerate(result.deviating)}
+        responses = runner.run(requests, "step2") if requests else {}
+        for i, clause in enumerate(result.deviating):
+            clause.modified_clause = responses[f"step2-{i:04d}"][0]
+            tracer.trace(name="Check Deviating Clauses", input=requests[f"step2-{i:04d}"]["messages"][1]["content"],
+                         output=clause.modified_clause,
+                         thread_id=f"V3 - 2_V3_deviatingClauses - {config.sample_doc}")
+            _emit(progress, "deviating", clause=deviating_clause_data(clause))
+        _emit(progress, "step", step="step2", status="done", done=len(result.deviating), total=len(result.deviating))
+        second_batch_time = time.time() - start_time
+    finally:
+        tracer.close()
+
+    # Steps 1 and 3 share a batch; its time is counted once, under step 1
+    _step_records(result, [retrieval_time + first_batch_time, second_batch_time, 0],
+                  [None, None, "in batch_step1_step3"])
+    result.wall_time_seconds = round(retrieval_time + first_batch_time + second_batch_time, 1)
+    result.stage_timings = {
+        "retrieval": {"time_seconds": round(retrieval_time, 1)},
+        "batch_step1_step3": {"time_seconds": round(first_batch_time, 1)},
+        "batch_step2": {"time_seconds": round(second_batch_time, 1)},
+    }
+
+    print(f"Pipeline execution completed ({runner.stats['batches']} batches, {runner.stats['submitted']} requests "
+          f"submitted, {runner.stats['cache_hits']} cache hits).")
+    return _finish(result, generate_pdf, progress)
@@ -0,0 +1,177 @@
+"""
+prompt_registry.py
+In-memory registry for the Opik prompts used by the pipeline.
+
+Each named prompt is fetched from Opik once and then served from memory until its
+TTL expires, so the per-clause LLM calls no longer make remote prompt lookups.
+Prompts can also be loaded from a local snapshot file, which lets the pipeline run
+without any connection to Opik.
+
+Create or refresh a snapshot (needs Opik access):
+python3 V3_Frontend/prompt_registry.py --snapshot data/prompts_snapshot.json
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# All prompts the pipeline uses
+SYSTEM_PROMPT = "V1 - System Prompt"
+MISSING_PROMPT = "V3 - Missing Clauses - Zero-shot"
+DEVIATING_PROMPT = "V3 - Deviating Clauses - Zero-shot"
+ADDITIONAL_PROMPT = "V1.2 - Additional"
+PROMPT_NAMES = (SYSTEM_PROMPT, MISSING_PROMPT, DEVIATING_PROMPT, ADDITIONAL_PROMPT)
+
+DEFAULT_TTL_SECONDS = 3600
+SNAPSHOT_VERSION = 1
+
+_PLACEHOLDER = re.compile(r"{{\s*([A-Za-z0-9_]+)\s*}}")
+
+
+class LocalPrompt:
+    def __init__(self, name, template, commit=None):
+        """
+        A prompt loaded from a snapshot. format() fills {{placeholders}} like Opik's
+        mustache prompts do.
+        """
+        self.name = name
+        self.prompt = template
+        self.commit = commit
+
+    def format(self, **kwargs):
+        return _PLACEHOLDER.sub(
+            lambda match: str(kwargs[match.group(1)]) if match.group(1) in kwargs else match.group(0),
+            self.prompt,
+        )
+
+
+class PromptRegistry:
+    def __init__(self, opik_client=None, ttl_seconds=DEFAULT_TTL_SECONDS, snapshot_path=None, offline=False,
+                 clock=time.monotonic):
+        """
+        Parameters:
+        - opik_client: Opik client used for remote lookups; created on first use if not given.
+        - ttl_seconds (float): How long a fetched prompt is served from memory.
+        - snapshot_path (str | Path): Local snapshot file, used offline or when Opik is unreachable.
+        - offline (bool): Only use the snapshot, never contact Opik.
+        - clock (callable): Returns the current time in seconds for the TTL, time.monotonic by default.
+        """
+        self.ttl_seconds = ttl_seconds
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.offline = offline
+        self._opik_client = opik_client
+        self._clock = clock
+        self._prompts = {}
+        self._snapshot = None
+        self._lock = threading.Lock()
+        if offline and self.snapshot_path is None:
+            raise ValueError("Offline prompt registry needs a snapshot file")
+
+    def get_prompt(self, name):
+        """Returns the prompt object for name; its format(**kwargs) renders the prompt."""
+        now = self._clock()
+        entry = self._prompts.get(name)
+        if entry is not None and (self.offline or now - entry[1] < self.ttl_seconds):
+            return entry[0]
+
+        with self._lock:
+            entry = self._prompts.get(name)
+            if entry is not None and (self.offline or now - entry[1] < self.ttl_seconds):
+                return entry[0]
+            prompt = self._fetch(name)
+            self._prompts[name] = (prompt, self._clock())
+            return prompt
+
+    def format(self, prompt_name, /, **kwargs):
+        # prompt_name is positional-only since prompts may have a {{name}} placeholder
+        return self.get_prompt(prompt_name).format(**kwargs)
+
+    def preload(self, names=PROMPT_NAMES):
+        """Fetches all given prompts up front so the first LLM calls don't wait for them."""
+        for name in names:
+            self.get_prompt(name)
+        return self
+
+    def _fetch(self, name):
+        if self.offline:
+            return self._from_snapshot(name)
+        try:
+            if self._opik_client is None:
+                from utils import initialize_opik_client
+                self._opik_client = initialize_opik_client()
+            prompt = self._opik_client.get_prompt(name=name)
+            if prompt is None:
+                raise KeyError(f"Prompt '{name}' not found in Opik")
+            return prompt
+        except Exception:
+            if self.snapshot_path is None or not self.snapshot_path.exists():
+                raise
+            print(f"Opik lookup of prompt '{name}' failed, using snapshot {self.snapshot_path}.")
+            return self._from_snapshot(name)
+
+    def _from_snapshot(self, name):
+        if self._snapshot is None:
+            self._snapshot = load_snapshot(self.snapshot_path)
+        if name not in self._snapshot:
+            raise KeyError(f"Prompt '{name}' is not in snapshot {self.snapshot_path}")
+        return self._snapshot[name]
+
+
+def load_snapshot(path):
+    """Reads a snapshot file and returns {name: LocalPrompt}."""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"Unsupported prompt snapshot version {data.get('version')} in {path}")
+    return {
+        name: LocalPrompt(name, entry["template"], entry.get("commit"))
+        for name, entry in data["prompts"].items()
+    }
+
+
+def write_snapshot(path, opik_client, names=PROMPT_NAMES):
+    """Fetches the given prompts from Opik and writes them, with their commit, to a snapshot file."""
+    prompts = {}
+    for name in names:
+        prompt = opik_client.get_prompt(name=name)
+        if prompt is None:
+            raise KeyError(f"Prompt '{name}' not found in Opik")
+        prompts[name] = {"template": prompt.prompt, "commit": getattr(prompt, "commit", None)}
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "version": SNAPSHOT_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "prompts": prompts,
+        }, f, indent=4, ensure_ascii=False)
+    return path
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_prompt_registry(snapshot_path=None, offline=False, ttl_seconds=DEFAULT_TTL_SECONDS):
+    """Returns the process-wide registry for the given snapshot/offline setting."""
+    key = (str(snapshot_path) if snapshot_path else None, offline)
+    with _registries_lock:
+        registry = _registries.get(key)
+        if registry is None:
+            registry = PromptRegistry(ttl_seconds=ttl_seconds, snapshot_path=snapshot_path, offline=offline)
+            _registries[key] = registry
+    return registry
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the pipeline's Opik prompts to a local snapshot file.")
+    parser.add_argument("--snapshot", required=True, help="Output path of the snapshot JSON")
+    args = parser.parse_args()
+
+    from utils import initialize_opik_client
+    print(f"Snapshot written to {write_snapshot(args.snapshot, initialize_opik_client())}")
@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+resilience.py
+Retries, deadlines and hedged requests for the LLM calls of steps 1-3.
+
+- Rate limits (429), server errors (5xx), connection errors and timeouts are retried
+  with jittered exponential backoff ("full jitter"), honouring Retry-After.
+- Every request has a deadline; no attempt or backoff runs past it.
+- With hedging enabled, a duplicate request is sent once a call has taken longer than
+  the p95 latency of the recent calls of the same client, and the first answer wins.
+  Stragglers then cost one extra request instead of holding up the whole stage.
+
+Retries and hedges are set on the response (response.retries / response.hedged) and
+on a final exception (error.retries), which is where metrics.py picks them up. The
+request that loses a hedge is billed as well: once it completes, its response is
+passed to on_hedge_loser (MeteredOpenAIClient.record_hedge_loser).
+
+Compare tail latencies against the fault-injecting fake server:
+python3 V3_Frontend/resilience.py --requests 400 --error-rate 0.05 --slow-rate 0.05
+"""
+
+import argparse
+import functools
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from types import SimpleNamespace
+
+import openai
+
+from metrics import percentile
+
+RETRYABLE_STATUS_CODES = (408, 409, 429)
+DEFAULT_MAX_RETRIES = 4
+DEFAULT_BASE_DELAY = 0.5
+DEFAULT_MAX_DELAY = 20.0
+DEFAULT_DEADLINE = 600.0
+# Hedging only starts once the p95 of this many calls is known
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 deadline=DEFAULT_DEADLINE, hedge=False, hedge_quantile=0.95, hedge_min_delay=0.5):
+        """
+        Parameters:
+        - max_retries (int): Retries after the first attempt; 0 disables retrying.
+        - base_delay / max_delay (float): Backoff before retry n is uniform in [0, min(max_delay, base_delay * 2**n)].
+        - deadline (float): Seconds a request may take including all retries and backoff, None for no deadline.
+        - hedge (bool): Send a duplicate request when a call takes longer than the hedge delay.
+        - hedge_quantile (float): Latency quantile of the recent calls used as hedge delay.
+        - hedge_min_delay (float): Lower bound of the hedge delay in seconds.
+        """
+        self.max_retries = int(max_retries)
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.deadline = float(deadline) if deadline else None
+        self.hedge = hedge
+        self.hedge_quantile = float(hedge_quantile)
+        self.hedge_min_delay = float(hedge_min_delay)
+
+    def backoff(self, attempt, error=None):
+        """Seconds to wait before retry number attempt (0-based)."""
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def _retry_after(error):
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """429, 408, 409 and 5xx responses, connection errors and timeouts are retried."""
+    if isinstance(error, DeadlineExceeded):
+        return False
+    # Includes openai.APITimeoutError
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code in RETRYABLE_STATUS_CODES or status_code >= 500)
+
+
+def retry_call(fn, policy, on_retry=None, on_deadline=None):
+    """
+    Calls fn(deadline) with the backoff and deadline of policy; deadline is a time.monotonic()
+    value or None. Used for the chat completions below and the Batch API calls of batch_jobs.py.
+
+    Returns:
+    - Tuple (return value, retries). The final exception is raised with error.retries set.
+    """
+    deadline = time.monotonic() + policy.deadline if policy.deadline else None
+    retries = 0
+    while True:
+        try:
+            return fn(deadline), retries
+        except Exception as e:
+            delay = policy.backoff(retries, e)
+            out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+            if not is_retryable(e) or retries >= policy.max_retries or out_of_time:
+                if (out_of_time or isinstance(e, DeadlineExceeded)) and on_deadline is not None:
+                    on_deadline()
+                raise _annotate(e, retries=retries)
+            retries += 1
+            if on_retry is not None:
+                on_retry()
+            time.sleep(delay)
+
+
+def timeout_until(deadline):
+    """SDK request options that end a request at deadline (a time.monotonic() value, or None)."""
+    return {"timeout": max(deadline - time.monotonic(), 0.001)} if deadline is not None else {}
+
+
+def _annotate(obj, **attributes):
+    for name, value in attributes.items():
+        try:
+            setattr(obj, name, value)
+        except (AttributeError, TypeError, ValueError):
+            pass
+    return obj
+
+
+class _ResilientCompletions:
+    def __init__(self, owner):
+        self._owner = owner
+
+    def create(self, **kwargs):
+        return self._owner._create(**kwargs)
+
+
+class ResilientOpenAIClient:
+    def __init__(self, openai_client, policy: RetryPolicy = None, max_in_flight=32, on_hedge_loser=None):
+        """
+        Wraps an OpenAI (or CachedOpenAIClient) client so chat.completions.create() is
+        retried, bounded by the policy's deadline and optionally hedged.
+        Create one wrapper per step: the hedge delay comes from the latencies of the
+        wrapper's own calls, and step 3 calls take far longer than step 1 calls.
+
+        Parameters:
+        - openai_client: The client to wrap. Disable its own retries (max_retries=0) to
+          keep the backoff in one place.
+        - policy (RetryPolicy): Retry, deadline and hedging settings.
+        - max_in_flight (int): Threads for hedged calls (primary plus duplicate).
+        - on_hedge_loser (callable): Called with (request kwargs, response, latency in seconds) of the
+          hedged request whose answer was dropped, once it has completed.
+        """
+        self._client = openai_client
+        self.policy = policy or RetryPolicy()
+        self.on_hedge_loser = on_hedge_loser
+        self.chat = SimpleNamespace(completions=_ResilientCompletions(self))
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="llm-hedge") \
+            if self.policy.hedge else None
+        self.stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "hedge_losers": 0,
+                      "deadline_exceeded": 0}
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+    def hedge_delay(self):
+        """Seconds after which a call is hedged, None while too few latencies are known."""
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            latencies = list(self._latencies)
+        return max(self.policy.hedge_min_delay, percentile(latencies, self.policy.hedge_quantile))
+
+    def _call(self, kwargs, deadline):
+        kwargs = dict(kwargs, **timeout_until(deadline))
+        start = time.perf_counter()
+        response = self._client.chat.completions.create(**kwargs)
+        # Cache hits would drag the hedge delay towards zero
+        if not getattr(response, "cached", False):
+            with self._lock:
+                self._latencies.append(time.perf_counter() - start)
+        return response
+
+    def _attempt(self, kwargs, deadline):
+        """One attempt, hedged if enabled. Returns (response, hedged)."""
+        hedge_delay = self.hedge_delay() if self._pool is not None else None
+        if hedge_delay is None:
+            return self._call(kwargs, deadline), False
+
+        primary = self._pool.submit(self._call, kwargs, deadline)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result(), False
+
+        hedge_start = time.perf_counter()
+        duplicate = self._pool.submit(self._call, kwargs, deadline)
+        with self._lock:
+            self.stats["hedges"] += 1
+        started = {primary: hedge_start - hedge_delay, duplicate: hedge_start}
+        pending = {primary, duplicate}
+        winner = None
+        error = None
+        try:
+            while pending:
+                timeout = max(deadline - time.monotonic(), 0) if deadline is not None else None
+                done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    raise DeadlineExceeded(f"No answer within the {self.policy.deadline} s deadline")
+                for future in done:
+                    if future.exception() is None:
+                        winner = future
+                        if future is duplicate:
+                            with self._lock:
+                                self.stats["hedge_wins"] += 1
+                        return future.result(), True
+                    error = future.exception()
+            raise error
+        finally:
+            # The slower request keeps running; its answer is dropped, but it is billed all the same
+            for future in (primary, duplicate):
+                if future is not winner:
+                    future.add_done_callback(functools.partial(self._hedge_lost, kwargs, started[future]))
+
+    def _hedge_lost(self, kwargs, start, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            self.stats["hedge_losers"] += 1
+        if self.on_hedge_loser is not None:
+            self.on_hedge_loser(kwargs, future.result(), time.perf_counter() - start)
+
+    def _count(self, name):
+        def increment():
+            with self._lock:
+                self.stats[name] += 1
+        return increment
+
+    def _create(self, **kwargs):
+        self._count("calls")()
+        (response, hedged), retries = retry_call(lambda deadline: self._attempt(kwargs, deadline), self.policy,
+                                                 on_retry=self._count("retries"),
+                                                 on_deadline=self._count("deadline_exceeded"))
+        return _annotate(response, retries=retries, hedged=hedged)
+
+    def close(self):
+        """Waits for the hedged requests still in flight (bounded by the deadline), so their usage is recorded."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+
+if __name__ == "__main__":
+    from fake_openai_server import start_fake_server
+    from llm_executor import run_concurrently
+    from metrics import MeteredOpenAIClient, MetricsRecorder
+
+    parser = argparse.ArgumentParser(description="Compare LLM call tail latencies with and without retries and hedging.")
+    parser.add_argument("--requests", type=int, default=400, help="Calls per configuration (default: 400)")
+    parser.add_argument("--concurrency", type=int, default=8, help="Calls in flight (default: 8)")
+    parser.add_argument("--latency", type=float, default=0.2, help="Normal latency of the fake server (default: 0.2)")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Share of 429/5xx answers (default: 0.05)")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Share of stragglers (default: 0.05)")
+    parser.add_argument("--slow-latency", type=float, default=3.0, help="Seconds a straggler takes (default: 3)")
+    parser.add_argument("--deadline", type=float, default=30.0, help="Per-request deadline (default: 30)")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(latency=args.latency, error_rate=args.error_rate, slow_rate=args.slow_rate,
+                                         slow_latency=args.slow_latency, seed=42)
+    configurations = [
+        ("SDK retries only", openai.OpenAI(base_url=base_url, api_key="fake"), None),
+        ("backoff", openai.OpenAI(base_url=base_url, api_key="fake", max_retries=0),
+         RetryPolicy(deadline=args.deadline)),
+        ("backoff + hedging", openai.OpenAI(base_url=base_url, api_key="fake", max_retries=0),
+         RetryPolicy(deadline=args.deadline, hedge=True)),
+    ]
+    for name, client, policy in configurations:
+        recorder = MetricsRecorder()
+        if policy is not None:
+            client = ResilientOpenAIClient(client, policy)
+        metered = MeteredOpenAIClient(client, recorder, "benchmark")
+        if policy is not None:
+            client.on_hedge_loser = metered.record_hedge_loser
+
+        def call(i):
+            try:
+                metered.chat.completions.create(model="fake-model", messages=[{"role": "user", "content": f"Clause {i}"}])
+            except Exception:
+                pass
+
+        run_concurrently(call, range(args.requests), args.concurrency)
+        if policy is not None:
+            client.close()
+        latencies = [entry["latency_seconds"] for entry in recorder.records if not entry["hedge_loser"]]
+        summary = recorder.aggregate()["benchmark"]
+        print(f"{name:<18}: p50 {percentile(latencies, 0.5):.2f} s, p95 {percentile(latencies, 0.95):.2f} s, "
+              f"p99 {percentile(latencies, 0.99):.2f} s, {summary['errors']} failed, "
+              f"{summary['retries']} retries, {summary['hedged']} hedged, "
+              f"{summary['hedge_losers']} duplicate requests billed")
+
+    server.shutdown()
@@ -2,22 +2,25 @@
 """
 run_pipeline.py
 This script executes a three-step Python pipeline.
-It uses argparse to manage parameters with descriptive names.
+It uses argparse to manage parameters with descriptive names and runs all steps
+in-process through pipeline.analyze().
 """
 
 import argparse
 import os
-import subprocess
-import time
-import json
-import openai
-#from path import Path
-from opik.integrations.openai import track_openai
-from opik import Opik
+import sys
 from pathlib import Path
 
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
 
-def main():
+from config import DEFAULT_CANDIDATE_THRESHOLD, PipelineConfig
+
+OPENAI_KEY_SUFFIX = "-Hel95zZHWD0WIw0iqZKsEKncbWs_0MvFrzcqEBbi5l61o7BSphQAWSP0T3BlbkFJlT0_RjG63KECZlAka1mI1q158PhlcIeKXZ41zqNjOwE_wHhy9jwCjTgZT2sQE2y-BjgiU74_gA"
+
+
+def parse_args(argv=None):
     parser = argparse.ArgumentParser(
         description="Run a three-step Python pipeline with customizable parameters."
     )
@@ -68,6 +71,194 @@ def main():
         default=None,
         help="Output JSON filename for step 2 (default: auto-generated)"
     )
+    parser.add_argument(
+        "--embedding-batch-size",
+        type=int,
+        default=64,
+        help="Maximum batch size of the shared embedding model (default: 64)"
+    )
+    parser.add_argument(
+        "--llm-concurrency",
+        type=int,
+        default=8,
+        help="Maximum number of concurrent OpenAI requests in steps 1 and 2 (default: 8)"
+    )
+    parser.add_argument(
+        "--llm-max-retries",
+        type=int,
+        default=4,
+        help="Retries of an OpenAI request on 429/5xx/timeouts, with jittered exponential backoff (default: 4)"
+    )
+    parser.add_argument(
+        "--llm-deadline",
+        type=float,
+        default=600.0,
+        help="Seconds an OpenAI request may take including retries (default: 600)"
+    )
+    parser.add_argument(
+        "--hedge",
+        action="store_true",
+        help="Send a duplicate of OpenAI requests that take longer than the recent p95 latency"
+    )
+    parser.add_argument(
+        "--hedge-quantile",
+        type=float,
+        default=0.95,
+        help="Latency quantile after which a request is hedged (default: 0.95)"
+    )
+    parser.add_argument(
+        "--no-llm-cache",
+        action="store_true",
+        help="Always call OpenAI instead of reusing cached responses"
+    )
+    parser.add_argument(
+        "--llm-cache-path",
+        default=None,
+        help="SQLite file of the LLM response cache (default: V3_Frontend/temp/llm_cache.sqlite3)"
+    )
+    parser.add_argument(
+        "--llm-cache-max-mb",
+        type=int,
+        default=256,
+        help="Size in MB above which least recently used cache entries are evicted (default: 256)"
+    )
+    parser.add_argument(
+        "--prompt-snapshot",
+        default=None,
+        help="Local prompt snapshot file (see prompt_registry.py), used when Opik is unreachable"
+    )
+    parser.add_argument(
+        "--offline-prompts",
+        action="store_true",
+        help="Read prompts only from --prompt-snapshot and don't contact Opik"
+    )
+    parser.add_argument(
+        "--trace-sink",
+        choices=["opik", "jsonl", "none"],
+        default="opik",
+        help="Where LLM call traces are exported to (default: 'opik'); use 'jsonl' for offline runs"
+    )
+    parser.add_argument(
+        "--trace-path",
+        default=None,
+        help="Output file of the jsonl trace sink (default: V3_Frontend/temp/traces.jsonl)"
+    )
+    parser.add_argument(
+        "--adaptive-k",
+        action="store_true",
+        help="Choose the number of retrieved items per clause from their scores, at most --retrieved-k"
+    )
+    parser.add_argument(
+        "--min-score",
+        type=float,
+        default=0.3,
+        help="Adaptive top-k: drop items below this similarity; the best one is always kept (default: 0.3)"
+    )
+    parser.add_argument(
+        "--max-score-drop",
+        type=float,
+        default=0.1,
+        help="Adaptive top-k: drop items scoring more than this fraction below the best one (default: 0.1)"
+    )
+    parser.add_argument(
+        "--entail-above",
+        type=float,
+        default=None,
+        help="Step 1 answers 'entailment' without an LLM call at or above this best retrieval score "
+             "(see score_thresholds.py)"
+    )
+    parser.add_argument(
+        "--missing-below",
+        type=float,
+        default=None,
+        help="Step 1 answers 'missing' without an LLM call below this best retrieval score"
+    )
+    parser.add_argument(
+        "--additional-prefilter",
+        action="store_true",
+        help="Send step 3 only the paragraphs no template clause matches instead of the whole contract and template"
+    )
+    parser.add_argument(
+        "--additional-threshold",
+        type=float,
+        default=DEFAULT_CANDIDATE_THRESHOLD,
+        help=f"Step 3 pre-filter: paragraphs below this template clause similarity are candidates "
+             f"(default: {DEFAULT_CANDIDATE_THRESHOLD})"
+    )
+    parser.add_argument(
+        "--no-index-cache",
+        action="store_true",
+        help="Always parse and encode the document instead of reusing its cached FAISS index"
+    )
+    parser.add_argument(
+        "--segmentation",
+        action="store_true",
+        help="Index clause-level units (segmentation.py) instead of every document paragraph"
+    )
+    parser.add_argument(
+        "--context-token-budget",
+        type=int,
+        default=2000,
+        help="Maximum tokens of retrieved context per step 1 prompt, 0 for no limit (default: 2000)"
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Send the LLM requests through the OpenAI Batch API (cheaper, finishes within 24 h)"
+    )
+    parser.add_argument(
+        "--batch-poll-interval",
+        type=float,
+        default=30.0,
+        help="Seconds between batch status checks (default: 30)"
+    )
+    parser.add_argument(
+        "--batch-timeout",
+        type=float,
+        default=None,
+        help="Give up waiting for a batch after this many seconds (default: wait for the batch)"
+    )
+    parser.add_argument(
+        "--output-dir",
+        default=None,
+        help="Directory for the result JSON files and the PDF (default: the run's workspace)"
+    )
+    parser.add_argument(
+        "--run-id",
+        default=None,
+        help="ID of the run; its files go to <workspace root>/<run ID> (default: generated)"
+    )
+    parser.add_argument(
+        "--workspace-root",
+        default=None,
+        help="Directory of the per-run workspaces (default: V3_Frontend/temp/runs)"
+    )
+    parser.add_argument(
+        "--workspace-retention-hours",
+        type=float,
+        default=72.0,
+        help="Remove workspaces idle for longer than this when a run starts, 0 to keep them (default: 72)"
+    )
+    parser.add_argument(
+        "--metrics-path",
+        default=None,
+        help="JSONL file every LLM call is appended to (default: V3_Frontend/temp/metrics.jsonl)"
+    )
+    parser.add_argument(
+        "--prometheus-path",
+        default=None,
+        help="Also write the run's LLM metrics to this file in Prometheus text format"
+    )
+    parser.add_argument(
+        "--pdf",
+        action="store_true",
+        help="Also write the findings PDF to the run's workspace (or --output-dir)"
+    )
+    parser.add_argument(
+        "--estimate-only",
+        action="store_true",
+        help="Print the pre-flight token and cost estimate and exit without calling OpenAI"
+    )
     parser.add_argument(
         "--openai_key", "-K",
         default=None,
@@ -79,120 +270,121 @@ def main():
         help="Basedir as Str"
     )
 
-    args = parser.parse_args()
+    return parser.parse_args(argv)
 
-    # Generate default filenames if not explicitly provided
-    sample = args.sample_doc.split(".")[0]
-    if not args.step1_json:
-        args.step1_json = f"V3-missing-{args.missing_model}-{sample}-K{args.retrieved_k}.json"
-    if not args.step2_json:
-        args.step2_json = f"V3-deviating-{args.deviating_model}-{sample}.json"
+
+def build_config(args):
+    """Turns the parsed command-line arguments into a PipelineConfig."""
     if args.basedir is None:
         args.basedir = str(Path(__file__).resolve().parent.parent)
     #if not args.doc_path:
     #    args.doc_path = f"/Users/luca/Documents/HSLU/Bachelor Thesis/thesis_luca_gafner/data/raw/{args.sample_doc}"
+    openai_key = args.openai_key + OPENAI_KEY_SUFFIX if args.openai_key else None
+
+    return PipelineConfig(
+        sample_doc=args.sample_doc,
+        doc_path=args.doc_path,
+        model_name=args.model_name,
+        missing_model=args.missing_model,
+        deviating_model=args.deviating_model,
+        additional_model=args.additional_model,
+        retrieved_k=args.retrieved_k,
+        step1_json=args.step1_json,
+        step2_json=args.step2_json,
+        openai_key=openai_key,
+        basedir=args.basedir,
+        embedding_batch_size=args.embedding_batch_size,
+        llm_concurrency=args.llm_concurrency,
+        llm_max_retries=args.llm_max_retries,
+        llm_deadline=args.llm_deadline,
+        llm_hedge=args.hedge,
+        llm_hedge_quantile=args.hedge_quantile,
+        use_llm_cache=not args.no_llm_cache,
+        llm_cache_path=args.llm_cache_path,
+        llm_cache_max_mb=args.llm_cache_max_mb,
+        prompt_snapshot=args.prompt_snapshot,
+        offline_prompts=args.offline_prompts,
+        trace_sink=args.trace_sink,
+        trace_path=args.trace_path,
+        use_index_cache=not args.no_index_cache,
+        segment_clauses=args.segmentation,
+        context_token_budget=args.context_token_budget,
+        batch_mode=args.batch,
+        batch_poll_interval=args.batch_poll_interval,
+        batch_timeout=args.batch_timeout,
+        output_dir=args.output_dir,
+        metrics_path=args.metrics_path,
+        prometheus_path=args.prometheus_path,
+        run_id=args.run_id,
+        workspace_root=args.workspace_root,
+        workspace_retention_hours=args.workspace_retention_hours,
+        adaptive_k=args.adaptive_k,
+        min_score=args.min_score,
+        max_score_drop=args.max_score_drop,
+        entail_above=args.entail_above,
+        missing_below=args.missing_below,
+        additional_prefilter=args.additional_prefilter,
+        additional_threshold=args.additional_threshold,
+    )
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    config = build_config(args)
 
     # Print out the parameters for verification
     print("Using the following parameters:")
-    print(f"  Sample Document    : {args.sample_doc}")
-    print(f"  Model Name         : {args.model_name}")
-    print(f"  Document Path      : {args.doc_path}")
-    print(f"  Missing Model      : {args.missing_model}")
-    print(f"  Deviating Model    : {args.deviating_model}")
-    print(f"  Additional Model   : {args.additional_model}")
-    print(f"  Retrieved K        : {args.retrieved_k}")
-    print(f"  Step 1 JSON Output : {args.step1_json}")
-    print(f"  Step 2 JSON Output : {args.step2_json}")
-    print(f"  Base DIR : {args.basedir}")
-    print(f"  Base DIR : {type(args.basedir)}")
+    print(f"  Sample Document    : {config.sample_doc}")
+    print(f"  Model Name         : {config.model_name}")
+    print(f"  Document Path      : {config.doc_path}")
+    print(f"  Missing Model      : {config.missing_model}")
+    print(f"  Deviating Model    : {config.deviating_model}")
+    print(f"  Additional Model   : {config.additional_model}")
+    if config.adaptive_k:
+        print(f"  Retrieved K        : adaptive, at most {config.retrieved_k} (min score {config.min_score}, "
+              f"max drop {config.max_score_drop:.0%})")
+    else:
+        print(f"  Retrieved K        : {config.retrieved_k}")
+    if config.entail_above is not None or config.missing_below is not None:
+        print(f"  Score Thresholds   : entailment >= {config.entail_above}, missing < {config.missing_below}")
+    print(f"  LLM Concurrency    : {config.llm_concurrency}")
+    print(f"  LLM Retries        : {config.llm_max_retries} (deadline {config.llm_deadline} s"
+          f"{', hedged at p' + str(round(config.llm_hedge_quantile * 100)) if config.llm_hedge else ''})")
+    print(f"  LLM Cache          : {config.llm_cache_path if config.use_llm_cache else 'disabled'}")
+    print(f"  Prompt Snapshot    : {config.prompt_snapshot} {'(offline)' if config.offline_prompts else ''}")
+    print(f"  Trace Sink         : {config.trace_sink}")
+    print(f"  Segmentation       : {'clause units' if config.segment_clauses else 'paragraphs'}")
+    print(f"  Step 3 Input       : "
+          f"{f'paragraphs below {config.additional_threshold} similarity' if config.additional_prefilter else 'whole contract'}")
+    print(f"  Mode               : {'Batch API' if config.batch_mode else 'synchronous'}")
+    print(f"  Metrics            : {config.metrics_path}")
+    print(f"  Run ID             : {config.run_id}")
+    print(f"  Workspace          : {config.workspace_dir}")
+    print(f"  Step 1 JSON Output : {config.step1_json}")
+    print(f"  Step 2 JSON Output : {config.step2_json}")
+    print(f"  Base DIR : {config.basedir}")
+    print("")
+
+    # Imported here so that --help doesn't pay for loading torch and the OpenAI/Opik SDKs
+    from prompt_registry import get_prompt_registry
+    from token_budget import format_estimate, plan_run
+
+    try:
+        prompts = get_prompt_registry(config.prompt_snapshot, config.offline_prompts).preload()
+    except Exception as e:
+        print(f"Prompts unavailable for the estimate: {e!r}")
+        prompts = None
+    print(format_estimate(plan_run(config, prompts)))
     print("")
+    if args.estimate_only:
+        return None
 
-    # Set the environment variables so they are available to the downstream Python modules
-    os.environ["SAMPLE_DOC"] = args.sample_doc
-    os.environ["MODEL_NAME"] = args.model_name
-    os.environ["DOC_PATH"] = args.doc_path
-    os.environ["OPENAI_MODEL_MISSING"] = args.missing_model
-    os.environ["OPENAI_MODEL_DEVIATING"] = args.deviating_model
-    os.environ["OPENAI_MODEL_ADDITIONAL"] = args.additional_model
-    os.environ["RETRIEVED_K"] = str(args.retrieved_k)
-    os.environ["PROCESS_STEP1_JSON"] = args.step1_json
-    os.environ["PROCESS_STEP2_JSON"] = args.step2_json
-    os.environ["OPENAI_API_KEY"] = args.openai_key + "-Hel95zZHWD0WIw0iqZKsEKncbWs_0MvFrzcqEBbi5l61o7BSphQAWSP0T3BlbkFJlT0_RjG63KECZlAka1mI1q158PhlcIeKXZ41zqNjOwE_wHhy9jwCjTgZT2sQE2y-BjgiU74_gA"
-    os.environ["BASEDIR"] = args.basedir
-
-    # Define the pipeline steps and their corresponding Python scripts
-
-    pipeline_steps = [
-        ("Running Step 1: '1_V3_RAG for top-k missing.py'...", Path(args.basedir) / "V3_Frontend/1_V3_RAG.py"),
-        ("Running Step 2: '2_V3_deviatingClauses.py'...", Path(args.basedir) / "V3_Frontend/2_V3_deviatingClauses.py"),
-        ("Running Step 3: '3_V3_AdditionalClauses.py'...", Path(args.basedir) / "V3_Frontend/3_V3_AdditionalClauses.py")
-    ]
-    # 2) Prepare output JSON
-    output_path = Path(
-        args.basedir) / "V3_Frontend/temp/execuation_details.json"
-    #output_path.parent.mkdir(parents=True, exist_ok=True)
-
-
-    # Initialize file before running any steps
-    # with output_path.open("w") as f:
-    #     json.dump({"steps": []}, f, indent=4)
-
-    results = {"steps": []}
-
-    for message, script in pipeline_steps:
-        step_record = {
-            "script": str(script),
-            "time_seconds": 0,
-            "total_tokens": 0,
-            "input_tokens": 0,
-            "output_tokens": 0
-        }
-        results["steps"].append(step_record)
-
-    # Write the prepopulated results to the JSON file
-    with output_path.open("w") as f:
-        json.dump(results, f, indent=4)
-
-    # Execute each step and update the JSON file
-    for index, (message, script) in enumerate(pipeline_steps):
-        print(message)
-
-        start_time = time.time()
-        result = subprocess.run(
-            ["python", script],
-            capture_output=True,
-            text=True
-        )
-        end_time = time.time()
-
-        elapsed = round(end_time - start_time, 1)
-        with output_path.open("r", encoding="utf-8") as f:
-            results = json.load(f)
-
-        # Update only the elapsed time for the current step
-        elapsed = round(end_time - start_time, 1)
-        results["steps"][index]["time_seconds"] = elapsed
-
-        if result.returncode != 0:
-            print(f"Error: {script} exited with code {result.returncode}")
-            print(result.stderr)
-            exit(result.returncode)
-
-        # Write the updated JSON content back to the file
-        with output_path.open("w", encoding="utf-8") as f:
-            json.dump(results, f, indent=4)
-
-
-    print("Pipeline execution completed.")
-
-    message, script = ("Running Step 4: '4_PDF Generator.py'...", "V3_Frontend/4_PDF Generator.py")
-
-    print(message)
-    result = subprocess.run(["python", script])
-    if result.returncode != 0:
-        print(f"Error: {script} exited with return code {result.returncode}")
-        exit(result.returncode)
+    from pipeline import analyze, analyze_batch
 
+    result = (analyze_batch if config.batch_mode else analyze)(config.doc_path, config, generate_pdf=args.pdf)
+    result.print_timings()
+    print(f"Results written to {result.workspace.path}")
+    return result
 
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+"""
+scheduler.py
+Runs pipeline stages as a dependency graph: every stage starts as soon as the
+stages it depends on have finished, so independent stages overlap and the run
+takes about as long as its longest dependency path.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class StageScheduler:
+    def __init__(self):
+        self._stages = {}
+        # Set as soon as a stage raises, so long-running stages can check it and stop early
+        self.failed = threading.Event()
+
+    def add_stage(self, name, fn, depends_on=()):
+        """
+        Registers a stage.
+
+        Parameters:
+        - name (str): Unique stage name.
+        - fn (callable): Called with a dict {dependency name: result} once all dependencies are done.
+        - depends_on (iterable[str]): Names of stages that have to finish first.
+        """
+        if name in self._stages:
+            raise ValueError(f"Stage '{name}' is already registered")
+        for dependency in depends_on:
+            if dependency not in self._stages:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dependency}'")
+        self._stages[name] = (fn, tuple(depends_on))
+        return self
+
+    def run(self):
+        """
+        Runs all stages.
+
+        Returns:
+        - Tuple (results, timings): results maps stage names to return values, timings maps
+          stage names to {"start", "end", "time_seconds"} (start/end relative to the run start).
+          If a stage raises, no further stages are started, failed is set for the running
+          stages to check, and the exception is re-raised once they have finished.
+        """
+        results = {}
+        timings = {}
+        lock = threading.Lock()
+        run_start = time.perf_counter()
+        pending = dict(self._stages)
+        running = {}
+        error = None
+        self.failed.clear()
+
+        def execute(name, fn, dependency_results):
+            start = time.perf_counter()
+            try:
+                return fn(dependency_results)
+            except Exception:
+                self.failed.set()
+                raise
+            finally:
+                end = time.perf_counter()
+                with lock:
+                    timings[name] = {
+                        "start": round(start - run_start, 2),
+                        "end": round(end - run_start, 2),
+                        "time_seconds": round(end - start, 1),
+                    }
+
+        with ThreadPoolExecutor(max_workers=max(len(self._stages), 1), thread_name_prefix="stage") as pool:
+            while pending or running:
+                if error is None:
+                    for name, (fn, depends_on) in list(pending.items()):
+                        if all(dependency in results for dependency in depends_on):
+                            dependency_results = {dependency: results[dependency] for dependency in depends_on}
+                            running[pool.submit(execute, name, fn, dependency_results)] = name
+                            del pending[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        error = error or e
+                        pending.clear()
+
+        if error is not None:
+            raise error
+        return results, timings
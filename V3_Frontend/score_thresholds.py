@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+score_thresholds.py
+Retrieval score thresholds that answer step 1 without an LLM call.
+
+If the best retrieved paragraph of a template clause scores at least entail_above,
+the clause is labelled "entailment"; if it scores below missing_below, "missing".
+Only the clauses in between are sent to the LLM (see 1_V3_RAG.classify_clause).
+
+The thresholds are fitted on labelled runs: step 1 JSON files whose answers came
+from the LLM. entail_above is the lowest score above which at least --precision of
+the clauses were entailed, missing_below the highest score below which at least
+--precision were missing; --margin moves both towards the ambiguous band. The
+command also reports how many calls the thresholds save on each run, and how many
+of those answers would differ from the labels.
+
+python3 V3_Frontend/score_thresholds.py V3_Frontend/temp/runs --precision 1.0 --margin 0.02
+"""
+
+import argparse
+import json
+import math
+from pathlib import Path
+
+ENTAILMENT = "entailment"
+MISSING = "missing"
+STEP1_GLOB = "V3-missing-*.json"
+DEFAULT_PRECISION = 1.0
+DEFAULT_MARGIN = 0.02
+DEFAULT_MIN_SUPPORT = 3
+
+
+def score_answer(score, entail_above=None, missing_below=None):
+    """"entailment" / "missing" if score is outside the ambiguous band, None if the LLM has to decide."""
+    if entail_above is None and missing_below is None:
+        return None
+    # Nothing retrieved: there is no paragraph the clause could be entailed by
+    if score is None:
+        return MISSING
+    if entail_above is not None and score >= entail_above:
+        return ENTAILMENT
+    if missing_below is not None and score < missing_below:
+        return MISSING
+    return None
+
+
+def load_labelled_runs(paths):
+    """
+    Reads the step 1 JSON files under paths (files, workspaces or the workspace root).
+
+    Returns:
+    - Dict {file path: [(best score, label)]} of the clauses the LLM answered.
+    """
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.rglob(STEP1_GLOB)) if path.is_dir() else [path])
+
+    runs = {}
+    for file in files:
+        with open(file, "r", encoding="utf-8") as f:
+            clauses = json.load(f)
+        samples = []
+        for clause in clauses:
+            label = (clause.get("answer") or "").strip().lower()
+            # Threshold answers would only confirm the thresholds they came from
+            if label not in (ENTAILMENT, MISSING) or clause.get("answer_source") == "threshold":
+                continue
+            scores = [entry["confidence"] for entry in clause.get("retrieved_clauses", [])]
+            samples.append((max(scores) if scores else None, label))
+        if samples:
+            runs[str(file)] = samples
+    return runs
+
+
+def _lowest_threshold(samples, label, precision, min_support):
+    """Lowest score t such that at least precision of the samples scoring >= t carry label."""
+    best = None
+    matching = total = 0
+    ranked = sorted((sample for sample in samples if sample[0] is not None), key=lambda sample: -sample[0])
+    for i, (score, sample_label) in enumerate(ranked):
+        total += 1
+        matching += sample_label == label
+        # Ties are decided together
+        if i + 1 < len(ranked) and ranked[i + 1][0] == score:
+            continue
+        if total >= min_support and matching / total >= precision:
+            best = score
+    return best
+
+
+def fit_thresholds(samples, precision=DEFAULT_PRECISION, margin=DEFAULT_MARGIN, min_support=DEFAULT_MIN_SUPPORT):
+    """
+    Fits (entail_above, missing_below) on (best score, label) samples; a threshold is None if
+    no score separates at least min_support samples with the requested precision.
+    """
+    entail_above = _lowest_threshold(samples, ENTAILMENT, precision, min_support)
+    # Same scan from the bottom: with negated scores, "score <= t" becomes "-score >= -t"
+    highest_missing = _lowest_threshold([(-score, label) for score, label in samples if score is not None],
+                                        MISSING, precision, min_support)
+
+    # Rounded towards the ambiguous band, so rounding never widens what the thresholds decide
+    if entail_above is not None:
+        entail_above = math.ceil((entail_above + margin) * 10000) / 10000
+    missing_below = None
+    if highest_missing is not None:
+        missing_below = math.floor((-highest_missing - margin) * 10000) / 10000
+    if entail_above is not None and missing_below is not None and missing_below > entail_above:
+        missing_below = entail_above
+    return entail_above, missing_below
+
+
+def evaluate(samples, entail_above, missing_below):
+    """LLM calls the thresholds save on a run, and how many of those answers contradict the labels."""
+    saved = errors = 0
+    for score, label in samples:
+        answer = score_answer(score, entail_above, missing_below)
+        if answer is not None:
+            saved += 1
+            errors += answer != label
+    return {"clauses": len(samples), "calls_saved": saved, "errors": errors,
+            "saved_share": round(saved / len(samples), 3) if samples else 0}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fit the step 1 score thresholds on labelled runs.")
+    parser.add_argument("paths", nargs="+", help="Step 1 JSON files, run workspaces or the workspace root")
+    parser.add_argument("--precision", type=float, default=DEFAULT_PRECISION,
+                        help=f"Share of threshold answers that must match the labels (default: {DEFAULT_PRECISION})")
+    parser.add_argument("--margin", type=float, default=DEFAULT_MARGIN,
+                        help=f"Safety margin moved into the ambiguous band (default: {DEFAULT_MARGIN})")
+    parser.add_argument("--min-support", type=int, default=DEFAULT_MIN_SUPPORT,
+                        help=f"Clauses a threshold must decide on the labelled runs (default: {DEFAULT_MIN_SUPPORT})")
+    args = parser.parse_args()
+
+    runs = load_labelled_runs(args.paths)
+    if not runs:
+        raise SystemExit(f"No labelled step 1 files ({STEP1_GLOB}) found.")
+    samples = [sample for run_samples in runs.values() for sample in run_samples]
+    entail_above, missing_below = fit_thresholds(samples, args.precision, args.margin, args.min_support)
+
+    print(f"Labelled clauses: {len(samples)} from {len(runs)} runs")
+    print(f"Thresholds: entailment >= {entail_above}, missing < {missing_below}")
+    for path, run_samples in runs.items():
+        result = evaluate(run_samples, entail_above, missing_below)
+        print(f"  {path}: {result['calls_saved']}/{result['clauses']} calls saved ({result['saved_share']:.0%}), "
+              f"{result['errors']} wrong")
+    total = evaluate(samples, entail_above, missing_below)
+    print(f"Total: {total['calls_saved']}/{total['clauses']} calls saved ({total['saved_share']:.0%}), "
+          f"{total['errors']} wrong")
+    flags = []
+    if entail_above is not None:
+        flags.append(f"--entail-above {entail_above}")
+    if missing_below is not None:
+        flags.append(f"--missing-below {missing_below}")
+    if flags:
+        print(f"run_pipeline.py options: {' '.join(flags)}")
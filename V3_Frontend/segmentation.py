@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+segmentation.py
+Turns the paragraphs of a DocumentIR into clause-level retrieval units.
+
+- Numbered clause bodies ("2.1 Each Party undertakes ...") absorb the paragraphs
+  that continue them: lettered items, deeper list levels and paragraphs following
+  a sentence that ends with ":".
+- Headings, signature blocks, boilerplate (page numbers, "IN WITNESS WHEREOF", ...),
+  short fragments and near-duplicate units are dropped.
+
+Fewer, complete units mean fewer FAISS entries and shorter step 1/2 prompts, since
+the retrieved units are pasted into them. The heading heuristic is loose, so the
+pipeline only segments with --segmentation.
+
+Compare a document's paragraphs with its units (index size and retrieved prompt context):
+python3 V3_Frontend/segmentation.py -d "data/raw/Sample 2.docx"
+"""
+
+import argparse
+import importlib
+import os
+import re
+import sys
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+DEFAULT_MAX_UNIT_CHARS = 2000
+DEFAULT_MIN_UNIT_WORDS = 5
+DEFAULT_DUPLICATE_THRESHOLD = 0.9
+SIGNATURE_LINE_MAX_WORDS = 8
+
+# Typed numbers that start a new clause: "2", "2.1", "2.1.3"
+_CLAUSE_NUMBER = re.compile(r"^[0-9]+(?:\.[0-9]+)*$")
+# Signature-block labels and blank lines to sign on, a signature line whatever follows them
+_SIGNATURE_LABEL = re.compile(r"^(by:|name:|title:|date:|place[ ,/]+date\b|_{3,}|\.{5,})", re.IGNORECASE)
+# Openings of signature lines that are also how clauses start ("Signed copies shall ..."): only short lines count
+_SIGNATURE = re.compile(r"^(signature|signed\b|for and on behalf of)", re.IGNORECASE)
+_BOILERPLATE = re.compile(
+    r"^(page \d+( of \d+)?|\d+ ?/ ?\d+|in witness whereof\b.*|\[?signature page follows\]?|"
+    r"\[?(remainder|rest) of (this )?page (intentionally )?(left )?blank\]?|confidential|strictly confidential)$",
+    re.IGNORECASE,
+)
+_WORD = re.compile(r"\w+")
+
+
+class Segment:
+    def __init__(self, id, text, paragraph_ids, numbering=None):
+        """
+        A retrieval unit built from one or more consecutive document paragraphs.
+
+        Parameters:
+        - id (str): ID of the unit's first paragraph.
+        - text (str): Paragraph texts joined by newlines.
+        - paragraph_ids (list[str]): IDs of all paragraphs merged into the unit.
+        - numbering (str): Clause number of the first paragraph, if any.
+        """
+        self.id = id
+        self.text = text
+        self.paragraph_ids = paragraph_ids
+        self.numbering = numbering
+
+    def __repr__(self):
+        return f"Segment(id={self.id!r}, paragraphs={len(self.paragraph_ids)}, text={self.text[:40]!r})"
+
+
+def _words(text):
+    return _WORD.findall(text.lower())
+
+
+def is_heading(paragraph):
+    # Lettered items and nested list entries are clause content, however short
+    if (paragraph.numbering and not _CLAUSE_NUMBER.match(paragraph.numbering)) or (paragraph.list_level or 0) > 0:
+        return False
+    if paragraph.style and paragraph.style.lower().startswith(("heading", "title")):
+        return True
+    # Short lines without closing punctuation, e.g. "2. Confidentiality" or "DEFINITIONS"
+    text = paragraph.text
+    return len(_words(text)) <= 6 and not text.rstrip().endswith((".", ";", ":", ","))
+
+
+def is_signature(text):
+    text = text.strip()
+    if _SIGNATURE_LABEL.match(text):
+        return True
+    return bool(_SIGNATURE.match(text)) and len(_words(text)) <= SIGNATURE_LINE_MAX_WORDS
+
+
+def is_boilerplate(text):
+    return bool(_BOILERPLATE.match(text.strip().strip("-– ")))
+
+
+def _continues_unit(paragraph, current):
+    """Whether a paragraph belongs to the unit that is currently being built."""
+    if current is None or paragraph.source == "table":
+        return False
+    if paragraph.numbering and _CLAUSE_NUMBER.match(paragraph.numbering):
+        return False
+    if paragraph.numbering or (paragraph.list_level or 0) > 0:
+        return True
+    return current["text"][-1].rstrip().endswith(":")
+
+
+def _shingles(text, size=3):
+    words = _words(text)
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def _drop_near_duplicates(segments, threshold):
+    kept, kept_shingles, dropped = [], [], 0
+    for segment in segments:
+        shingles = _shingles(segment.text)
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            dropped += len(segment.paragraph_ids)
+            continue
+        kept.append(segment)
+        kept_shingles.append(shingles)
+    return kept, dropped
+
+
+def segment_document(document, max_unit_chars=DEFAULT_MAX_UNIT_CHARS, min_unit_words=DEFAULT_MIN_UNIT_WORDS,
+                     duplicate_threshold=DEFAULT_DUPLICATE_THRESHOLD):
+    """
+    Splits a DocumentIR into retrieval units.
+
+    Parameters:
+    - document (DocumentIR): The parsed contract.
+    - max_unit_chars (int): A unit is closed once merging would make it longer than this.
+    - min_unit_words (int): Units with fewer words are dropped as fragments.
+    - duplicate_threshold (float): Word-trigram Jaccard similarity from which a unit counts
+      as a duplicate of an earlier one.
+
+    Returns:
+    - Tuple (segments, report) where report counts the dropped paragraphs per reason and
+      compares the size of the paragraphs with the size of the units.
+    """
+    dropped = {"heading": 0, "signature": 0, "boilerplate": 0, "fragment": 0, "duplicate": 0}
+    units = []
+    current = None
+    in_signature_block = False
+
+    for paragraph in document.paragraphs:
+        text = paragraph.text
+        if is_boilerplate(text):
+            dropped["boilerplate"] += 1
+            continue
+        # A signature line starts a block of short lines (names, titles, places, dates)
+        if is_signature(text):
+            in_signature_block = True
+        if in_signature_block and (is_signature(text) or len(_words(text)) <= SIGNATURE_LINE_MAX_WORDS):
+            dropped["signature"] += 1
+            continue
+        in_signature_block = False
+        if is_heading(paragraph):
+            dropped["heading"] += 1
+            current = None
+            continue
+
+        if _continues_unit(paragraph, current) and \
+                sum(len(part) + 1 for part in current["text"]) + len(text) <= max_unit_chars:
+            current["text"].append(text)
+            current["paragraph_ids"].append(paragraph.id)
+            continue
+
+        current = {"id": paragraph.id, "text": [text], "paragraph_ids": [paragraph.id],
+                   "numbering": paragraph.numbering}
+        units.append(current)
+
+    segments = []
+    for unit in units:
+        text = "\n".join(unit["text"])
+        if len(_words(text)) < min_unit_words:
+            dropped["fragment"] += len(unit["paragraph_ids"])
+            continue
+        segments.append(Segment(unit["id"], text, unit["paragraph_ids"], unit["numbering"]))
+    segments, dropped["duplicate"] = _drop_near_duplicates(segments, duplicate_threshold)
+
+    paragraph_chars = sum(len(paragraph.text) for paragraph in document.paragraphs)
+    segment_chars = sum(len(segment.text) for segment in segments)
+    report = {
+        "paragraphs": len(document.paragraphs),
+        "units": len(segments),
+        "merged_paragraphs": sum(len(segment.paragraph_ids) - 1 for segment in segments),
+        "dropped": dropped,
+        "paragraph_chars": paragraph_chars,
+        "unit_chars": segment_chars,
+        "index_reduction": round(1 - len(segments) / len(document.paragraphs), 3) if document.paragraphs else 0,
+    }
+    return segments, report
+
+
+def retrieved_context_tokens(clauses, encoding):
+    """Tokens of the retrieved context that step 1 pastes into the prompts of all clauses."""
+    return sum(len(encoding.encode(clause.return_retrievedClauses())) for clause in clauses)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare paragraph and clause-level retrieval units of a document.")
+    parser.add_argument("--doc-path", "-d", required=True, help="Path to the .docx document")
+    parser.add_argument("--model-name", "-m", default=None, help="Embedding model (default: the pipeline's model)")
+    parser.add_argument("--retrieved-k", "-k", type=int, default=3, help="Number of items to retrieve (default: 3)")
+    args = parser.parse_args()
+
+    import tiktoken
+    from config import BASEDIR
+    from document import load_document
+    from embedding_service import DEFAULT_MODEL_NAME, get_embedding_service
+
+    rag_step = importlib.import_module("1_V3_RAG")
+    model_name = args.model_name or DEFAULT_MODEL_NAME
+    document = load_document(args.doc_path)
+    segments, report = segment_document(document)
+    print(f"Paragraphs: {report['paragraphs']}  Units: {report['units']}  "
+          f"(index {report['index_reduction']:.0%} smaller, {report['merged_paragraphs']} paragraphs merged)")
+    print(f"Dropped: {report['dropped']}")
+
+    embedding_model = get_embedding_service(model_name).start()
+    encoding = tiktoken.get_encoding("o200k_base")
+    template_path = BASEDIR / "data/V3 - Template Clause MLL.json"
+    tokens = {}
+    for name, units in (("paragraphs", document.texts()), ("units", [segment.text for segment in segments])):
+        index, paragraphs = rag_step.initialize_faiss_index(args.doc_path, embedding_model, cache_dir=None,
+                                                            units=units)
+        clauses = rag_step.retrieve_template_clauses(index, paragraphs, template_path, embedding_model,
+                                                     args.retrieved_k, model_name)
+        tokens[name] = retrieved_context_tokens(clauses, encoding)
+    print(f"Retrieved prompt context: {tokens['paragraphs']} tokens with paragraphs, {tokens['units']} with units "
+          f"({1 - tokens['units'] / max(tokens['paragraphs'], 1):.0%} fewer)")
@@ -0,0 +1,247 @@
+"""
+token_budget.py
+Counts tokens before requests are sent.
+
+- estimate_run() projects the input/output tokens and cost of every step from the
+  document, the template and config.MODEL_PRICING, without calling OpenAI.
+- trim_retrieved_context() cuts the retrieved paragraphs of a clause down to a
+  per-call token budget, lowest-ranked paragraphs first, for the step 1 prompt.
+- ensure_fits_context() fails a request that can't fit the model's context window
+  before it is sent, instead of after a slow round trip.
+
+Print the estimate for a document without running the pipeline:
+python3 V3_Frontend/run_pipeline.py -s "Sample 2.docx" -d "data/raw/Sample 2.docx" --estimate-only
+"""
+
+import copy
+import json
+import os
+import sys
+from functools import lru_cache
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import tiktoken
+
+from config import MODEL_CONTEXT_TOKENS, MODEL_PRICING
+from prompt_registry import ADDITIONAL_PROMPT, DEVIATING_PROMPT, MISSING_PROMPT, SYSTEM_PROMPT
+
+DEFAULT_ENCODING = "o200k_base"
+# Tokens the chat format adds per message and per request
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REQUEST = 3
+# Lines return_retrievedClauses() adds around each retrieved paragraph ("1. Confidence: ...", "-----")
+TOKENS_PER_RETRIEVED_CLAUSE = 12
+
+# Rough answer lengths used for the cost projection
+DEFAULT_OUTPUT_TOKENS = {"missing": 5, "deviating": 400, "additional": 2000}
+REASONING_MODEL_PREFIXES = ("o1", "o3", "o4", "gpt-5")
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model=None):
+    """Returns the tiktoken encoding of a model, o200k_base for unknown models."""
+    if model:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+    return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text, model=None):
+    return len(get_encoding(model).encode(text or "", disallowed_special=()))
+
+
+def count_message_tokens(messages, model=None):
+    """Input tokens of a chat.completions request with the given messages."""
+    return TOKENS_PER_REQUEST + sum(TOKENS_PER_MESSAGE + count_tokens(message["content"], model)
+                                    for message in messages)
+
+
+def ensure_fits_context(messages, model, reserved_output_tokens=0):
+    """
+    Raises ValueError if the messages plus reserved_output_tokens exceed the model's context
+    window (models without a known window are not checked). Returns the input token count.
+    """
+    input_tokens = count_message_tokens(messages, model)
+    context_tokens = MODEL_CONTEXT_TOKENS.get(model)
+    if context_tokens is not None and input_tokens + reserved_output_tokens > context_tokens:
+        raise ValueError(
+            f"Request needs {input_tokens} input tokens (+{reserved_output_tokens} reserved for the answer), "
+            f"but {model} has a context window of {context_tokens} tokens."
+        )
+    return input_tokens
+
+
+def truncate_to_tokens(text, max_tokens, model=None):
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max(max_tokens, 0)])
+
+
+def trim_retrieved_context(clause, budget, model=None):
+    """
+    Returns a copy of a RetrievedClause with the best ranked retrieved paragraphs that fit
+    into budget tokens; the paragraph that crosses the budget is truncated. The top paragraph
+    is always kept (truncated if needed). Only meant for rendering the step 1 prompt: clause
+    itself is unchanged, so step 2 and the results still get the full paragraphs.
+    """
+    if not budget or not clause.retrieved_clauses:
+        return clause
+
+    kept, used = [], 0
+    for text, score in clause.retrieved_clauses:
+        tokens = count_tokens(text, model) + TOKENS_PER_RETRIEVED_CLAUSE
+        remaining = budget - used
+        if tokens <= remaining:
+            kept.append((text, score))
+            used += tokens
+        elif not kept or remaining > 4 * TOKENS_PER_RETRIEVED_CLAUSE:
+            truncated = truncate_to_tokens(text, max(remaining - TOKENS_PER_RETRIEVED_CLAUSE, 1), model)
+            kept.append((truncated, score))
+            used += count_tokens(truncated, model) + TOKENS_PER_RETRIEVED_CLAUSE
+    trimmed = copy.copy(clause)
+    trimmed.retrieved_clauses = kept
+    return trimmed
+
+
+def project_cost(model, input_tokens, output_tokens):
+    """Cost in $ from config.MODEL_PRICING, None for models without pricing."""
+    if model not in MODEL_PRICING:
+        return None
+    return input_tokens * MODEL_PRICING[model]["input"] + output_tokens * MODEL_PRICING[model]["output"]
+
+
+def _render(prompts, name, **kwargs):
+    """Renders a prompt if a registry is available, otherwise just joins the variable parts."""
+    if prompts is None:
+        return "\n".join(str(value) for value in kwargs.values())
+    return prompts.format(name, **kwargs)
+
+
+def _stage(name, model, calls, input_tokens, output_tokens):
+    cost = project_cost(model, input_tokens, output_tokens)
+    return {
+        "name": name,
+        "model": model,
+        "calls": calls,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cost": round(cost, 4) if cost is not None else None,
+    }
+
+
+def estimate_run(config, units, full_text, template, prompts=None, entailment_ratio=1.0,
+                 output_tokens=DEFAULT_OUTPUT_TOKENS):
+    """
+    Projects tokens and cost of steps 1-3 before anything is sent.
+
+    Parameters:
+    - config (PipelineConfig): Models, retrieved_k and context_token_budget of the run.
+    - units (list[str]): The texts that will be indexed (paragraphs or clause units).
+    - full_text (str): The document text step 3 receives.
+    - template (dict): The template clause JSON.
+    - prompts (PromptRegistry): Used to include the prompt templates; without it only the
+      variable parts (clauses, retrieved context, contract) are counted.
+    - entailment_ratio (float): Share of clauses expected to reach step 2; 1.0 gives an upper bound.
+    - output_tokens (dict): Expected answer tokens per call for "missing", "deviating", "additional".
+
+    Returns:
+    - Dict with "stages" (name, model, calls, input_tokens, output_tokens, cost),
+      "total_input_tokens", "total_output_tokens", "total_cost" and "warnings".
+    """
+    clauses = [value for clause_group in template.values() if isinstance(clause_group, dict)
+               for value in clause_group.values()]
+    warnings = []
+    system_prompt = _render(prompts, SYSTEM_PROMPT) if prompts is not None else ""
+
+    # Retrieved context: k average units, capped by the per-call budget
+    unit_tokens = [count_tokens(unit, config.missing_model) for unit in units] or [0]
+    average_unit_tokens = sum(unit_tokens) / len(unit_tokens)
+    context_tokens = min(len(unit_tokens), config.retrieved_k) * (average_unit_tokens + TOKENS_PER_RETRIEVED_CLAUSE)
+    if config.context_token_budget:
+        context_tokens = min(context_tokens, config.context_token_budget)
+    context_tokens = int(context_tokens)
+
+    step1_input = 0
+    for clause in clauses:
+        messages = [{"role": "system", "content": system_prompt},
+                    {"role": "user", "content": _render(prompts, MISSING_PROMPT, input_clause=clause,
+                                                        retrieved_clauses="")}]
+        step1_input += count_message_tokens(messages, config.missing_model) + context_tokens
+
+    step2_calls = round(len(clauses) * entailment_ratio)
+    step2_input = 0
+    # Step 2 gets the untrimmed best paragraph
+    best_clause_tokens = max(unit_tokens)
+    for clause in clauses[:step2_calls]:
+        messages = [{"role": "system", "content": system_prompt},
+                    {"role": "user", "content": _render(prompts, DEVIATING_PROMPT, name="", subname="",
+                                                        template_clause=clause, counterparty_clause="")}]
+        step2_input += count_message_tokens(messages, config.deviating_model) + best_clause_tokens
+
+    step3_messages = [{"role": "system", "content": system_prompt},
+                      {"role": "user", "content": _render(prompts, ADDITIONAL_PROMPT, MLL_template=template,
+                                                          external_contract=full_text)}]
+    step3_input = count_message_tokens(step3_messages, config.additional_model)
+    context_window = MODEL_CONTEXT_TOKENS.get(config.additional_model)
+    if context_window is not None and step3_input + output_tokens["additional"] > context_window:
+        warnings.append(f"Step 3 needs about {step3_input} input tokens, more than the {context_window} "
+                        f"token context window of {config.additional_model}.")
+
+    stages = [
+        _stage("Step 1 (Missing)", config.missing_model, len(clauses), step1_input,
+               len(clauses) * output_tokens["missing"]),
+        _stage("Step 2 (Deviation)", config.deviating_model, step2_calls, step2_input,
+               step2_calls * output_tokens["deviating"]),
+        _stage("Step 3 (Additional)", config.additional_model, 1, step3_input, output_tokens["additional"]),
+    ]
+    for stage in stages:
+        if stage["cost"] is None:
+            warnings.append(f"No pricing for {stage['model']}, its cost is not included.")
+        if stage["model"].startswith(REASONING_MODEL_PREFIXES):
+            warnings.append(f"{stage['model']} bills hidden reasoning tokens as output; "
+                            f"the {stage['name']} output estimate doesn't include them.")
+    if prompts is None:
+        warnings.append("Prompt templates weren't available, only clause and document tokens are counted.")
+
+    return {
+        "stages": stages,
+        "total_input_tokens": sum(stage["input_tokens"] for stage in stages),
+        "total_output_tokens": sum(stage["output_tokens"] for stage in stages),
+        "total_cost": round(sum(stage["cost"] or 0 for stage in stages), 4),
+        "warnings": list(dict.fromkeys(warnings)),
+    }
+
+
+def plan_run(config, prompts=None, entailment_ratio=1.0):
+    """Loads the document and template of config and returns estimate_run() for them."""
+    from document import load_document
+    from segmentation import segment_document
+
+    document = load_document(config.doc_path, config.document_cache_dir)
+    units = document.texts()
+    if config.segment_clauses:
+        segments, _ = segment_document(document)
+        units = [segment.text for segment in segments] or units
+    with open(config.template_path, "r", encoding="utf-8") as f:
+        template = json.load(f)
+    return estimate_run(config, units, document.full_text, template, prompts, entailment_ratio)
+
+
+def format_estimate(estimate):
+    lines = ["Pre-flight estimate:"]
+    for stage in estimate["stages"]:
+        cost = f"{stage['cost']:.4f} $" if stage["cost"] is not None else "n/a"
+        lines.append(f"  {stage['name']:<20}: {stage['calls']:>3} calls, {stage['input_tokens']:>8} in, "
+                     f"{stage['output_tokens']:>6} out, {cost}")
+    lines.append(f"  Total                : {estimate['total_input_tokens']} in, "
+                 f"{estimate['total_output_tokens']} out, {estimate['total_cost']:.4f} $")
+    lines.extend(f"  ! {warning}" for warning in estimate["warnings"])
+    return "\n".join(lines)
+
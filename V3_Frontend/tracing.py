@@ -0,0 +1,178 @@
+"""
+tracing.py
+Keeps tracing off the LLM request path: spans are put into a bounded in-memory
+buffer and shipped in batches by a background thread. When the buffer is full,
+spans are dropped according to the drop policy instead of blocking the caller.
+
+Sinks:
+- OpikSink: sends the spans as Opik traces (the previous behaviour).
+- JsonlSink: appends the spans to a local JSONL file, for offline runs.
+- NoopSink: discards everything.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from pathlib import Path
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class NoopSink:
+    def export(self, spans):
+        pass
+
+    def close(self):
+        pass
+
+
+class JsonlSink:
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def export(self, spans):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+    def close(self):
+        pass
+
+
+class OpikSink:
+    def __init__(self, opik_client=None):
+        """Creates the Opik client on the exporter thread if none is given."""
+        self._client = opik_client
+
+    def export(self, spans):
+        if self._client is None:
+            from utils import initialize_opik_client
+            self._client = initialize_opik_client()
+        for span in spans:
+            self._client.trace(
+                name=span["name"],
+                input=span["input"],
+                output=span["output"],
+                thread_id=span.get("thread_id"),
+                metadata=span.get("metadata"),
+            )
+        self._client.flush()
+
+    def close(self):
+        if self._client is not None:
+            self._client.end()
+
+
+class TraceExporter:
+    def __init__(self, sink=None, max_buffer=1000, batch_size=50, flush_interval=2.0, drop_policy=DROP_OLDEST):
+        """
+        Parameters:
+        - sink: Object with export(list[dict]) and close(); defaults to NoopSink.
+        - max_buffer (int): Maximum number of spans waiting to be exported.
+        - batch_size (int): Maximum number of spans passed to one export call.
+        - flush_interval (float): Seconds between exports when fewer than batch_size spans wait.
+        - drop_policy (str): DROP_OLDEST or DROP_NEWEST, applied when the buffer is full.
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"Unknown drop policy '{drop_policy}'")
+        self.sink = sink or NoopSink()
+        self.max_buffer = max_buffer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.drop_policy = drop_policy
+        self.stats = {"recorded": 0, "exported": 0, "dropped": 0, "failed": 0}
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._in_flight = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+
+    def trace(self, name, input=None, output=None, thread_id=None, metadata=None):
+        """Records a span without doing any I/O. Same keywords as Opik's client.trace()."""
+        span = {
+            "name": name,
+            "input": input,
+            "output": output,
+            "thread_id": thread_id,
+            "metadata": metadata,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        with self._condition:
+            if self._closed:
+                self.stats["dropped"] += 1
+                return
+            self.stats["recorded"] += 1
+            if len(self._buffer) >= self.max_buffer:
+                self.stats["dropped"] += 1
+                if self.drop_policy == DROP_NEWEST:
+                    return
+                self._buffer.popleft()
+            self._buffer.append(span)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify()
+
+    def flush(self, timeout=10.0):
+        """Waits until all buffered spans are exported. Returns False on timeout."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            self._condition.notify()
+            while self._buffer or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(min(remaining, 0.1))
+        return True
+
+    def close(self, timeout=10.0):
+        """Exports what's left (up to timeout), stops the background thread and closes the sink."""
+        flushed = self.flush(timeout)
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self.sink.close()
+        return flushed
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._buffer and not self._closed:
+                    self._condition.wait(self.flush_interval)
+                if not self._buffer:
+                    if self._closed:
+                        return
+                    continue
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                self._in_flight = len(batch)
+            try:
+                self.sink.export(batch)
+                exported, failed = len(batch), 0
+            except Exception as e:
+                print(f"Trace export failed, dropping {len(batch)} spans: {e!r}")
+                exported, failed = 0, len(batch)
+            with self._condition:
+                self._in_flight = 0
+                self.stats["exported"] += exported
+                self.stats["failed"] += failed
+                self._condition.notify_all()
+
+
+def create_tracer(sink="opik", path=None, opik_client=None, **kwargs):
+    """
+    Builds a TraceExporter for a sink name: "opik", "jsonl" (needs path) or "none".
+    Extra keyword arguments are passed to TraceExporter.
+    """
+    if sink == "opik":
+        return TraceExporter(OpikSink(opik_client), **kwargs)
+    if sink == "jsonl":
+        if path is None:
+            raise ValueError("The jsonl trace sink needs a path")
+        return TraceExporter(JsonlSink(path), **kwargs)
+    if sink == "none":
+        return TraceExporter(NoopSink(), **kwargs)
+    raise ValueError(f"Unknown trace sink '{sink}'")
@@ -4,17 +4,21 @@ from opik import Opik
 from opik.integrations.openai import track_openai
 import streamlit as st
 
-def initialize_openai_client():
-    """Initializes the OpenAI client with the provided API key."""
+def initialize_openai_client(api_key=None, max_retries=2, track=False):
+    """
+    Initializes the OpenAI client with the provided API key.
+    max_retries are the SDK's own retries; pass 0 when the calls go through resilience.py.
+    track wraps the client with Opik's track_openai, which logs every call synchronously;
+    the steps export their traces through tracing.TraceExporter instead, so it is off.
+    """
     #client = Opik(project_name="BAA Thesis")
-    api_key = os.getenv('OPENAI_API_KEY')
+    api_key = api_key or os.getenv('OPENAI_API_KEY')
     if not api_key:
         raise EnvironmentError("OPENAI_API_KEY not found in environment variables.")
     #openai.api_key = api_key
     #openai_client = openai.OpenAI()
-    client = openai.OpenAI(api_key=api_key)
-    openai_client = track_openai(client)
-    return openai_client
+    client = openai.OpenAI(api_key=api_key, max_retries=max_retries)
+    return track_openai(client) if track else client
 
 def initialize_opik_client():
     api_key = st.secrets["OPIK"]
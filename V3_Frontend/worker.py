@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+worker.py
+Runs the analysis jobs of the job store (job_store.py).
+
+Each worker process loads the embedding model once, then claims one job at a time,
+renews its lease with heartbeats while the pipeline runs, and writes the progress
+events and the result back to the store. Start as many processes, on as many hosts,
+as there is capacity; they only share the job database (JOB_STORE_PATH).
+
+If a worker dies, its job is queued again once the lease runs out. A worker whose
+lease was taken over (e.g. after a long network partition) aborts the job at its next
+progress event and drops its result.
+
+Workers run with their own OPENAI_API_KEY. The app starts an in-process worker
+(start_in_process_worker) when no worker is alive or when the user enters a key;
+that key is handed to the worker in memory and never written to the job store.
+
+python3 V3_Frontend/worker.py --processes 2
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+if current_dir not in sys.path:
+    sys.path.insert(0, current_dir)
+
+import run_pipeline
+from job_store import DEFAULT_LEASE_SECONDS, JobStore
+from workspace import DEFAULT_WORKSPACE_ROOT, create_workspace
+
+DEFAULT_POLL_INTERVAL = 2.0
+
+
+class LeaseLost(Exception):
+    """Raised from the progress callback to abort a job another worker has taken over."""
+
+
+def job_result(result):
+    """The JSON result of a job: what the app renders, plus the run statistics and the report header."""
+    config = result.config
+    return {
+        "missing": result.missing,
+        "deviating": result.deviating_data,
+        "additional": result.additional,
+        "execution_details": result.execution_details(),
+        "report": {
+            "sample_doc": config.sample_doc,
+            "model_name": config.model_name,
+            "missing_model": config.missing_model,
+            "deviating_model": config.deviating_model,
+            "additional_model": config.additional_model,
+        },
+        "workspace": str(result.workspace.path),
+    }
+
+
+class Worker:
+    def __init__(self, store: JobStore, worker_id=None, poll_interval=DEFAULT_POLL_INTERVAL,
+                 workspace_root=DEFAULT_WORKSPACE_ROOT, openai_keys=None):
+        """
+        Parameters:
+        - store (JobStore): The shared job store.
+        - worker_id (str): Name of the worker in the store, defaults to <host>-<pid>.
+        - poll_interval (float): Seconds between claims while the queue is empty.
+        - workspace_root (str | Path): Directory of the run workspaces; a job runs in the workspace named
+          after its ID.
+        - openai_keys (dict): {job ID: OpenAI key} handed over in memory by the submitter of pinned
+          jobs (in-process workers only); other jobs use OPENAI_API_KEY.
+        """
+        self.store = store
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+        self.poll_interval = poll_interval
+        self.workspace_root = workspace_root
+        self.openai_keys = openai_keys if openai_keys is not None else {}
+
+    def _heartbeat(self, job_id, stop, lost):
+        while not stop.wait(self.store.lease_seconds / 3):
+            try:
+                self.store.worker_seen(self.worker_id)
+                if not self.store.heartbeat(job_id, self.worker_id):
+                    print(f"Job {job_id} is no longer leased to {self.worker_id}; aborting it.")
+                    lost.set()
+                    return
+            except Exception as e:
+                # Keep trying until the lease runs out; the store may be briefly unreachable
+                print(f"Heartbeat for job {job_id} failed: {e!r}")
+
+    def run_job(self, job):
+        from pipeline import analyze, analyze_batch
+
+        job_id = job["id"]
+        stop, lost = threading.Event(), threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop, lost), daemon=True)
+        heartbeat.start()
+
+        def progress(event):
+            # Stops the pipeline (and its LLM calls) once another worker owns the job
+            if lost.is_set():
+                raise LeaseLost(f"Lease of job {job_id} lost")
+            self.store.add_event(job_id, event)
+
+        workspace = None
+        try:
+            # A retried job reuses the workspace of its earlier attempt
+            workspace = create_workspace(self.workspace_root, run_id=job_id, worker_id=self.worker_id)
+            doc_path = workspace.file(job["filename"])
+            doc_path.write_bytes(job["document"])
+
+            argv = ["-s", job["sample_doc"], "-d", str(doc_path), "--run-id", job_id,
+                    "--workspace-root", str(self.workspace_root)] + job["args"]
+            if self.openai_keys.get(job_id):
+                argv += ["-K", self.openai_keys[job_id]]
+            config = run_pipeline.build_config(run_pipeline.parse_args(argv))
+            # No PDF: the app renders it from the job result when the user asks for it
+            result = (analyze_batch if config.batch_mode else analyze)(str(doc_path), config, progress=progress)
+            saved = self.store.complete(job_id, self.worker_id, job_result(result))
+        except Exception as e:
+            traceback.print_exc()
+            if workspace is not None:
+                try:
+                    workspace.update(status="failed", error=repr(e))
+                except OSError:
+                    pass
+            try:
+                saved = self.store.fail(job_id, self.worker_id, repr(e))
+            except Exception as fail_error:
+                # The store may be briefly unreachable; the lease runs out and the next claim retries the job
+                print(f"Could not mark job {job_id} as failed: {fail_error!r}")
+                saved = None
+        finally:
+            stop.set()
+            heartbeat.join()
+        if saved:
+            self.openai_keys.pop(job_id, None)
+        elif saved is not None:
+            print(f"Lost the lease of job {job_id}; its result was dropped.")
+        return bool(saved)
+
+    def run(self, once=False):
+        """Processes jobs until interrupted, or until the queue is empty if once is set."""
+        print(f"Worker {self.worker_id} polling {self.store.path}")
+        while True:
+            self.store.worker_seen(self.worker_id)
+            job = self.store.claim(self.worker_id)
+            if job is None:
+                if once:
+                    return
+                time.sleep(self.poll_interval)
+                continue
+            print(f"Worker {self.worker_id}: job {job['id']} ({job['sample_doc']}, attempt {job['attempts']})")
+            start_time = time.time()
+            self.run_job(job)
+            print(f"Worker {self.worker_id}: job {job['id']} finished in {round(time.time() - start_time, 1)} s")
+
+
+def start_in_process_worker(store: JobStore, worker_id=None, poll_interval=0.5):
+    """Runs a Worker in a daemon thread of the current process, e.g. the Streamlit app. Returns the Worker."""
+    worker = Worker(store, worker_id or f"{socket.gethostname()}-{os.getpid()}-inprocess", poll_interval)
+    # Report in before the first claim, so the submitter sees a live worker right away
+    store.worker_seen(worker.worker_id)
+    threading.Thread(target=worker.run, name="job-worker", daemon=True).start()
+    return worker
+
+
+def run_worker(store_path, lease_seconds, poll_interval, once, model_name, embedding_batch_size):
+    from embedding_service import get_embedding_service
+
+    get_embedding_service(model_name, embedding_batch_size).start()
+    Worker(JobStore(store_path, lease_seconds), poll_interval=poll_interval).run(once)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run analysis jobs from the job store.")
+    parser.add_argument("--store", default=None, help="Job database (default: $JOB_STORE_PATH or V3_Frontend/temp/jobs.sqlite3)")
+    parser.add_argument("--processes", "-p", type=int, default=1, help="Worker processes on this host (default: 1)")
+    parser.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS,
+                        help=f"Lease of a claimed job without heartbeat (default: {DEFAULT_LEASE_SECONDS})")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"Seconds between polls of an empty queue (default: {DEFAULT_POLL_INTERVAL})")
+    parser.add_argument("--once", action="store_true", help="Exit once the queue is empty")
+    parser.add_argument("--model-name", "-m", default="lucagafner/NDA_finetuned_V1",
+                        help="Embedding model each process preloads (default: 'lucagafner/NDA_finetuned_V1')")
+    parser.add_argument("--embedding-batch-size", type=int, default=64,
+                        help="Maximum batch size of the shared embedding model (default: 64)")
+    args = parser.parse_args()
+
+    worker_args = (args.store, args.lease_seconds, args.poll_interval, args.once, args.model_name,
+                   args.embedding_batch_size)
+    if args.processes == 1:
+        run_worker(*worker_args)
+    else:
+        # spawn: like batch_analyze.py, the workers start from a clean interpreter
+        context = multiprocessing.get_context("spawn")
+        processes = [context.Process(target=run_worker, args=worker_args) for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
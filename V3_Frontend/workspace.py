@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+workspace.py
+One directory per pipeline run.
+
+Every run gets a run ID and writes its document copy, result JSON files, PDF and
+batch files into <workspace root>/<run ID>/ instead of fixed paths under
+V3_Frontend/temp, so concurrent runs can't overwrite each other's results. The
+content-addressed caches (embeddings, indexes, documents, LLM answers) stay shared.
+
+Workspaces older than the retention period are removed at the start of a run, or
+with this script:
+python3 V3_Frontend/workspace.py --max-age-hours 72 --keep 20
+"""
+
+import argparse
+import json
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+DEFAULT_WORKSPACE_ROOT = Path(__file__).resolve().parent / "temp" / "runs"
+DEFAULT_RETENTION_HOURS = 72.0
+METADATA_FILE = "workspace.json"
+
+
+def new_run_id():
+    """Sortable, unique run ID: creation time plus a random suffix."""
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+
+
+class Workspace:
+    def __init__(self, path, run_id=None):
+        """
+        Parameters:
+        - path (str | Path): The run's directory.
+        - run_id (str): Defaults to the directory name.
+        """
+        self.path = Path(path)
+        self.run_id = run_id or self.path.name
+
+    def create(self, **metadata):
+        """Creates the directory (if needed) and records the run's metadata."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        if not (self.path / METADATA_FILE).exists():
+            self.update(run_id=self.run_id, created_at=time.time(), status="created", **metadata)
+        return self
+
+    def metadata(self):
+        try:
+            with open(self.path / METADATA_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def update(self, **metadata):
+        data = self.metadata()
+        data.update(metadata, updated_at=time.time())
+        temp_path = self.path / f".{METADATA_FILE}.{uuid.uuid4().hex}"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        temp_path.replace(self.path / METADATA_FILE)
+
+    def file(self, name):
+        return self.path / name
+
+    def write_json(self, name, data):
+        path = self.file(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+        return path
+
+    def last_activity(self):
+        """Last metadata update, or the directory's modification time for workspaces without metadata."""
+        updated_at = self.metadata().get("updated_at")
+        if updated_at is not None:
+            return updated_at
+        try:
+            return self.path.stat().st_mtime
+        except OSError:
+            return time.time()
+
+    def remove(self):
+        # Another process may be cleaning up the same workspace
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def create_workspace(root=DEFAULT_WORKSPACE_ROOT, run_id=None, **metadata):
+    """Creates (or reopens) the workspace of run_id under root; a new run ID is generated if None."""
+    run_id = run_id or new_run_id()
+    return Workspace(Path(root) / run_id, run_id).create(**metadata)
+
+
+def list_workspaces(root=DEFAULT_WORKSPACE_ROOT):
+    """The workspaces under root; directories without a METADATA_FILE were not created here and are skipped."""
+    root = Path(root)
+    if not root.is_dir():
+        return []
+    return [Workspace(path) for path in sorted(root.iterdir())
+            if path.is_dir() and (path / METADATA_FILE).is_file()]
+
+
+def cleanup_workspaces(root=DEFAULT_WORKSPACE_ROOT, max_age_hours=DEFAULT_RETENTION_HOURS, keep=None, exclude=(),
+                       dry_run=False):
+    """
+    Removes workspaces without activity for max_age_hours, and beyond the keep most recent ones.
+    Only directories with a METADATA_FILE count as workspaces; anything else under root is left alone.
+
+    Parameters:
+    - root (str | Path): Directory holding the workspaces.
+    - max_age_hours (float): Retention period, None or 0 to keep workspaces regardless of age.
+    - keep (int): Keep at most this many workspaces (most recent activity first), None for no limit.
+    - exclude (iterable[str]): Run IDs that are never removed, e.g. the current run.
+    - dry_run (bool): Only report what would be removed.
+
+    Returns:
+    - List of the removed (or, with dry_run, removable) Workspace objects.
+    """
+    now = time.time()
+    workspaces = sorted(list_workspaces(root), key=lambda workspace: workspace.last_activity(), reverse=True)
+    removed = []
+    for position, workspace in enumerate(workspaces):
+        if workspace.run_id in exclude:
+            continue
+        expired = bool(max_age_hours) and now - workspace.last_activity() > max_age_hours * 3600
+        if expired or (keep is not None and position >= keep):
+            removed.append(workspace)
+            if not dry_run:
+                workspace.remove()
+    return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Remove old run workspaces.")
+    parser.add_argument("--root", default=str(DEFAULT_WORKSPACE_ROOT), help="Workspace root directory")
+    parser.add_argument("--max-age-hours", type=float, default=DEFAULT_RETENTION_HOURS,
+                        help=f"Remove workspaces idle for longer than this (default: {DEFAULT_RETENTION_HOURS})")
+    parser.add_argument("--keep", type=int, default=None, help="Keep at most this many workspaces")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the workspaces that would be removed")
+    args = parser.parse_args()
+
+    removed = cleanup_workspaces(args.root, args.max_age_hours, args.keep, dry_run=args.dry_run)
+    for workspace in removed:
+        print(f"{'Would remove' if args.dry_run else 'Removed'} {workspace.path}")
+    print(f"{len(removed)} workspaces {'to remove' if args.dry_run else 'removed'}.")
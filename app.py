@@ -6,23 +6,215 @@ import numpy as np
 # import altair as alt
 import os
 import sys
-import tempfile
-import subprocess
-import shutil
+import importlib
 import json
-from difflib import SequenceMatcher
 from pathlib import Path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'V3_Frontend')))
+import run_pipeline
+from highlighting import highlight_html
+from job_store import DONE, FAILED, QUEUED, JobStore
+from prompt_registry import get_prompt_registry
+from token_budget import plan_run
+from worker import start_in_process_worker
+from workspace import create_workspace
+pdf_step = importlib.import_module("4_PDF Generator")
 #import src.models.V3_Frontend.run_pipeline
 #from src.models.V3_Frontend.run_pipeline import main
-# --------------  file processing --------------
-from tempfile import NamedTemporaryFile
 
 
 
 # --------------  main page --------------
 st.set_page_config(page_title="Doc Analyzer", layout="wide")
 
+
+@st.cache_resource
+def load_job_store():
+    """The job store the analyses are submitted to; worker.py processes and the app's own worker run them."""
+    return JobStore()
+
+
+job_store = load_job_store()
+
+
+@st.cache_resource
+def load_local_worker():
+    """
+    Worker thread inside the app process. Runs the jobs submitted with a key from the sidebar
+    (the key is handed over in memory, never stored) and keeps the queue moving when no
+    worker.py process is alive.
+    """
+    return start_in_process_worker(job_store)
+
+
+local_worker = load_local_worker()
+
+
+@st.cache_data(show_spinner=False)
+def preflight_estimate(doc_path, openai_model):
+    """Token and cost estimate of a run, computed without calling OpenAI."""
+    args = run_pipeline.parse_args([
+        "-s", "UserDocument.docx", "-d", doc_path, "-a", openai_model, "-b", openai_model, "-c", openai_model,
+    ])
+    try:
+        prompts = get_prompt_registry().preload()
+    except Exception:
+        prompts = None
+    return plan_run(run_pipeline.build_config(args), prompts)
+
+
+STEP_LABELS = {
+    "step1": "Step 1 – Identify missing clauses",
+    "step2": "Step 2 – Identify deviating clauses",
+    "step3": "Step 3 – Identify additional clauses",
+}
+
+
+POLL_INTERVAL_SECONDS = 1.0
+
+
+def render_step(step_slots, event):
+    slot = step_slots.get(event["step"])
+    if slot is None:
+        return
+    label = STEP_LABELS[event["step"]]
+    count = f" ({event['done']}/{event['total']})" if event["total"] else ""
+    if event["status"] == "done":
+        slot.success(f"✅ {label}{count}")
+    else:
+        slot.info(f"⚙️ {label} …{count}")
+
+
+def get_best_retrieved_clause(retrieved_clauses):
+    """Return the retrieved clause dict with the highest confidence."""
+    return max(retrieved_clauses, key=lambda x: x["confidence"])
+
+
+def format_missing(e):
+    return f"**{e['clause_name']} – {e['clause_subname']}**\n\n{e['input_clause']}"
+
+
+def format_deviating(e):
+    best = get_best_retrieved_clause(e["retrieved_clauses"])
+    highlighted_modified = highlight_html(e["modified_clause"], best["clause"])
+    return (
+        f"**{e['clause_name']} – {e['clause_subname']}**\n\n"
+        f"*Input clause:*\n{e['input_clause']}\n\n"
+        f"*Retrieved clause:  (confidence {best['confidence']:.1%})*\n{best['clause']}\n\n"
+        f"<span style='background-color: yellow;'>*Modified clause:*</span>\n{highlighted_modified}"
+    )
+
+
+def format_additional(e):
+    return (
+        f"**{e['additional_clause_name']}**\n\n{e['additional_clause']}\n\n"
+        f"<span style='background-color: yellow;'>*Legal impact:*</span> {e['legal_impact']}"
+    )
+
+
+@st.cache_data(show_spinner=False, max_entries=20)
+def findings_pdf(job_id, _result):
+    """The findings PDF of a finished job, rendered in-process on first request."""
+    report = _result["report"]
+    return pdf_step.render_pdf(
+        _result["missing"], _result["deviating"], _result["additional"], _result["execution_details"],
+        report["sample_doc"], report["model_name"], report["missing_model"], report["deviating_model"],
+        report["additional_model"],
+    )
+
+
+def offer_pdf(job):
+    """Renders the PDF only once the user asks for it, then offers it for download."""
+    pdf_key = f"pdf_requested_{job['id']}"
+    if not st.session_state.get(pdf_key):
+        if st.button("📄 Create PDF report"):
+            st.session_state[pdf_key] = True
+        else:
+            return
+    with st.spinner("Creating the PDF report…"):
+        pdf = findings_pdf(job["id"], job["result"])
+    st.download_button("⬇️ Download PDF report", data=pdf, file_name=f"Findings Overview - {job['id']}.pdf",
+                       mime="application/pdf")
+
+
+def follow_job(job_id):
+    """Polls a job and renders every clause as soon as its worker reports it."""
+    status_slot = st.empty()
+    step_slots = {step: st.empty() for step in STEP_LABELS}
+    for step, label in STEP_LABELS.items():
+        step_slots[step].info(f"⏳ {label} – waiting …")
+
+    # Tabs are shown right away and filled as the clauses come in
+    tab1, tab2, tab3 = st.tabs([
+        "Additional Clauses",
+        "Deviating Clauses",
+        "Missing Clauses",
+    ])
+    with tab1:
+        st.write("### Additional Clauses")
+        additional_box = st.container()
+    with tab2:
+        st.write("### Deviating Clauses")
+        deviating_box = st.container()
+    with tab3:
+        st.write("### Missing Clauses")
+        missing_box = st.container()
+
+    last_event_id = 0
+    attempts = None
+    first_result_seconds = None
+    with st.spinner("Running AI Model in the background…"):
+        while True:
+            job = job_store.get(job_id)
+            if job is None:
+                status_slot.error("❌ The analysis job no longer exists.")
+                return
+            if attempts is not None and job["attempts"] != attempts:
+                # A worker died and the job was restarted; its earlier clauses are replaced
+                st.rerun()
+            if job["status"] == QUEUED and not job_store.live_workers():
+                status_slot.warning("⚠️ Queued – no worker has reported in recently. "
+                                    "Start one with `python3 V3_Frontend/worker.py`.")
+            elif job["status"] == QUEUED:
+                status_slot.info(f"⏳ Queued – {job_store.queue_position(job_id)} analyses ahead, "
+                                 f"waiting for a worker …")
+            elif job["status"] not in (DONE, FAILED):
+                attempts = job["attempts"]
+                status_slot.caption(f"Running on {job['worker_id']} (attempt {job['attempts']})")
+
+            for last_event_id, event in job_store.events(job_id, last_event_id):
+                if event["type"] == "step":
+                    render_step(step_slots, event)
+                    continue
+                if first_result_seconds is None:
+                    first_result_seconds = time.time() - job["created_at"]
+                if event["type"] == "missing":
+                    missing_box.markdown(f"- {format_missing(event['clause'])}", unsafe_allow_html=True)
+                elif event["type"] == "deviating":
+                    deviating_box.markdown(f"- {format_deviating(event['clause'])}", unsafe_allow_html=True)
+                elif event["type"] == "additional":
+                    for entry in event["entries"]:
+                        additional_box.markdown(f"- {format_additional(entry)}", unsafe_allow_html=True)
+
+            if job["status"] == DONE:
+                status_slot.success("✅ Pipeline finished successfully!")
+                if first_result_seconds is not None:
+                    st.caption(f"First result after {first_result_seconds:.1f} s, "
+                               f"all results after {job['finished_at'] - job['created_at']:.1f} s.")
+                break
+            if job["status"] == FAILED:
+                status_slot.error(f"❌ Pipeline error: {job['error']}")
+                break
+            time.sleep(POLL_INTERVAL_SECONDS)
+
+    if job["status"] == DONE and job["result"] and "report" in job["result"]:
+        offer_pdf(job)
+    if st.button("🔄 New analysis"):
+        del st.session_state["job_id"]
+        st.session_state.pop("upload", None)
+        st.rerun()
+
+
 st.title("Legal Document Analyzer")
 st.markdown("""
 Welcome to the Legal Document Analyzer. This tool helps users analyze legal documents—specifically NDAs—based on selected criteria.
@@ -41,7 +233,14 @@ with st.expander("How does it work?"):
 # --------------  sidebar controls --------------
 st.sidebar.header("Settings")
 
-openai_api_key = st.sidebar.text_input('Key')
+job_counts = job_store.counts()
+st.sidebar.caption(f"🗂️ Analyses: {job_counts.get('running', 0)} running, {job_counts.get(QUEUED, 0)} queued")
+if not set(job_store.live_workers()) - {local_worker.worker_id}:
+    st.sidebar.warning("⚠️ No worker process has reported in recently; analyses run one at a time inside "
+                       "this app. Start a worker with `python3 V3_Frontend/worker.py`.")
+
+openai_api_key = st.sidebar.text_input('Key', help="Optional: your own OpenAI API key. Without it, the "
+                                                    "analysis runs on a worker's OPENAI_API_KEY.")
 control_contractType = st.sidebar.selectbox(
     "Select Contract Type", ["NDA", "SPA (not implemented yet)", "SLA (not implemented yet)"],
     index=None,  #start empty
@@ -125,21 +324,32 @@ upload_placeholder = st.empty()
 
 uploaded_doc = upload_placeholder.file_uploader("🔄 Upload the NDA that you wish to be analyzed by the AI model. The file has to be either a docx or doc file.", type=["docx", "doc"])
 
-
-if uploaded_doc:
-    # Save to temp file
-    with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(uploaded_doc.name)[1]) as tmp:
-        tmp.write(uploaded_doc.read())
-        tmp_path = tmp.name
-    #st.markdown(f"**Saved to**: `{tmp_path}`")
-
-    # Copy into data/raw/
-    filename = os.path.basename(tmp_path)
-    raw_dir = os.path.join(os.getcwd(), "data", "raw")
-    os.makedirs(raw_dir, exist_ok=True)
-    dest = os.path.join(raw_dir, filename)
-    shutil.copy(tmp_path, dest)
-    #st.markdown(f"**Copied to**: `{dest}`")
+active_job = st.session_state.get("job_id")
+
+if uploaded_doc and not active_job:
+    # Save into the run's workspace once per upload; its run ID becomes the job ID
+    upload_key = (uploaded_doc.name, uploaded_doc.size)
+    upload = st.session_state.get("upload")
+    if upload is None or upload["key"] != upload_key:
+        workspace = create_workspace(source="app", filename=uploaded_doc.name)
+        doc_file = workspace.file("UserDocument" + os.path.splitext(uploaded_doc.name)[1])
+        doc_file.write_bytes(uploaded_doc.getvalue())
+        upload = {"key": upload_key, "run_id": workspace.run_id, "path": str(doc_file)}
+        st.session_state["upload"] = upload
+    dest = upload["path"]
+
+    estimate_placeholder = st.empty()
+    try:
+        estimate = preflight_estimate(dest, openai_model)
+        with estimate_placeholder.container():
+            st.markdown(f"**Estimated usage:** ~{estimate['total_input_tokens']:,} input tokens, "
+                        f"~{estimate['total_output_tokens']:,} output tokens, "
+                        f"≈ ${estimate['total_cost']:.2f} (upper bound: assumes every clause reaches step 2)")
+            st.dataframe(pd.DataFrame(estimate["stages"]), hide_index=True)
+            for warning in estimate["warnings"]:
+                st.caption(f"⚠️ {warning}")
+    except Exception as e:
+        estimate_placeholder.warning(f"Could not estimate tokens and cost: {e}")
 
     buttons_placeholder = st.empty()
     pipeline_steps = st.empty()
@@ -152,165 +362,30 @@ if uploaded_doc:
 
 
     if run_sub:
-        if not openai_api_key:
-            st.error("❌ Please enter your OpenAI API key in the sidebar.")
-            st.stop()
-
         if not control_contractType:
             st.error("❌ Please select a contract type in the sidebar.")
             st.stop()
 
-        upload_placeholder.empty()
-        buttons_placeholder.empty()
-
-        step1_slot, step2_slot, step3_slot = st.empty(), st.empty(), st.empty()
-
-        step1_slot.info("⚙️ Step 1 – Identify missing clauses …")
-        time.sleep(0.5)
-
-        step2_slot.info("⚙️ Step 2 – Identify deviating clauses …")
-        time.sleep(0.5)
-
-        step3_slot.info("⚙️ Step 3 – Identify additional clauses …")
-        time.sleep(1.5)
-
-        with st.spinner("Running AI Model in the background…"):
-            try:
-                if run_sub:
-                    cmd = [
-                        sys.executable,  # ensures same Python interpreter
-                        "V3_Frontend/run_pipeline.py",  # your script
-                        "-s", "UserDocument.docx",  # -s "Sample 2.docx"
-                        "-d", dest,  # -s "Sample 2.docx"
-                        "-a", openai_model,  # -a "gpt-4.1-2025-04-14"
-                        "-b", openai_model,  # -b "gpt-4.1-2025-04-14"
-                        "-c", openai_model,  # -c "gpt-4.1-2025-04-14"
-                        "-K", openai_api_key,
-                    ]
-                    env = os.environ.copy()
-                    env["PYTHONPATH"] = os.pathsep.join(sys.path)
-
-                    result = subprocess.run(cmd, capture_output=True, text=True, env=env)
-
-                    if result.returncode != 0:
-                        st.error("❌ Pipeline failed!")
-                        st.write("**Error Output:**")
-                        st.code(result.stderr if result.stderr else "No error message provided.")
-                        # Optionally also show stdout for debugging
-                        if result.stdout:
-                            st.write("**Standard Output:**")
-                            st.code(result.stdout)
-                        st.stop()  # Stop further execution
-
-                    output = result.stdout
-
-                st.success("✅ Pipeline finished successfully!")
-                BASE = Path("V3_Frontend")
-                with open(BASE / "temp/3_V3_additional_clauses.json", encoding="utf‑8") as f:
-                    additional_raw = json.load(f)["entries"]
-
-                step1_slot.success("✅ Step 1 – Identify missing clauses: ")
-                step2_slot.success("✅ Step 2 – Identify deviating clauses")
-                step3_slot.success("✅ Step 3 – Identify additional clauses:")
-
-                additional = [
-                    f"**{e['additional_clause_name']}**\n\n{e['additional_clause']}\n\n"
-                    f"<span style='background-color: yellow;'>*Legal impact:*</span> {e['legal_impact']}"
-                    for e in additional_raw
-                ]
-
-
-                # MISSING CLAUSES
-                MISSING_FILE = BASE / "temp/UserDocument-missing_filtered.json"
-                with open(MISSING_FILE, encoding="utf-8") as f:
-                    missing_raw = json.load(f)
-
-                missing = [
-                    f"**{e['clause_name']} – {e['clause_subname']}**\n\n{e['input_clause']}"
-                    for e in missing_raw
-                ]
-
-                # DEVIATING CLAUSES
-                DEV_FILE = BASE / f"V3-deviating-{openai_model}-UserDocument.json"
-                with open(DEV_FILE, encoding="utf-8") as f:
-                    dev_raw = json.load(f)
-
-
-                def get_best_retrieved_clause(retrieved_clauses):
-                    """Return the retrieved clause dict with the highest confidence."""
-                    return max(retrieved_clauses, key=lambda x: x["confidence"])
-
-                def mark_overlapping_text(modified, retrieved):
-                    import re
-                    from difflib import SequenceMatcher
-
-                    # Tokenize the texts preserving whitespace
-                    mod_tokens = re.findall(r'\S+\s*', modified)
-                    ret_tokens = re.findall(r'\S+\s*', retrieved)
-
-                    # Create a SequenceMatcher on token lists
-                    s = SequenceMatcher(None, mod_tokens, ret_tokens)
-                    marked_text = ""
-                    for tag, i1, i2, j1, j2 in s.get_opcodes():
-                        for token in mod_tokens[i1:i2]:
-                            # For equal tokens, display as is.
-                            if tag == 'equal':
-                                marked_text += token
-                            else:
-                                # Check if this token (ignoring case and extra whitespace)
-                                # exists anywhere in the corresponding retrieved tokens.
-                                ret_segment = "".join(ret_tokens[j1:j2]).lower()
-                                if token.strip().lower() and token.strip().lower() in ret_segment:
-                                    marked_text += token
-                                else:
-                                    marked_text += f"<font color='red'>{token}</font>"
-                    return marked_text
-
-                deviating = []
-                for e in dev_raw:
-                    best = get_best_retrieved_clause(e["retrieved_clauses"])
-                    highlighted_modified = mark_overlapping_text(e["modified_clause"], best["clause"])
-                    deviating.append(
-                        f"**{e['clause_name']} – {e['clause_subname']}**\n\n"
-                        f"*Input clause:*\n{e['input_clause']}\n\n"
-                        f"*Retrieved clause:  (confidence {best['confidence']:.1%})*\n{best['clause']}\n\n"
-                        f"<span style='background-color: yellow;'>*Modified clause:*</span>\n{highlighted_modified}"
-                    )
-
-                # 2) erst jetzt die Tabs anzeigen
-                tab1, tab2, tab3 = st.tabs([
-                    "Additional Clauses",
-                    "Deviating Clauses",
-                    "Missing Clauses",
-                ])
-
-                with tab1:
-                    st.write("### Additional Clauses")
-                    for clause in additional:  # List
-                        st.markdown(f"- {clause}", unsafe_allow_html=True)
-
-                with tab2:
-                    st.write("### Deviating Clauses")
-                    for clause in deviating:
-                        st.markdown(f"- {clause}", unsafe_allow_html=True)
-
-                with tab3:
-                    st.write("### Missing Clauses")
-                    for clause in missing:
-                        st.markdown(f"- {clause}", unsafe_allow_html=True)
-
-                #st.code(output)
-            except Exception as e:
-                st.error(f"❌ Pipeline error: {e}")
-                if hasattr(e, 'stdout'):
-                    st.subheader("Stdout")
-                    st.code(e.stdout or "— no stdout —")
-                if hasattr(e, 'stderr'):
-                    st.subheader("Stderr")
-                    st.code(e.stderr or "— no stderr —")
-
-
-
-
-
+        # Any worker runs the job with its own OPENAI_API_KEY. A key from the sidebar pins the job to this
+        # app's worker, which gets the key in memory; this session only polls the job from here on
+        affinity = None
+        if openai_api_key:
+            local_worker.openai_keys[upload["run_id"]] = openai_api_key
+            affinity = local_worker.worker_id
+        st.session_state["job_id"] = job_store.submit(
+            Path(dest).read_bytes(),
+            os.path.basename(dest),
+            [
+                "-a", openai_model,  # -a "gpt-4.1-2025-04-14"
+                "-b", openai_model,  # -b "gpt-4.1-2025-04-14"
+                "-c", openai_model,  # -c "gpt-4.1-2025-04-14"
+            ],
+            sample_doc="UserDocument.docx",
+            job_id=upload["run_id"],
+            affinity=affinity,
+        )
+        st.rerun()
 
+if active_job:
+    upload_placeholder.empty()
+    follow_job(active_job)
@@ -0,0 +1,39 @@
+import importlib
+import os
+import sys
+
+import pytest
+
+# 3_V3_AdditionalClauses imports the OpenAI and Opik clients and the document IR at module level
+for module in ("numpy", "faiss", "openai", "dotenv", "opik", "streamlit", "docx", "tiktoken"):
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+import numpy as np
+
+from config import DEFAULT_CANDIDATE_THRESHOLD
+
+additional_step = importlib.import_module("3_V3_AdditionalClauses")
+
+PARAGRAPHS = ["Term clause.", "Non-compete clause.", "Governing law clause."]
+
+
+@pytest.mark.parametrize("similarity, threshold, candidates", [
+    # One row per paragraph, one column per template clause; candidates reach the threshold in no column
+    ([[0.9, 0.1], [0.2, 0.3], [0.1, 0.8]], 0.5, ["Non-compete clause."]),
+    ([[0.9, 0.1], [0.2, 0.3], [0.1, 0.8]], 0.85, ["Non-compete clause.", "Governing law clause."]),
+    # The threshold itself counts as a match
+    ([[0.5, 0.1], [0.49, 0.3], [0.1, 0.5]], 0.5, ["Non-compete clause."]),
+    ([[0.9, 0.1], [0.2, 0.3], [0.1, 0.8]], 0.0, []),
+    ([[0.9, 0.1], [0.2, 0.3], [0.1, 0.8]], 1.0, PARAGRAPHS),
+])
+def test_select_candidates(similarity, threshold, candidates):
+    selected, report = additional_step.select_candidates(PARAGRAPHS, np.array(similarity), threshold)
+    assert selected == candidates
+    assert report == {"threshold": threshold, "paragraphs": 3, "candidates": len(candidates)}
+
+
+def test_select_candidates_defaults():
+    selected, report = additional_step.select_candidates([], np.zeros((0, 2)))
+    assert selected == [] and report["threshold"] == DEFAULT_CANDIDATE_THRESHOLD
@@ -0,0 +1,79 @@
+import os
+import sys
+
+import pytest
+
+openai = pytest.importorskip("openai")
+# batch_jobs.py retries with resilience.py, whose metrics import needs tiktoken
+pytest.importorskip("tiktoken")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from batch_jobs import BatchError, BatchRunner
+from fake_openai_server import start_fake_server
+from llm_cache import LLMCache, request_key
+
+
+def request(words):
+    return {"model": "fake-model", "messages": [{"role": "user", "content": " ".join(["w"] * words)}], "seed": 42}
+
+
+@pytest.fixture
+def fake_server():
+    server, base_url = start_fake_server()
+    yield server, base_url
+    server.shutdown()
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMCache(tmp_path / "cache.sqlite3")
+    yield cache
+    cache.close()
+
+
+def runner(base_url, tmp_path, cache):
+    client = openai.OpenAI(base_url=base_url, api_key="fake", max_retries=0)
+    return BatchRunner(client, tmp_path / "batches", poll_interval=0.05, timeout=10, cache=cache)
+
+
+def test_results_are_mapped_by_custom_id(fake_server, tmp_path, cache):
+    _, base_url = fake_server
+    batch_runner = runner(base_url, tmp_path, cache)
+    requests = {f"step1-{words:04d}": request(words) for words in (3, 1, 2)}
+
+    results = batch_runner.run(requests, "step1")
+    assert {custom_id: result[1] for custom_id, result in results.items()} == \
+        {"step1-0003": 3, "step1-0001": 1, "step1-0002": 2}
+    assert all(content == "entailment" for content, _, _, _ in results.values())
+    assert batch_runner.stats == {"batches": 1, "submitted": 3, "cache_hits": 0, "failed": 0}
+    assert (tmp_path / "batches" / "step1-input.jsonl").exists()
+
+
+def test_cache_hits_are_not_submitted(fake_server, tmp_path, cache):
+    server, base_url = fake_server
+    cache.put(request_key(request(1)), "fake-model", "missing", {"prompt_tokens": 1, "completion_tokens": 1,
+                                                                 "total_tokens": 2})
+    batch_runner = runner(base_url, tmp_path, cache)
+
+    results = batch_runner.run({"step1-0001": request(1), "step1-0002": request(2)}, "step1")
+    assert results["step1-0001"] == ("missing", 0, 0, 0)
+    assert results["step1-0002"][0] == "entailment"
+    assert batch_runner.stats["cache_hits"] == 1 and batch_runner.stats["submitted"] == 1
+    # The second run is answered from the cache alone, without a batch
+    assert batch_runner.run({"step1-0002": request(2)}, "again")["step1-0002"] == ("entailment", 0, 0, 0)
+    assert batch_runner.stats["batches"] == 1 and len(server.batches) == 1
+
+
+@pytest.mark.parametrize("fault", ["failing_ids", "dropped_ids"])
+def test_failed_or_missing_requests_raise_and_nothing_is_cached(fake_server, tmp_path, cache, fault):
+    server, base_url = fake_server
+    getattr(server, fault).add("step1-0002")
+    batch_runner = runner(base_url, tmp_path, cache)
+    requests = {f"step1-{words:04d}": request(words) for words in (1, 2, 3)}
+
+    with pytest.raises(BatchError, match="step1-0002"):
+        batch_runner.run(requests, "step1")
+    assert batch_runner.stats["failed"] == 1
+    # The results of the other requests aren't cached either; the run is repeated as a whole
+    assert all(cache.get(request_key(body), "fake-model") is None for body in requests.values())
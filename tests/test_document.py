@@ -0,0 +1,88 @@
+import os
+import sys
+
+import pytest
+
+docx = pytest.importorskip("docx")
+# The extractor step 3 used before the document IR
+docx2txt = pytest.importorskip("docx2txt")
+# document.py hashes files with embedding_cache, which imports both
+pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from document import DocumentIR, parse_docx
+
+TEXTBOX_XML = (
+    '<w:r xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+    'xmlns:mc="http://schemas.openxmlformats.org/markup-compatibility/2006" '
+    'xmlns:wps="http://schemas.microsoft.com/office/word/2010/wordprocessingShape" '
+    'xmlns:v="urn:schemas-microsoft-com:vml">'
+    '<mc:AlternateContent><mc:Choice Requires="wps"><w:drawing><wps:txbx><w:txbxContent>'
+    '<w:p><w:r><w:t>Boxed note: governed by Swiss law.</w:t></w:r></w:p>'
+    '</w:txbxContent></wps:txbx></w:drawing></mc:Choice>'
+    '<mc:Fallback><w:pict><v:textbox><w:txbxContent>'
+    '<w:p><w:r><w:t>Boxed note: governed by Swiss law.</w:t></w:r></w:p>'
+    '</w:txbxContent></v:textbox></w:pict></mc:Fallback></mc:AlternateContent></w:r>'
+)
+
+
+@pytest.fixture
+def sample_docx(tmp_path):
+    from docx.oxml import parse_xml
+
+    document = docx.Document()
+    document.sections[0].header.paragraphs[0].text = "CONFIDENTIAL - Mutual NDA"
+    document.sections[0].footer.paragraphs[0].text = "Page footer: Acme Ltd."
+    document.add_paragraph("1. Definitions")
+    document.add_paragraph("Confidential Information means all information disclosed by either party.")
+    table = document.add_table(rows=3, cols=3)
+    table.cell(0, 0).merge(table.cell(0, 2)).text = "Term of the agreement: two years."
+    table.cell(1, 0).merge(table.cell(2, 0)).text = "Signatures"
+    table.cell(1, 1).text = "Party A"
+    table.cell(1, 2).text = "Party B"
+    table.cell(2, 1).text = "Witness A"
+    table.cell(2, 2).text = "Witness B"
+    paragraph = document.add_paragraph("2. Governing law")
+    paragraph._p.append(parse_xml(TEXTBOX_XML))
+    document.add_paragraph("The receiving party shall not disclose the information.")
+    path = tmp_path / "sample.docx"
+    document.save(path)
+    return path
+
+
+def _lines(text):
+    return [line.strip() for line in text.splitlines() if line.strip()]
+
+
+def test_same_text_as_docx2txt(sample_docx):
+    ir_lines = _lines(parse_docx(str(sample_docx)).full_text)
+    docx2txt_lines = _lines(docx2txt.process(str(sample_docx)))
+    # docx2txt reads the text box twice (DrawingML and VML fallback); otherwise the text is the same
+    assert sorted(set(ir_lines)) == sorted(set(docx2txt_lines))
+    assert ir_lines[0] == "CONFIDENTIAL - Mutual NDA"
+    assert ir_lines[-1] == "Page footer: Acme Ltd."
+
+
+def test_merged_cells_and_text_boxes_are_read_once(sample_docx):
+    document = parse_docx(str(sample_docx))
+    texts = document.texts()
+    assert texts.count("Term of the agreement: two years.") == 1
+    assert texts.count("Signatures") == 1
+    assert texts.count("Boxed note: governed by Swiss law.") == 1
+    sources = {paragraph.text: paragraph.source for paragraph in document.paragraphs}
+    assert sources["CONFIDENTIAL - Mutual NDA"] == "header"
+    assert sources["Page footer: Acme Ltd."] == "footer"
+    assert sources["Party B"] == "table"
+    assert sources["Boxed note: governed by Swiss law."] == "textbox"
+    # The text box follows the paragraph it is anchored in
+    assert texts.index("Boxed note: governed by Swiss law.") == texts.index("2. Governing law") + 1
+
+
+def test_offsets_and_cache_round_trip(sample_docx):
+    document = parse_docx(str(sample_docx))
+    for paragraph in document.paragraphs:
+        assert document.full_text[paragraph.start:paragraph.end] == paragraph.text
+    restored = DocumentIR.from_bytes(document.to_bytes())
+    assert restored.full_text == document.full_text
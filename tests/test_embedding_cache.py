@@ -0,0 +1,82 @@
+import json
+import os
+import sys
+
+import pytest
+
+np = pytest.importorskip("numpy")
+faiss = pytest.importorskip("faiss")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from embedding_cache import (document_cache_dir, file_sha256, load_document_index, normalize_rows,
+                             save_document_index, units_sha256)
+
+MODEL = "lucagafner/NDA_finetuned_V1"
+PARAGRAPHS = ["1. Definitions", "Confidential Information means all information.", "The term is two years."]
+
+
+@pytest.fixture
+def doc_path(tmp_path):
+    path = tmp_path / "contract.docx"
+    path.write_bytes(b"docx bytes")
+    return path
+
+
+def build_index(count, seed=0):
+    embeddings = normalize_rows(np.random.default_rng(seed).normal(size=(count, 8)))
+    index = faiss.IndexFlatIP(embeddings.shape[1])
+    index.add(embeddings)
+    return embeddings, index
+
+
+def test_round_trip(doc_path, tmp_path):
+    cache_dir = tmp_path / "index_cache"
+    assert load_document_index(doc_path, MODEL, cache_dir) is None
+
+    embeddings, index = build_index(len(PARAGRAPHS))
+    entry_dir = save_document_index(doc_path, MODEL, PARAGRAPHS, embeddings, index, cache_dir)
+    assert entry_dir == document_cache_dir(doc_path, MODEL, cache_dir)
+    assert [path.name for path in cache_dir.iterdir()] == [entry_dir.name]
+
+    loaded_index, paragraphs, loaded_embeddings = load_document_index(doc_path, MODEL, cache_dir)
+    assert paragraphs == PARAGRAPHS
+    np.testing.assert_allclose(loaded_embeddings, embeddings)
+    # The loaded index answers like the one that was saved
+    scores, ids = loaded_index.search(embeddings[1:2], 1)
+    assert loaded_index.ntotal == 3 and ids[0][0] == 1 and scores[0][0] == pytest.approx(1.0)
+
+
+def test_an_inconsistent_entry_is_rebuilt(doc_path, tmp_path):
+    cache_dir = tmp_path / "index_cache"
+    embeddings, index = build_index(len(PARAGRAPHS))
+    entry_dir = save_document_index(doc_path, MODEL, PARAGRAPHS, embeddings, index, cache_dir)
+    (entry_dir / "paragraphs.json").write_text(json.dumps(PARAGRAPHS + ["An extra paragraph."]), encoding="utf-8")
+    assert load_document_index(doc_path, MODEL, cache_dir) is None
+
+    # Saving again replaces the broken entry
+    save_document_index(doc_path, MODEL, PARAGRAPHS, embeddings, index, cache_dir)
+    assert load_document_index(doc_path, MODEL, cache_dir)[1] == PARAGRAPHS
+
+
+def test_entries_are_keyed_by_content_model_and_units(doc_path, tmp_path):
+    cache_dir = tmp_path / "index_cache"
+    embeddings, index = build_index(len(PARAGRAPHS))
+    save_document_index(doc_path, MODEL, PARAGRAPHS, embeddings, index, cache_dir)
+    assert load_document_index(doc_path, "another/model", cache_dir) is None
+
+    # An index over clause units is stored next to the paragraph index of the same file
+    units = ["1. Definitions\nConfidential Information means all information.", "The term is two years."]
+    units_hash = units_sha256(units)
+    assert units_hash != file_sha256(doc_path)
+    assert units_sha256(list(units)) == units_hash and units_sha256(units[:1]) != units_hash
+    assert load_document_index(doc_path, MODEL, cache_dir, doc_hash=units_hash) is None
+    unit_embeddings, unit_index = build_index(len(units), seed=1)
+    save_document_index(doc_path, MODEL, units, unit_embeddings, unit_index, cache_dir, doc_hash=units_hash)
+
+    assert load_document_index(doc_path, MODEL, cache_dir)[1] == PARAGRAPHS
+    assert load_document_index(doc_path, MODEL, cache_dir, doc_hash=units_hash)[1] == units
+
+    # Another file content is another entry, whatever its path
+    doc_path.write_bytes(b"edited docx bytes")
+    assert load_document_index(doc_path, MODEL, cache_dir) is None
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from job_store import DONE, FAILED, QUEUED, RUNNING, JobStore
+
+LEASE_SECONDS = 0.2
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(tmp_path / "jobs.sqlite3", lease_seconds=LEASE_SECONDS)
+
+
+def submit(store, name="contract.docx", **kwargs):
+    return store.submit(b"docx bytes", name, ["-a", "gpt-4.1-2025-04-14"], **kwargs)
+
+
+def test_a_claimed_job_is_leased_to_its_worker(store):
+    first, second = submit(store, "first.docx"), submit(store, "second.docx")
+
+    job = store.claim("worker-a")
+    assert job["id"] == first and job["document"] == b"docx bytes" and job["attempts"] == 1
+    assert store.claim("worker-b")["id"] == second
+    assert store.claim("worker-c") is None
+
+    assert store.heartbeat(first, "worker-a")
+    assert not store.heartbeat(first, "worker-b")
+    assert not store.complete(first, "worker-b", {"missing": []})
+    assert store.complete(first, "worker-a", {"missing": []})
+    assert store.get(first)["status"] == DONE and store.get(first)["result"] == {"missing": []}
+    assert store.fail(second, "worker-b", "RuntimeError()")
+    assert store.get(second)["status"] == FAILED
+    assert store.counts() == {DONE: 1, FAILED: 1}
+
+
+def test_an_expired_lease_requeues_the_job_for_another_worker(store):
+    job_id = submit(store)
+    store.claim("worker-a")
+    store.add_event(job_id, {"type": "step", "step": "step1"})
+    time.sleep(LEASE_SECONDS * 1.5)
+
+    job = store.claim("worker-b")
+    assert job["id"] == job_id and job["worker_id"] == "worker-b" and job["attempts"] == 2
+    # The new attempt starts over, without the events of the dead worker
+    assert store.events(job_id) == []
+    # The old worker finds out at its next heartbeat and can't overwrite the result
+    assert not store.heartbeat(job_id, "worker-a")
+    assert not store.fail(job_id, "worker-a", "LeaseLost()")
+    assert store.get(job_id)["status"] == RUNNING
+
+
+def test_a_job_fails_after_max_attempts(store):
+    job_id = submit(store, max_attempts=2)
+    for worker_id in ("worker-a", "worker-b"):
+        assert store.claim(worker_id)["id"] == job_id
+        time.sleep(LEASE_SECONDS * 1.5)
+
+    assert store.requeue_expired() == 1
+    job = store.get(job_id)
+    assert job["status"] == FAILED and job["attempts"] == 2
+    assert "Lease expired 2 times, last worker worker-b" in job["error"]
+    assert store.claim("worker-c") is None
+
+
+def test_pinned_jobs_only_go_to_their_worker(store):
+    store.worker_seen("app-worker")
+    pinned = submit(store, "pinned.docx", affinity="app-worker")
+    unpinned = submit(store, "unpinned.docx")
+
+    assert store.claim("worker-a")["id"] == unpinned
+    assert store.claim("worker-a") is None
+    assert store.get(pinned)["status"] == QUEUED
+    assert store.claim("app-worker")["id"] == pinned
+
+
+def test_a_pinned_job_fails_once_its_worker_is_gone(store):
+    store.worker_seen("app-worker")
+    job_id = submit(store, affinity="app-worker")
+    assert store.live_workers() == ["app-worker"]
+    time.sleep(LEASE_SECONDS * 1.5)
+
+    assert store.live_workers() == []
+    store.requeue_expired()
+    job = store.get(job_id)
+    assert job["status"] == FAILED and job["error"] == "The worker this job was submitted to stopped"
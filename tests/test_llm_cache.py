@@ -0,0 +1,101 @@
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from llm_cache import CachedOpenAIClient, LLMCache, request_key
+
+USAGE = {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}
+REQUEST = {"model": "gpt-4.1", "messages": [{"role": "user", "content": "Is the clause entailed?"}], "seed": 42}
+
+
+class StubOpenAI:
+    """Answers every request with the given content and finish_reason, and counts the calls."""
+
+    def __init__(self, content="Entailed", finish_reason="stop"):
+        self.calls = 0
+        self.content = content
+        self.finish_reason = finish_reason
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(
+            choices=[SimpleNamespace(finish_reason=self.finish_reason, message=SimpleNamespace(content=self.content))],
+            usage=SimpleNamespace(**USAGE),
+        )
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = LLMCache(tmp_path / "cache.sqlite3")
+    yield cache
+    cache.close()
+
+
+@pytest.mark.parametrize("change", [
+    {"model": "gpt-4o"},
+    {"messages": [{"role": "user", "content": "Is the clause contradicted?"}]},
+    {"messages": [{"role": "system", "content": "Is the clause entailed?"}]},
+    {"seed": 7},
+    {"response_format": {"type": "json_object"}},
+    {"temperature": 0.2},
+    {"reasoning_effort": "high"},
+])
+def test_key_changes_with_what_determines_the_answer(change):
+    assert request_key({**REQUEST, **change}) != request_key(REQUEST)
+
+
+def test_key_ignores_unset_parameters_and_field_order():
+    reordered = dict(reversed(list(REQUEST.items())))
+    assert request_key(reordered) == request_key(REQUEST)
+    assert request_key({**REQUEST, "temperature": None}) == request_key(REQUEST)
+
+
+def test_entries_expire_after_the_model_ttl(tmp_path):
+    cache = LLMCache(tmp_path / "cache.sqlite3", ttl_seconds={"short-lived": 0.05, "default": None})
+    try:
+        cache.put("a", "short-lived", "answer a", USAGE)
+        cache.put("b", "kept", "answer b", USAGE)
+        assert cache.get("a", "short-lived") == ("answer a", USAGE)
+        time.sleep(0.1)
+        assert cache.get("a", "short-lived") is None
+        assert cache.get("b", "kept") == ("answer b", USAGE)
+    finally:
+        cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_first(tmp_path):
+    # Each entry is len(key) + len(model) + len(content) = 1 + 1 + 8 bytes; three fit
+    cache = LLMCache(tmp_path / "cache.sqlite3", max_size_bytes=30)
+    try:
+        for key in "abc":
+            cache.put(key, "m", f"answer {key}", USAGE)
+            time.sleep(0.01)
+        cache.get("a", "m")
+        cache.put("d", "m", "answer d", USAGE)
+        assert cache.get("b", "m") is None
+        assert [cache.get(key, "m")[0] for key in "acd"] == ["answer a", "answer c", "answer d"]
+    finally:
+        cache.close()
+
+
+def test_only_complete_answers_are_cached(cache):
+    truncated = StubOpenAI(finish_reason="length")
+    client = CachedOpenAIClient(truncated, cache)
+    client.chat.completions.create(**REQUEST)
+    client.chat.completions.create(**REQUEST)
+    assert truncated.calls == 2 and client.stats["cache_hits"] == 0
+
+    complete = StubOpenAI()
+    client = CachedOpenAIClient(complete, cache)
+    client.chat.completions.create(**REQUEST)
+    response = client.chat.completions.create(**REQUEST)
+    assert complete.calls == 1 and client.stats["cache_hits"] == 1
+    assert response.choices[0].message.content == "Entailed"
+    # A hit is not billed again; its original usage is kept aside
+    assert response.usage.total_tokens == 0 and response.cached_usage == USAGE
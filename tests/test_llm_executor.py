@@ -0,0 +1,103 @@
+import json
+import os
+import sys
+import threading
+import time
+import urllib.request
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from fake_openai_server import start_fake_server
+from llm_executor import run_concurrently, sum_token_usage
+
+LATENCY = 0.2
+
+
+@pytest.fixture
+def fake_server():
+    server, base_url = start_fake_server(latency=LATENCY)
+    yield server, base_url
+    server.shutdown()
+
+
+class InFlight:
+    """Counts the calls running at the same time."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.running = 0
+        self.peak = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.running += 1
+            self.peak = max(self.peak, self.running)
+
+    def __exit__(self, *exc):
+        with self.lock:
+            self.running -= 1
+
+
+def chat(base_url, words):
+    """One chat completion whose prompt has `words` words, i.e. `words` prompt tokens."""
+    body = json.dumps({"model": "fake-model", "messages": [{"role": "user", "content": " ".join(["w"] * words)}]})
+    request = urllib.request.Request(f"{base_url}/chat/completions", data=body.encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        completion = json.load(response)
+    usage = completion["usage"]
+    return (completion["choices"][0]["message"]["content"], usage["prompt_tokens"], usage["completion_tokens"],
+            usage["total_tokens"])
+
+
+def test_results_keep_the_input_order(fake_server):
+    _, base_url = fake_server
+    responses = run_concurrently(lambda words: chat(base_url, words), range(1, 13), max_concurrency=4)
+    assert [prompt_tokens for _, prompt_tokens, _, _ in responses] == list(range(1, 13))
+    assert sum_token_usage(responses)["input_tokens"] == sum(range(1, 13))
+
+
+def test_concurrency_is_bounded(fake_server):
+    _, base_url = fake_server
+    in_flight = InFlight()
+
+    def call(words):
+        with in_flight:
+            return chat(base_url, words)
+
+    start_time = time.perf_counter()
+    run_concurrently(call, range(1, 13), max_concurrency=4)
+    elapsed = time.perf_counter() - start_time
+
+    assert in_flight.peak == 4
+    # Three waves of four calls, instead of twelve sequential ones
+    assert 3 * LATENCY <= elapsed < 12 * LATENCY
+
+
+def test_first_failure_cancels_the_pending_calls(fake_server):
+    server, base_url = fake_server
+
+    def call(words):
+        if words == 1:
+            raise RuntimeError("clause 1 failed")
+        return chat(base_url, words)
+
+    with pytest.raises(RuntimeError, match="clause 1 failed"):
+        run_concurrently(call, range(1, 21), max_concurrency=2)
+    # Only the calls running around the failure reached the endpoint: the other worker's call
+    # and, at most, the next one the failed call's worker picked up before the cancellation
+    assert server.faults["requests"] <= 3
+
+
+def test_sequential_when_concurrency_is_one(fake_server):
+    _, base_url = fake_server
+    in_flight = InFlight()
+
+    def call(words):
+        with in_flight:
+            return chat(base_url, words)
+
+    assert len(run_concurrently(call, range(1, 4), max_concurrency=1)) == 3
+    assert in_flight.peak == 1
@@ -0,0 +1,103 @@
+import importlib
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# metrics.py prices the calls with token_budget, which needs tiktoken
+pytest.importorskip("tiktoken")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from config import MODEL_PRICING
+from llm_cache import CachedOpenAIClient, LLMCache
+from metrics import BATCH_PRICE_FACTOR, MeteredOpenAIClient, MetricsRecorder, aggregate, to_prometheus
+
+STEP1_MODEL = "gpt-4.1-2025-04-14"
+STEP3_MODEL = "o3-2025-04-16"
+
+
+class StubOpenAI:
+    """Answers every request with 100 prompt and 10 completion tokens."""
+
+    def __init__(self):
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        return SimpleNamespace(
+            choices=[SimpleNamespace(finish_reason="stop", message=SimpleNamespace(content="entailment"))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=10, total_tokens=110),
+        )
+
+
+def price(model, input_tokens, output_tokens):
+    return input_tokens * MODEL_PRICING[model]["input"] + output_tokens * MODEL_PRICING[model]["output"]
+
+
+def test_each_step_is_priced_with_its_own_model():
+    recorder = MetricsRecorder()
+    recorder.record("step1", STEP1_MODEL, 0.1, input_tokens=1000, output_tokens=10)
+    recorder.record("step1", STEP1_MODEL, 0.1, input_tokens=500, output_tokens=5)
+    recorder.record("step3", STEP3_MODEL, 2.0, input_tokens=8000, output_tokens=2000)
+    recorder.record("step3", STEP3_MODEL, None, input_tokens=8000, output_tokens=2000, batch=True)
+
+    summary = recorder.aggregate()
+    assert summary["step1"]["cost"] == pytest.approx(price(STEP1_MODEL, 1500, 15))
+    assert summary["step3"]["cost"] == pytest.approx(price(STEP3_MODEL, 8000, 2000) * (1 + BATCH_PRICE_FACTOR))
+    assert summary["step3"]["models"] == [STEP3_MODEL]
+
+
+def test_unknown_price_is_none_not_zero():
+    recorder = MetricsRecorder()
+    recorder.record("step1", STEP1_MODEL, 0.1, input_tokens=1000, output_tokens=10)
+    recorder.record("step1", "unpriced-model", 0.1, input_tokens=1000, output_tokens=10)
+
+    assert recorder.aggregate()["step1"]["cost"] is None
+    assert recorder.aggregate(by="model")[STEP1_MODEL]["cost"] == pytest.approx(price(STEP1_MODEL, 1000, 10))
+    # Prometheus gets no cost sample for the unpriced model instead of a 0
+    prometheus = to_prometheus(recorder.records)
+    assert f'cost_dollars_total{{stage="step1",model="{STEP1_MODEL}"}}' in prometheus
+    assert 'cost_dollars_total{stage="step1",model="unpriced-model"}' not in prometheus
+
+
+def test_cache_hits_are_not_billed(tmp_path):
+    recorder = MetricsRecorder()
+    cache = LLMCache(tmp_path / "cache.sqlite3")
+    client = MeteredOpenAIClient(CachedOpenAIClient(StubOpenAI(), cache), recorder, "step1")
+    try:
+        for _ in range(3):
+            client.chat.completions.create(model=STEP1_MODEL, messages=[{"role": "user", "content": "Clause"}])
+    finally:
+        cache.close()
+
+    summary = recorder.aggregate()["step1"]
+    assert summary["calls"] == 3 and summary["cache_hits"] == 2
+    assert summary["input_tokens"] == 100 and summary["output_tokens"] == 10
+    assert summary["cached_input_tokens"] == 200 and summary["cached_output_tokens"] == 20
+    assert summary["cost"] == pytest.approx(price(STEP1_MODEL, 100, 10))
+
+
+def test_hedge_losers_are_billed_but_not_counted_as_calls():
+    recorder = MetricsRecorder()
+    client = MeteredOpenAIClient(StubOpenAI(), recorder, "step1")
+    request = {"model": STEP1_MODEL, "messages": [{"role": "user", "content": "Clause"}]}
+    response = client.chat.completions.create(**request)
+    # ResilientOpenAIClient hands the dropped duplicate of a hedged call to this callback
+    client.record_hedge_loser(request, response, 0.5)
+
+    summary = aggregate(recorder.records)["step1"]
+    assert summary["calls"] == 1 and summary["hedge_losers"] == 1
+    assert summary["input_tokens"] == 200 and summary["output_tokens"] == 20
+    assert summary["cost"] == pytest.approx(price(STEP1_MODEL, 200, 20))
+    assert summary["latency_max"] < 0.5
+
+
+def test_report_price_is_unknown_when_a_step_is_unpriced():
+    # The PDF prints "n/a" for a None price
+    pytest.importorskip("reportlab")
+    pytest.importorskip("rapidfuzz")
+    pdf_step = importlib.import_module("4_PDF Generator")
+    steps = [{"cost": 0.5}, {"cost": None}, {"cost": 1.0}]
+    assert pdf_step.calculate_steps_price(steps, [None] * 3) is None
+    assert pdf_step.calculate_steps_price([steps[0], steps[2]], [None] * 2) == pytest.approx(1.5)
@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from prompt_registry import MISSING_PROMPT, SYSTEM_PROMPT, LocalPrompt, PromptRegistry, load_snapshot, write_snapshot
+
+TEMPLATES = {
+    SYSTEM_PROMPT: "You review NDAs.",
+    MISSING_PROMPT: "Is {{input_clause}} in {{ retrieved_clauses }}?",
+}
+
+
+class FakeOpik:
+    """get_prompt() like Opik's client; counts the lookups and fails while down is set."""
+
+    def __init__(self, templates=TEMPLATES):
+        self.templates = dict(templates)
+        self.lookups = 0
+        self.down = False
+
+    def get_prompt(self, name):
+        self.lookups += 1
+        if self.down:
+            raise ConnectionError("Opik unreachable")
+        if name not in self.templates:
+            return None
+        return LocalPrompt(name, self.templates[name], commit=f"commit-{self.lookups}")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_prompts_are_served_from_memory_until_the_ttl_expires():
+    opik, clock = FakeOpik(), FakeClock()
+    registry = PromptRegistry(opik, ttl_seconds=60, clock=clock)
+
+    assert registry.format(MISSING_PROMPT, input_clause="the term", retrieved_clauses="the NDA") == \
+        "Is the term in the NDA?"
+    clock.now += 59
+    registry.get_prompt(MISSING_PROMPT)
+    assert opik.lookups == 1
+
+    opik.templates[MISSING_PROMPT] = "Is {{input_clause}} missing?"
+    clock.now += 2
+    assert registry.format(MISSING_PROMPT, input_clause="the term") == "Is the term missing?"
+    assert opik.lookups == 2
+
+
+def test_an_unreachable_opik_falls_back_to_the_snapshot(tmp_path):
+    snapshot = write_snapshot(tmp_path / "prompts.json", FakeOpik(), names=TEMPLATES)
+    opik = FakeOpik()
+    opik.down = True
+    registry = PromptRegistry(opik, snapshot_path=snapshot)
+    assert registry.format(SYSTEM_PROMPT) == "You review NDAs."
+
+    # Without a snapshot the error reaches the caller
+    with pytest.raises(ConnectionError):
+        PromptRegistry(opik).get_prompt(SYSTEM_PROMPT)
+
+
+def test_offline_registries_never_contact_opik(tmp_path):
+    snapshot = write_snapshot(tmp_path / "prompts.json", FakeOpik(), names=TEMPLATES)
+    opik, clock = FakeOpik(), FakeClock()
+    registry = PromptRegistry(opik, ttl_seconds=1, snapshot_path=snapshot, offline=True, clock=clock)
+    registry.preload([SYSTEM_PROMPT, MISSING_PROMPT])
+    clock.now += 3600
+    assert registry.get_prompt(SYSTEM_PROMPT).prompt == "You review NDAs."
+    assert opik.lookups == 0
+    with pytest.raises(KeyError):
+        registry.get_prompt("Not in the snapshot")
+    with pytest.raises(ValueError):
+        PromptRegistry(offline=True)
+
+
+def test_snapshots_keep_the_templates_and_commits(tmp_path):
+    path = write_snapshot(tmp_path / "snapshots" / "prompts.json", FakeOpik(), names=TEMPLATES)
+    data = json.loads(path.read_text(encoding="utf-8"))
+    assert data["version"] == 1 and set(data["prompts"]) == set(TEMPLATES)
+
+    prompts = load_snapshot(path)
+    assert prompts[MISSING_PROMPT].prompt == TEMPLATES[MISSING_PROMPT]
+    assert prompts[MISSING_PROMPT].commit == "commit-2"
+    # An unknown placeholder is left as it is, like Opik's mustache rendering
+    assert prompts[MISSING_PROMPT].format(input_clause="x") == "Is x in {{ retrieved_clauses }}?"
+
+    with pytest.raises(KeyError):
+        write_snapshot(tmp_path / "incomplete.json", FakeOpik(), names=[SYSTEM_PROMPT, "Unknown prompt"])
@@ -0,0 +1,99 @@
+import importlib
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# 1_V3_RAG imports the embedding model, FAISS, the OpenAI and Opik clients and the document IR at module level
+for module in ("sentence_transformers", "numpy", "faiss", "openai", "dotenv", "opik", "streamlit", "docx",
+               "tiktoken"):
+    pytest.importorskip(module)
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+import faiss
+import numpy as np
+
+rag_step = importlib.import_module("1_V3_RAG")
+
+# Template clauses and paragraphs as fixed unit vectors: clause "present" is paragraph 0 (score 1.0),
+# "absent" matches nothing (0.0), "unclear" is in between (0.6)
+EMBEDDINGS = {
+    "Paragraph about the term.": [1.0, 0.0, 0.0],
+    "Paragraph about the law.": [0.0, 1.0, 0.0],
+    "present": [1.0, 0.0, 0.0],
+    "absent": [0.0, 0.0, 1.0],
+    "unclear": [0.6, 0.0, 0.8],
+}
+
+
+@pytest.mark.parametrize("scores, min_score, max_drop, k", [
+    ([], 0.5, 0.1, 0),
+    ([0.9, 0.8, 0.7], None, None, 3),
+    # The top hit is kept even below min_score
+    ([0.3, 0.2], 0.5, None, 1),
+    ([0.9, 0.6, 0.55, 0.4], 0.5, None, 3),
+    # max_drop is relative to the top hit: 0.9 * (1 - 0.1) = 0.81
+    ([0.9, 0.85, 0.81, 0.8], None, 0.1, 3),
+    ([0.9, 0.5, 0.89], None, 0.1, 1),
+    # Both limits, the stricter one wins
+    ([0.9, 0.85, 0.7, 0.65], 0.68, 0.1, 2),
+    ([0.9, 0.85, 0.7, 0.65], 0.8, 0.5, 2),
+])
+def test_choose_k(scores, min_score, max_drop, k):
+    assert rag_step.choose_k(scores, min_score, max_drop) == k
+
+
+class FakeEmbeddingModel:
+    def encode(self, texts, **kwargs):
+        return np.array([EMBEDDINGS[text] for text in texts], dtype=np.float32)
+
+
+class FakePrompts:
+    def format(self, name, /, **kwargs):
+        return f"{name}: {kwargs}"
+
+
+class StubOpenAI:
+    def __init__(self):
+        self.requests = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.requests.append(kwargs)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(finish_reason="stop", message=SimpleNamespace(content="Entailment"))],
+            usage=SimpleNamespace(prompt_tokens=100, completion_tokens=1, total_tokens=101),
+        )
+
+
+def test_identify_missing_clauses_answers_clear_cut_clauses_from_the_score(tmp_path):
+    template_path = tmp_path / "template.json"
+    template_path.write_text(json.dumps({"Term": {"present": "present", "absent": "absent", "unclear": "unclear"}}),
+                             encoding="utf-8")
+    paragraphs = ["Paragraph about the term.", "Paragraph about the law."]
+    model = FakeEmbeddingModel()
+    index = faiss.IndexFlatIP(3)
+    index.add(model.encode(paragraphs))
+    client = StubOpenAI()
+
+    clauses, token_usage = rag_step.identify_missing_clauses(
+        index, paragraphs, template_path, model, client, None, "gpt-4.1-2025-04-14", retrieved_k=2,
+        prompts=FakePrompts(), entail_above=0.9, missing_below=0.3,
+    )
+    answers = {clause.clause_subname: (clause.answer, clause.answer_source) for clause in clauses}
+    assert answers == {
+        "present": ("entailment", rag_step.THRESHOLD_ANSWER),
+        "absent": ("missing", rag_step.THRESHOLD_ANSWER),
+        "unclear": ("Entailment", rag_step.LLM_ANSWER),
+    }
+    assert len(client.requests) == 1 and "unclear" in client.requests[0]["messages"][1]["content"]
+    assert token_usage["input_tokens"] == 100
+
+    # Without thresholds every clause is sent to the LLM
+    client = StubOpenAI()
+    rag_step.identify_missing_clauses(index, paragraphs, template_path, model, client, None, "gpt-4.1-2025-04-14",
+                                      retrieved_k=2, prompts=FakePrompts())
+    assert len(client.requests) == 3
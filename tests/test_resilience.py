@@ -0,0 +1,105 @@
+import os
+import sys
+import time
+
+import pytest
+
+openai = pytest.importorskip("openai")
+# metrics.py prices the calls with token_budget, which needs tiktoken
+pytest.importorskip("tiktoken")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from fake_openai_server import start_fake_server
+from llm_executor import run_concurrently
+from metrics import MeteredOpenAIClient, MetricsRecorder, percentile
+from resilience import HEDGE_MIN_SAMPLES, DeadlineExceeded, ResilientOpenAIClient, RetryPolicy
+
+MESSAGES = [{"role": "user", "content": "Is the clause entailed?"}]
+
+
+def fake_client(base_url):
+    # The SDK's own retries would hide the ones under test
+    return openai.OpenAI(base_url=base_url, api_key="fake", max_retries=0)
+
+
+def test_server_errors_are_retried_until_max_retries():
+    server, base_url = start_fake_server(error_rate=1.0)
+    client = ResilientOpenAIClient(fake_client(base_url), RetryPolicy(max_retries=2, base_delay=0.01))
+    try:
+        with pytest.raises(openai.APIStatusError) as raised:
+            client.chat.completions.create(model="fake-model", messages=MESSAGES)
+    finally:
+        client.close()
+        server.shutdown()
+    assert raised.value.retries == 2
+    assert server.faults["requests"] == 3
+    assert client.stats["retries"] == 2
+
+
+def test_retried_call_reports_its_retries():
+    server, base_url = start_fake_server(error_rate=0.5, seed=3)
+    recorder = MetricsRecorder()
+    client = ResilientOpenAIClient(fake_client(base_url), RetryPolicy(max_retries=10, base_delay=0.01))
+    metered = MeteredOpenAIClient(client, recorder, "step1")
+    try:
+        for _ in range(10):
+            metered.chat.completions.create(model="fake-model", messages=MESSAGES)
+    finally:
+        client.close()
+        server.shutdown()
+    summary = recorder.aggregate()["step1"]
+    assert summary["calls"] == 10 and summary["errors"] == 0
+    assert summary["retries"] == server.faults["errors"] > 0
+
+
+def test_no_attempt_runs_past_the_deadline():
+    server, base_url = start_fake_server(latency=2.0)
+    client = ResilientOpenAIClient(fake_client(base_url), RetryPolicy(max_retries=5, deadline=0.5))
+    start_time = time.perf_counter()
+    try:
+        with pytest.raises((openai.APITimeoutError, DeadlineExceeded)):
+            client.chat.completions.create(model="fake-model", messages=MESSAGES)
+    finally:
+        elapsed = time.perf_counter() - start_time
+        server.shutdown()
+    assert elapsed < 1.5
+    assert client.stats["deadline_exceeded"] == 1
+
+
+def test_hedging_cuts_the_tail_and_bills_the_dropped_duplicates():
+    latency, slow_latency = 0.05, 1.5
+    server, base_url = start_fake_server(latency=latency, slow_latency=slow_latency, seed=7)
+    recorder = MetricsRecorder()
+    # Hedged at the median: with 10% stragglers, the p95 of the recent latencies would soon be a straggler's
+    policy = RetryPolicy(hedge=True, hedge_quantile=0.5, hedge_min_delay=0.2)
+    client = ResilientOpenAIClient(fake_client(base_url), policy)
+    metered = MeteredOpenAIClient(client, recorder, "step1")
+    client.on_hedge_loser = metered.record_hedge_loser
+
+    def call(i):
+        return metered.chat.completions.create(model="fake-model", messages=MESSAGES)
+
+    try:
+        # The hedge delay is only known after HEDGE_MIN_SAMPLES calls at normal latency
+        run_concurrently(call, range(HEDGE_MIN_SAMPLES), 4)
+        server.slow_rate = 0.1
+        run_concurrently(call, range(60), 4)
+    finally:
+        # Waits for the dropped duplicates, so their usage is recorded
+        client.close()
+        server.shutdown()
+
+    calls = [entry for entry in recorder.records if not entry["hedge_loser"]]
+    losers = [entry for entry in recorder.records if entry["hedge_loser"]]
+    assert server.faults["slow"] > 0
+    assert client.stats["hedges"] > 0 and client.stats["hedge_wins"] > 0
+    # A straggler is answered by its duplicate instead of after slow_latency
+    assert percentile([entry["latency_seconds"] for entry in calls], 0.95) < slow_latency / 2
+
+    summary = recorder.aggregate()["step1"]
+    assert summary["calls"] == HEDGE_MIN_SAMPLES + 60
+    assert summary["hedge_losers"] == len(losers) == client.stats["hedge_losers"] > 0
+    # Every request that reached the endpoint is billed, including the dropped duplicates
+    assert len(recorder.records) == server.faults["requests"]
+    assert summary["input_tokens"] == sum(entry["input_tokens"] for entry in recorder.records)
@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from scheduler import StageScheduler
+
+
+def test_stages_run_after_their_dependencies_and_get_only_their_results():
+    order, lock = [], threading.Lock()
+
+    def stage(name, value):
+        def run(dependencies):
+            with lock:
+                order.append(name)
+            return value, dependencies
+        return run
+
+    scheduler = StageScheduler()
+    scheduler.add_stage("document", stage("document", 1))
+    scheduler.add_stage("index", stage("index", 2), depends_on=["document"])
+    scheduler.add_stage("additional", stage("additional", 3), depends_on=["document"])
+    scheduler.add_stage("retrieval", stage("retrieval", 4), depends_on=["index"])
+    results, timings = scheduler.run()
+
+    assert order[0] == "document" and order.index("index") < order.index("retrieval")
+    assert results["retrieval"] == (4, {"index": results["index"]})
+    assert results["additional"][1] == {"document": results["document"]}
+    assert set(timings) == {"document", "index", "additional", "retrieval"}
+    assert not scheduler.failed.is_set()
+
+
+def test_independent_stages_overlap():
+    scheduler = StageScheduler()
+    for name in ("a", "b", "c"):
+        scheduler.add_stage(name, lambda _: time.sleep(0.2))
+    start = time.perf_counter()
+    scheduler.run()
+    assert time.perf_counter() - start < 0.5
+
+
+def test_unknown_or_duplicate_stages_are_rejected():
+    scheduler = StageScheduler().add_stage("document", lambda _: None)
+    with pytest.raises(ValueError, match="unknown stage"):
+        scheduler.add_stage("index", lambda _: None, depends_on=["segments"])
+    with pytest.raises(ValueError, match="already registered"):
+        scheduler.add_stage("document", lambda _: None)
+
+
+def test_a_failure_stops_dependents_and_flags_the_running_stages():
+    scheduler = StageScheduler()
+    started = []
+    seen_failure = threading.Event()
+
+    def failing(_):
+        raise RuntimeError("step 3 failed")
+
+    def long_running(_):
+        # Like step 1, which skips step 2 once another stage has failed
+        if scheduler.failed.wait(5):
+            seen_failure.set()
+        return "partial"
+
+    scheduler.add_stage("document", lambda _: "document")
+    scheduler.add_stage("additional", failing, depends_on=["document"])
+    scheduler.add_stage("missing_and_deviating", long_running, depends_on=["document"])
+    scheduler.add_stage("report", lambda _: started.append("report"), depends_on=["missing_and_deviating"])
+
+    with pytest.raises(RuntimeError, match="step 3 failed"):
+        scheduler.run()
+    assert seen_failure.is_set()
+    assert started == []
+    assert scheduler.failed.is_set()
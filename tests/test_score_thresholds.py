@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from score_thresholds import ENTAILMENT, MISSING, _lowest_threshold, evaluate, fit_thresholds, score_answer
+
+E, M = ENTAILMENT, MISSING
+
+
+@pytest.mark.parametrize("score, entail_above, missing_below, answer", [
+    (0.95, None, None, None),
+    (None, 0.9, 0.3, M),
+    (None, None, None, None),
+    (0.95, 0.9, 0.3, E),
+    (0.9, 0.9, 0.3, E),
+    (0.5, 0.9, 0.3, None),
+    (0.3, 0.9, 0.3, None),
+    (0.29, 0.9, 0.3, M),
+    (0.1, 0.9, None, None),
+    (0.95, None, 0.3, None),
+])
+def test_score_answer(score, entail_above, missing_below, answer):
+    assert score_answer(score, entail_above, missing_below) == answer
+
+
+@pytest.mark.parametrize("samples, precision, min_support, threshold", [
+    ([], 1.0, 1, None),
+    ([(0.9, E), (0.8, E), (0.7, M)], 1.0, 1, 0.8),
+    # Tied scores are decided together: 0.8 can't be a threshold, one of its samples is missing
+    ([(0.9, E), (0.8, E), (0.8, M), (0.7, E)], 1.0, 1, 0.9),
+    ([(0.9, E), (0.8, E)], 1.0, 3, None),
+    ([(0.9, E), (0.8, E)], 1.0, 2, 0.8),
+    ([(0.9, E), (0.8, M), (0.7, E), (0.6, E), (0.5, M)], 0.75, 1, 0.6),
+    # Clauses without retrieved paragraphs have no score to separate
+    ([(None, E), (0.9, E), (0.8, E)], 1.0, 3, None),
+])
+def test_lowest_threshold(samples, precision, min_support, threshold):
+    assert _lowest_threshold(samples, E, precision, min_support) == threshold
+
+
+def test_fit_thresholds_rounds_the_margin_towards_the_ambiguous_band():
+    samples = [(0.9, E), (0.85, E), (0.81234, E), (0.6, M), (0.55, E), (0.31234, M), (0.25, M), (0.2, M)]
+    entail_above, missing_below = fit_thresholds(samples, precision=1.0, margin=0.02, min_support=3)
+    assert (entail_above, missing_below) == (0.8324, 0.2923)
+    # The margin leaves the samples at the fitted boundaries (0.81234, 0.31234) to the LLM
+    assert evaluate(samples, entail_above, missing_below) == {"clauses": 8, "calls_saved": 4, "errors": 0,
+                                                              "saved_share": 0.5}
+
+
+def test_fit_thresholds_without_support():
+    samples = [(0.9, E), (0.2, M)]
+    assert fit_thresholds(samples, min_support=3) == (None, None)
+    assert fit_thresholds(samples, margin=0, min_support=1) == (0.9, 0.2)
@@ -0,0 +1,114 @@
+import os
+import sys
+
+import pytest
+
+# document.py reads .docx files and hashes them with embedding_cache, which imports numpy and faiss
+pytest.importorskip("docx")
+pytest.importorskip("numpy")
+pytest.importorskip("faiss")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from document import DocumentIR, DocumentParagraph
+from segmentation import SIGNATURE_LINE_MAX_WORDS, is_signature, segment_document
+
+
+def document(*paragraphs):
+    """A DocumentIR from (text, numbering, list_level, style) tuples; missing fields are None."""
+    parsed = []
+    for i, paragraph in enumerate(paragraphs):
+        text, numbering, list_level, style = (tuple(paragraph) + (None,) * 3)[:4]
+        parsed.append(DocumentParagraph(f"p{i:04d}", text, 0, len(text), numbering, list_level, style))
+    return DocumentIR("contract.docx", "0" * 64, parsed)
+
+
+def texts(segments):
+    return [segment.text for segment in segments]
+
+
+def test_numbered_clauses_absorb_their_continuations():
+    segments, report = segment_document(document(
+        ("2.1 The Receiving Party shall keep the information secret, except:", "2.1"),
+        ("(a) information that is already public;", "a"),
+        ("(b) information required to be disclosed by law.", "b"),
+        ("2.2 The obligations survive the termination of this Agreement.", "2.2"),
+        ("Each Party may disclose information to its advisers on a need to know basis.",),
+        ("Nested list entries belong to the paragraph before them as well.", None, 1),
+    ))
+    assert texts(segments) == [
+        "2.1 The Receiving Party shall keep the information secret, except:\n"
+        "(a) information that is already public;\n(b) information required to be disclosed by law.",
+        "2.2 The obligations survive the termination of this Agreement.",
+        "Each Party may disclose information to its advisers on a need to know basis.\n"
+        "Nested list entries belong to the paragraph before them as well.",
+    ]
+    assert [segment.paragraph_ids for segment in segments][0] == ["p0000", "p0001", "p0002"]
+    assert segments[1].numbering == "2.2"
+    assert report["merged_paragraphs"] == 3
+
+
+def test_headings_boilerplate_and_signature_blocks_are_dropped():
+    segments, report = segment_document(document(
+        ("MUTUAL NON-DISCLOSURE AGREEMENT",),
+        ("Confidentiality of all exchanged information", None, None, "Heading 1"),
+        ("1. The parties shall keep all exchanged information strictly confidential.", "1"),
+        ("Page 1 of 3",),
+        ("IN WITNESS WHEREOF the parties have signed this Agreement.",),
+        ("For and on behalf of Acme Ltd.",),
+        ("By: ____________________",),
+        ("Jane Doe",),
+        ("Chief Executive Officer",),
+        ("Place, date: Zurich, 1 May 2025",),
+    ))
+    assert texts(segments) == ["1. The parties shall keep all exchanged information strictly confidential."]
+    assert report["dropped"]["heading"] == 2
+    assert report["dropped"]["boilerplate"] == 2
+    assert report["dropped"]["signature"] == 5
+
+
+@pytest.mark.parametrize("text, signature", [
+    ("By: Jane Doe", True),
+    ("Name: Jane Doe, Chief Executive Officer of Acme Holding Ltd., Zurich, Switzerland", True),
+    ("__________________", True),
+    ("Signed for Acme Ltd.", True),
+    ("Signature", True),
+    ("Signed copies of this Agreement shall be exchanged by e-mail and are as valid as the original.", False),
+    ("Signature of this Agreement does not oblige either party to enter into any further transaction.", False),
+    ("For and on behalf of the Disclosing Party, its Affiliates may also disclose Confidential Information.", False),
+])
+def test_signature_lines_are_short_or_labels(text, signature):
+    assert is_signature(text) is signature
+
+
+def test_a_clause_starting_like_a_signature_is_kept():
+    clause = "Signed copies of this Agreement shall be exchanged by e-mail and are as valid as the original."
+    assert len(clause.split()) > SIGNATURE_LINE_MAX_WORDS
+    segments, report = segment_document(document((clause,)))
+    assert texts(segments) == [clause]
+    assert report["dropped"]["signature"] == 0
+
+
+def test_fragments_and_near_duplicates_are_dropped():
+    clause = "The Receiving Party shall not disclose any Confidential Information to third parties without consent."
+    segments, report = segment_document(document(
+        (clause,),
+        ("See above.",),
+        (clause.replace("any", "the"),),
+        ("The Agreement is governed by Swiss law and the courts of Zurich have exclusive jurisdiction.",),
+    ), duplicate_threshold=0.5)
+    assert texts(segments) == [
+        clause, "The Agreement is governed by Swiss law and the courts of Zurich have exclusive jurisdiction."
+    ]
+    assert report["dropped"]["fragment"] == 1
+    assert report["dropped"]["duplicate"] == 1
+
+
+def test_units_are_capped_at_max_unit_chars():
+    items = [(f"({letter}) item {letter} of the list of permitted disclosures;", letter) for letter in "abcdef"]
+    segments, _ = segment_document(document(("3. Permitted disclosures are the following:", "3"), *items),
+                                   max_unit_chars=150)
+    assert len(segments) > 1
+    assert all(len(segment.text) <= 150 for segment in segments)
+    # Nothing is lost, the overflow starts a new unit
+    assert sum(len(segment.paragraph_ids) for segment in segments) == 7
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("tiktoken")
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from Class_RetrievedClause import RetrievedClause
+from token_budget import TOKENS_PER_RETRIEVED_CLAUSE, count_tokens, get_encoding, trim_retrieved_context
+
+MODEL = "gpt-4.1-2025-04-14"
+
+
+@pytest.fixture(autouse=True)
+def encoding():
+    # tiktoken downloads its encodings on first use
+    try:
+        get_encoding(MODEL)
+    except Exception as e:
+        pytest.skip(f"tiktoken encoding not available: {e!r}")
+
+
+def retrieved_clause(*paragraphs):
+    clause = RetrievedClause("Confidentiality", "Term", "The obligations last two years.")
+    clause.retrieved_clauses = [(text, 0.9 - i * 0.1) for i, text in enumerate(paragraphs)]
+    return clause
+
+
+def test_trimmed_copy_fits_the_budget_and_the_clause_is_unchanged():
+    paragraphs = [" ".join(["secret"] * 300), " ".join(["party"] * 300), " ".join(["term"] * 300)]
+    clause = retrieved_clause(*paragraphs)
+    budget = 400
+
+    trimmed = trim_retrieved_context(clause, budget, MODEL)
+    used = sum(count_tokens(text, MODEL) + TOKENS_PER_RETRIEVED_CLAUSE for text, _ in trimmed.retrieved_clauses)
+    assert used <= budget
+    assert [score for _, score in trimmed.retrieved_clauses] == [0.9, pytest.approx(0.8)]
+    assert trimmed.retrieved_clauses[0][0] == paragraphs[0]
+    # Step 2 compares the template clause with the full best paragraph, not the trimmed prompt context
+    assert clause.retrieved_clauses == [(text, score) for text, score in zip(paragraphs, [0.9, 0.8, 0.7])]
+    assert trimmed.input_clause == clause.input_clause
+
+
+def test_the_top_paragraph_is_kept_even_over_budget():
+    clause = retrieved_clause(" ".join(["secret"] * 500), "short")
+    trimmed = trim_retrieved_context(clause, 50, MODEL)
+    assert len(trimmed.retrieved_clauses) == 1
+    assert 0 < count_tokens(trimmed.retrieved_clauses[0][0], MODEL) <= 50
+    assert clause.retrieved_clauses[0][0] == " ".join(["secret"] * 500)
+
+
+def test_no_budget_keeps_everything():
+    clause = retrieved_clause("a", "b")
+    assert trim_retrieved_context(clause, 0, MODEL) is clause
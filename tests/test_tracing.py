@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from tracing import DROP_NEWEST, DROP_OLDEST, TraceExporter
+
+# Longer than any test: the exporter only ships a batch when it is full, flushed or closed
+IDLE = 60.0
+
+
+class StubSink:
+    def __init__(self, fail=False):
+        self.batches = []
+        self.closed = False
+        self.fail = fail
+
+    def export(self, spans):
+        if self.fail:
+            raise ConnectionError("sink unreachable")
+        self.batches.append([span["name"] for span in spans])
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.mark.parametrize("drop_policy, kept", [(DROP_OLDEST, ["s2", "s3", "s4"]), (DROP_NEWEST, ["s0", "s1", "s2"])])
+def test_a_full_buffer_drops_by_policy(drop_policy, kept):
+    sink = StubSink()
+    exporter = TraceExporter(sink, max_buffer=3, batch_size=10, flush_interval=IDLE, drop_policy=drop_policy)
+    for i in range(5):
+        exporter.trace(f"s{i}")
+    assert exporter.close()
+    assert sink.batches == [kept]
+    assert exporter.stats == {"recorded": 5, "exported": 3, "dropped": 2, "failed": 0}
+
+
+def test_full_batches_are_exported_without_a_flush():
+    sink = StubSink()
+    exporter = TraceExporter(sink, batch_size=2, flush_interval=IDLE)
+    for i in range(4):
+        exporter.trace(f"s{i}")
+    try:
+        assert wait_for(lambda: exporter.stats["exported"] == 4)
+        assert [name for batch in sink.batches for name in batch] == ["s0", "s1", "s2", "s3"]
+        assert all(len(batch) <= 2 for batch in sink.batches)
+    finally:
+        exporter.close()
+
+
+def test_close_flushes_the_rest_and_closes_the_sink():
+    sink = StubSink()
+    exporter = TraceExporter(sink, batch_size=10, flush_interval=IDLE)
+    exporter.trace("s0", input="prompt", output="entailment", thread_id="run-1")
+    exporter.trace("s1")
+    assert sink.batches == []
+
+    assert exporter.close()
+    assert sink.batches == [["s0", "s1"]] and sink.closed
+    exporter.trace("late")
+    assert exporter.stats["dropped"] == 1 and exporter.stats["exported"] == 2
+
+
+def test_a_failing_sink_only_loses_its_batch():
+    exporter = TraceExporter(StubSink(fail=True), batch_size=10, flush_interval=IDLE)
+    exporter.trace("s0")
+    assert exporter.close()
+    assert exporter.stats["failed"] == 1 and exporter.stats["exported"] == 0
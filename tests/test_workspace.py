@@ -0,0 +1,37 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "V3_Frontend")))
+
+from workspace import cleanup_workspaces, create_workspace, list_workspaces
+
+
+def test_cleanup_removes_old_workspaces_only(tmp_path):
+    old = create_workspace(tmp_path, run_id="old")
+    # update() stamps updated_at itself; backdate the metadata by hand
+    old_metadata = old.metadata()
+    old_metadata["updated_at"] = time.time() - 10 * 3600
+    old.write_json("workspace.json", old_metadata)
+    recent = create_workspace(tmp_path, run_id="recent")
+    foreign = tmp_path / "someone-elses-dir"
+    foreign.mkdir()
+    (foreign / "notes.txt").write_text("not a workspace")
+    os.utime(foreign, (0, 0))
+
+    assert [workspace.run_id for workspace in list_workspaces(tmp_path)] == ["old", "recent"]
+    removed = cleanup_workspaces(tmp_path, max_age_hours=1)
+    assert [workspace.run_id for workspace in removed] == ["old"]
+    assert not old.path.exists() and recent.path.exists()
+    assert (foreign / "notes.txt").read_text() == "not a workspace"
+
+
+def test_keep_limits_the_workspaces_and_spares_excluded_ones(tmp_path):
+    for run_id in ("a", "b", "c"):
+        create_workspace(tmp_path, run_id=run_id)
+        time.sleep(0.01)
+    (tmp_path / "foreign").mkdir()
+
+    removed = cleanup_workspaces(tmp_path, max_age_hours=None, keep=1, exclude=("a",))
+    assert [workspace.run_id for workspace in removed] == ["b"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "c", "foreign"]